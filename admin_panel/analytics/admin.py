@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils import timezone
+from apex_admin.export import stream_csv
 from .models import Dashboard, Metric, DashboardMetric, Report, ReportExecution, AnalyticsEvent
 
 
@@ -293,8 +294,12 @@ class AnalyticsEventAdmin(admin.ModelAdmin):
     actions = ['export_events', 'clear_old_events']
     
     def export_events(self, request, queryset):
-        """Экспорт событий"""
-        self.message_user(request, f'Экспорт подготовлен для {queryset.count()} событий.')
+        """Экспорт событий (потоковый CSV)"""
+        return stream_csv(queryset, [
+            'timestamp', 'event_type', 'landing_id', 'value', 'session_id', 'user_id',
+            'ip_address', 'country', 'city', 'device_type', 'browser', 'os',
+            'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'event_data'
+        ], 'events')
     export_events.short_description = 'Экспорт событий'
     
     def clear_old_events(self, request, queryset):
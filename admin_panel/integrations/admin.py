@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils import timezone
+from apex_admin.export import stream_csv
 from .models import APIIntegration, IntegrationLog, WebhookEvent
 
 
@@ -129,8 +130,10 @@ class IntegrationLogAdmin(admin.ModelAdmin):
     actions = ['export_logs']
     
     def export_logs(self, request, queryset):
-        """Экспорт логов"""
-        self.message_user(request, f'Экспорт подготовлен для {queryset.count()} логов.')
+        """Экспорт логов (потоковый CSV)"""
+        return stream_csv(queryset, [
+            'timestamp', 'integration__name', 'level', 'message', 'data'
+        ], 'integration-logs')
     export_logs.short_description = 'Экспорт логов'
 
 
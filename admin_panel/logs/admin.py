@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils import timezone
+from apex_admin.export import stream_csv
 from .models import SystemLog, NotificationTemplate, NotificationLog, SecurityLog
 
 
@@ -66,8 +67,11 @@ class SystemLogAdmin(admin.ModelAdmin):
     actions = ['export_logs', 'clear_old_logs']
     
     def export_logs(self, request, queryset):
-        """Экспорт логов"""
-        self.message_user(request, f'Экспорт подготовлен для {queryset.count()} логов.')
+        """Экспорт логов (потоковый CSV)"""
+        return stream_csv(queryset, [
+            'timestamp', 'level', 'log_type', 'source', 'message', 'user__username',
+            'ip_address', 'landing_id', 'integration_id', 'data'
+        ], 'system-logs')
     export_logs.short_description = 'Экспорт логов'
     
     def clear_old_logs(self, request, queryset):
@@ -0,0 +1,26 @@
+"""Add indexes on leads amoCRM ids for batched webhook lookups
+
+Revision ID: 20251017000001
+Revises: 20250101000000
+Create Date: 2025-10-17 00:00:01.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000001'
+down_revision: Union[str, None] = '20250101000000'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_leads_amocrm_lead_id'), 'leads', ['amocrm_lead_id'], unique=False)
+    op.create_index(op.f('ix_leads_amocrm_contact_id'), 'leads', ['amocrm_contact_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_leads_amocrm_contact_id'), table_name='leads')
+    op.drop_index(op.f('ix_leads_amocrm_lead_id'), table_name='leads')
@@ -0,0 +1,41 @@
+"""Add webhook_queue table for fast-ack webhook mode
+
+Revision ID: 20251017000002
+Revises: 20251017000001
+Create Date: 2025-10-17 00:00:02.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000002'
+down_revision: Union[str, None] = '20251017000001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('webhook_queue',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('account_id', sa.String(length=100), nullable=True),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_webhook_queue_id'), 'webhook_queue', ['id'], unique=False)
+    op.create_index('ix_webhook_queue_status_id', 'webhook_queue', ['status', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_webhook_queue_status_id', table_name='webhook_queue')
+    op.drop_index(op.f('ix_webhook_queue_id'), table_name='webhook_queue')
+    op.drop_table('webhook_queue')
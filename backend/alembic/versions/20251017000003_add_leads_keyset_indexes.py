@@ -0,0 +1,26 @@
+"""Add composite (created_at, id) indexes on leads for keyset pagination
+
+Revision ID: 20251017000003
+Revises: 20251017000002
+Create Date: 2025-10-17 00:00:03.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000003'
+down_revision: Union[str, None] = '20251017000002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_leads_created_at_id', 'leads', ['created_at', 'id'], unique=False)
+    op.create_index('ix_leads_status_created_at_id', 'leads', ['status', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_leads_status_created_at_id', table_name='leads')
+    op.drop_index('ix_leads_created_at_id', table_name='leads')
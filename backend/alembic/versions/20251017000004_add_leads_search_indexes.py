@@ -0,0 +1,57 @@
+"""Add full-text search indexes on leads (name, email, phone)
+
+PostgreSQL: GIN tsvector and pg_trgm indexes over the same expressions
+as app/services/lead_search.py. SQLite: FTS5 table with sync triggers
+(same DDL as app/models/lead.py).
+
+Revision ID: 20251017000004
+Revises: 20251017000003
+Create Date: 2025-10-17 00:00:04.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000004'
+down_revision: Union[str, None] = '20251017000003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_TEXT = "coalesce(name, '') || ' ' || coalesce(email, '') || ' ' || coalesce(phone, '')"
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(
+            f"CREATE INDEX ix_leads_search_tsv ON leads "
+            f"USING gin (to_tsvector('simple'::regconfig, {SEARCH_TEXT}))"
+        )
+        op.execute(
+            f"CREATE INDEX ix_leads_search_trgm ON leads "
+            f"USING gin (({SEARCH_TEXT}) gin_trgm_ops)"
+        )
+
+    elif dialect == 'sqlite':
+        from app.models.lead import LEADS_FTS_DDL
+        for statement in LEADS_FTS_DDL:
+            op.execute(statement)
+        # Индексация существующих строк
+        op.execute("INSERT INTO leads_fts(leads_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.drop_index('ix_leads_search_trgm', table_name='leads')
+        op.drop_index('ix_leads_search_tsv', table_name='leads')
+
+    elif dialect == 'sqlite':
+        for trigger in ('leads_fts_au', 'leads_fts_ad', 'leads_fts_ai'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS leads_fts")
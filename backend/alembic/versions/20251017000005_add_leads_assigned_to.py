@@ -0,0 +1,27 @@
+"""Add leads.assigned_to for per-user analytics and filters
+
+Revision ID: 20251017000005
+Revises: 20251017000004
+Create Date: 2025-10-17 00:00:05.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000005'
+down_revision: Union[str, None] = '20251017000004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('leads', sa.Column('assigned_to', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_leads_assigned_to'), 'leads', ['assigned_to'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_leads_assigned_to'), table_name='leads')
+    op.drop_column('leads', 'assigned_to')
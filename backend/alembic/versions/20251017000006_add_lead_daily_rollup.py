@@ -0,0 +1,45 @@
+"""Add lead_daily_rollup table and backfill it from leads
+
+Revision ID: 20251017000006
+Revises: 20251017000005
+Create Date: 2025-10-17 00:00:06.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000006'
+down_revision: Union[str, None] = '20251017000005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('lead_daily_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('source', sa.String(length=100), nullable=False),
+    sa.Column('utm_source', sa.String(length=100), nullable=False),
+    sa.Column('utm_medium', sa.String(length=100), nullable=False),
+    sa.Column('utm_campaign', sa.String(length=100), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('leads_count', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'source', 'utm_source', 'utm_medium', 'utm_campaign', 'status')
+    )
+    # Первичное заполнение; дальше агрегат поддерживается приложением
+    op.execute(
+        "INSERT INTO lead_daily_rollup "
+        "(day, source, utm_source, utm_medium, utm_campaign, status, leads_count, revenue) "
+        "SELECT date(created_at), coalesce(source, ''), coalesce(utm_source, ''), "
+        "coalesce(utm_medium, ''), coalesce(utm_campaign, ''), coalesce(status, ''), "
+        "count(id), coalesce(sum(revenue), 0) "
+        "FROM leads WHERE created_at IS NOT NULL "
+        "GROUP BY 1, 2, 3, 4, 5, 6"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('lead_daily_rollup')
@@ -0,0 +1,28 @@
+"""Add created_at/updated_at indexes for incremental analytics engine loads
+
+Revision ID: 20251017000007
+Revises: 20251017000006
+Create Date: 2025-10-17 00:00:07.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000007'
+down_revision: Union[str, None] = '20251017000006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_leads_updated_at', 'leads', ['updated_at'], unique=False)
+    op.create_index('ix_deals_created_at', 'deals', ['created_at'], unique=False)
+    op.create_index('ix_deals_updated_at', 'deals', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deals_updated_at', table_name='deals')
+    op.drop_index('ix_deals_created_at', table_name='deals')
+    op.drop_index('ix_leads_updated_at', table_name='leads')
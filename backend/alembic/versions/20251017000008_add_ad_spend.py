@@ -0,0 +1,34 @@
+"""Add ad_spend table for daily advertising costs
+
+Revision ID: 20251017000008
+Revises: 20251017000007
+Create Date: 2025-10-17 00:00:08.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000008'
+down_revision: Union[str, None] = '20251017000007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('ad_spend',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('utm_source', sa.String(length=100), nullable=False),
+    sa.Column('utm_campaign', sa.String(length=100), nullable=False),
+    sa.Column('cost', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('day', 'utm_source', 'utm_campaign')
+    )
+    op.create_index('ix_ad_spend_updated_at', 'ad_spend', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ad_spend_updated_at', table_name='ad_spend')
+    op.drop_table('ad_spend')
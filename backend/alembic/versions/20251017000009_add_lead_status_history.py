@@ -0,0 +1,36 @@
+"""Add append-only lead_status_history table
+
+Revision ID: 20251017000009
+Revises: 20251017000008
+Create Date: 2025-10-17 00:00:09.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '20251017000009'
+down_revision: Union[str, None] = '20251017000008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('lead_status_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('lead_id', sa.Integer(), nullable=False),
+    sa.Column('from_status', sa.String(length=50), nullable=True),
+    sa.Column('to_status', sa.String(length=50), nullable=False),
+    sa.Column('changed_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('source', sa.String(length=20), nullable=False),
+    sa.ForeignKeyConstraint(['lead_id'], ['leads.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_lead_status_history_lead_id_changed_at', 'lead_status_history', ['lead_id', 'changed_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_lead_status_history_lead_id_changed_at', table_name='lead_status_history')
+    op.drop_table('lead_status_history')
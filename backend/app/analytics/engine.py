@@ -0,0 +1,503 @@
+"""
+Колоночный in-memory движок аналитики лидов и сделок
+
+Факты лидов и сделок хранятся в памяти процесса как NumPy массивы:
+created_at - int64 (микросекунды UTC), source/status/UTM - коды словаря
+(int32), суммы - float64. Строки упорядочены по id, поэтому обновление
+строки и связь сделки с лидом - это searchsorted.
+
+Массивы обновляются в фоне (run) инкрементально: загружаются строки с
+updated_at/created_at не старше водяного знака (с перекрытием на
+задержку коммитов) и новые id (лиды из webhook приходят с прошлым
+created_at и пустым updated_at). Удаления инкрементально не видны, поэтому раз в
+analytics_engine_full_refresh_interval данные перезагружаются целиком.
+
+CPL/CR/ROI и разбивки за произвольный период считаются масками и
+bincount без обращения к БД на пути запроса.
+"""
+
+import asyncio
+import calendar
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from app.core.cache import invalidate_cache
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.deal import Deal
+from app.models.lead import Lead
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - движок отключается, расчеты идут через БД
+    np = None
+
+LEAD_DIMENSIONS = ("source", "utm_source", "utm_medium", "utm_campaign", "status")
+
+
+def to_epoch_us(value: Optional[datetime]) -> int:
+    """datetime -> микросекунды UTC (naive считается UTC, как в БД)"""
+    if value is None:
+        return 0
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return calendar.timegm(value.timetuple()) * 1_000_000 + value.microsecond
+
+
+class Dictionary:
+    """Словарное кодирование строк; код 0 - NULL"""
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]
+        self.codes: Dict[Optional[str], int] = {None: 0}
+
+    def encode(self, value: Optional[str]) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def code(self, value: Optional[str]) -> Optional[int]:
+        """Код без добавления; None - значения нет в данных"""
+        return self.codes.get(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class FactTable:
+    """Растущая колоночная таблица, строки упорядочены по id"""
+
+    __slots__ = ("dtypes", "columns", "size")
+
+    def __init__(self, dtypes: Dict[str, str], capacity: int = 1024):
+        self.dtypes = dict(dtypes, id="int64")
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.dtypes.items()}
+        self.size = 0
+
+    def column(self, name: str):
+        return self.columns[name][:self.size]
+
+    def upsert(self, values: Dict[str, Any]):
+        """Вставка/обновление пачки строк (values - массивы одинаковой длины, ключ "id")"""
+        ids = values["id"]
+        if len(ids) == 0:
+            return
+
+        # Последняя версия строки в пачке побеждает; пачка - в порядке id
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        last = np.append(ids[1:] != ids[:-1], True)
+        order = order[last]
+        ids = ids[last]
+        values = {name: np.asarray(column)[order] for name, column in values.items()}
+
+        current = self.column("id")
+        positions = np.searchsorted(current, ids)
+        exists = positions < self.size
+        exists[exists] = current[positions[exists]] == ids[exists]
+
+        for name, column in values.items():
+            self.columns[name][positions[exists]] = column[exists]
+
+        new = ~exists
+        if not new.any():
+            return
+
+        appended = {name: column[new] for name, column in values.items()}
+        if self.size and appended["id"][0] < current[-1]:
+            # Редкий случай (id из поздно закоммиченной транзакции): слияние с пересортировкой
+            merged = {
+                name: np.concatenate([self.column(name), appended[name]]) for name in self.dtypes
+            }
+            order = np.argsort(merged["id"], kind="stable")
+            self._replace({name: column[order] for name, column in merged.items()})
+            return
+
+        count = len(appended["id"])
+        self._reserve(self.size + count)
+        for name in self.dtypes:
+            self.columns[name][self.size:self.size + count] = appended[name]
+        self.size += count
+
+    def _reserve(self, size: int):
+        capacity = len(self.columns["id"])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def _replace(self, columns: Dict[str, Any]):
+        size = len(columns["id"])
+        self.columns = {}
+        capacity = max(1024, size)
+        for name, dtype in self.dtypes.items():
+            column = np.zeros(capacity, dtype=dtype)
+            column[:size] = columns[name]
+            self.columns[name] = column
+        self.size = size
+
+
+class _Facts:
+    """Данные одного поколения: таблицы лидов, сделок и словари"""
+
+    __slots__ = ("leads", "deals", "dictionaries", "deal_statuses", "lead_order", "lead_times", "by_time")
+
+    def __init__(self):
+        self.leads = FactTable({
+            "created_at": "int64",
+            **{name: "int32" for name in LEAD_DIMENSIONS},
+            "revenue": "float64",
+        })
+        self.deals = FactTable({
+            "lead_id": "int64",
+            "created_at": "int64",
+            "status": "int32",
+            "amount": "float64",
+        })
+        self.dictionaries = {name: Dictionary() for name in LEAD_DIMENSIONS}
+        self.deal_statuses = Dictionary()
+        self.lead_order = np.zeros(0, dtype=np.int64)
+        self.lead_times = np.zeros(0, dtype=np.int64)
+        self.by_time: Dict[str, Any] = {name: np.zeros(0, dtype=np.int32) for name in LEAD_DIMENSIONS}
+
+    def reindex(self):
+        """
+        Копии колонок измерений в порядке created_at
+
+        Период - непрерывный срез (searchsorted по lead_times), фильтры
+        сравнивают только его, без маски по всем строкам и без gather.
+        """
+        created_at = self.leads.column("created_at")
+        self.lead_order = np.argsort(created_at, kind="stable")
+        self.lead_times = created_at[self.lead_order]
+        self.by_time = {name: self.leads.column(name)[self.lead_order] for name in LEAD_DIMENSIONS}
+
+
+class AnalyticsEngine:
+    """Колоночные факты лидов и сделок с инкрементальным обновлением"""
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        overlap: Optional[float] = None,
+        full_refresh_interval: Optional[float] = None
+    ):
+        self.batch_size = batch_size or settings.analytics_engine_batch_size
+        self.overlap = timedelta(seconds=settings.analytics_engine_overlap if overlap is None else overlap)
+        self.full_refresh_interval = (
+            settings.analytics_engine_full_refresh_interval if full_refresh_interval is None else full_refresh_interval
+        )
+        self._facts: Optional[_Facts] = None
+        self._lock = threading.RLock()
+        self._lead_watermark: Optional[datetime] = None
+        self._deal_watermark: Optional[datetime] = None
+        self._loaded_at = 0.0
+        self.refreshes = 0
+        self.last_refresh_seconds = 0.0
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    @property
+    def ready(self) -> bool:
+        """Данные загружены хотя бы один раз"""
+        return self._facts is not None
+
+    # Загрузка
+
+    def refresh(self, db: Session, full: bool = False) -> int:
+        """Догрузка изменений с водяного знака (или полная перезагрузка); число строк"""
+        if not self.available:
+            return 0
+        started = time.perf_counter()
+        if full or self._facts is None or time.monotonic() - self._loaded_at >= self.full_refresh_interval:
+            facts = _Facts()
+            rows = self._load(db, facts, None, None)
+            with self._lock:
+                self._facts = facts
+                self._loaded_at = time.monotonic()
+        else:
+            rows = self._load(db, self._facts, self._lead_watermark, self._deal_watermark)
+
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - started
+        if rows:
+            # Результаты, посчитанные по прежним массивам (в т.ч. сразу после
+            # коммита, до догрузки), больше не актуальны
+            invalidate_cache("leads", "deals")
+        return rows
+
+    def _load(self, db: Session, facts: _Facts, lead_since: Optional[datetime], deal_since: Optional[datetime]) -> int:
+        lead_query = select(
+            Lead.id, Lead.created_at, Lead.updated_at, *(getattr(Lead, name) for name in LEAD_DIMENSIONS), Lead.revenue
+        )
+        if lead_since is not None:
+            since = lead_since - self.overlap
+            lead_query = lead_query.where(or_(
+                Lead.id > _max_id(facts.leads), Lead.updated_at >= since, Lead.created_at >= since
+            ))
+
+        deal_query = select(Deal.id, Deal.lead_id, Deal.created_at, Deal.updated_at, Deal.status, Deal.amount)
+        if deal_since is not None:
+            since = deal_since - self.overlap
+            deal_query = deal_query.where(or_(
+                Deal.id > _max_id(facts.deals), Deal.updated_at >= since, Deal.created_at >= since
+            ))
+
+        # Новое поколение недоступно читателям и заполняется по мере чтения курсора;
+        # изменения текущего копятся и применяются под блокировкой вместе с reindex
+        live = facts is self._facts
+        pending: List[Tuple[FactTable, Dict[str, Any]]] = []
+
+        rows = 0
+        lead_watermark = lead_since
+        for batch in self._batches(db, lead_query.order_by(Lead.id)):
+            rows += len(batch)
+            lead_watermark = _max_watermark(lead_watermark, batch, (1, 2))
+            arrays = self._lead_arrays(facts, batch)
+            if live:
+                pending.append((facts.leads, arrays))
+            else:
+                facts.leads.upsert(arrays)
+
+        deal_watermark = deal_since
+        for batch in self._batches(db, deal_query.order_by(Deal.id)):
+            rows += len(batch)
+            deal_watermark = _max_watermark(deal_watermark, batch, (2, 3))
+            arrays = self._deal_arrays(facts, batch)
+            if live:
+                pending.append((facts.deals, arrays))
+            else:
+                facts.deals.upsert(arrays)
+
+        if pending or not live:
+            with self._lock:
+                for table, arrays in pending:
+                    table.upsert(arrays)
+                facts.reindex()
+
+        self._lead_watermark = lead_watermark
+        self._deal_watermark = deal_watermark
+        return rows
+
+    def _batches(self, db: Session, query) -> Iterable[List[Tuple]]:
+        result = db.execute(query.execution_options(yield_per=self.batch_size))
+        for partition in result.partitions():
+            yield partition
+
+    def _lead_arrays(self, facts: _Facts, batch: List[Tuple]) -> Dict[str, Any]:
+        # (id, created_at, updated_at, source, utm_source, utm_medium, utm_campaign, status, revenue)
+        arrays = {
+            "id": np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch)),
+            "created_at": np.fromiter((to_epoch_us(row[1]) for row in batch), dtype=np.int64, count=len(batch)),
+            "revenue": np.fromiter((row[8] or 0.0 for row in batch), dtype=np.float64, count=len(batch)),
+        }
+        # Словари только дополняются, поэтому кодирование не мешает читателям
+        for offset, name in enumerate(LEAD_DIMENSIONS, start=3):
+            encode = facts.dictionaries[name].encode
+            arrays[name] = np.fromiter((encode(row[offset]) for row in batch), dtype=np.int32, count=len(batch))
+        return arrays
+
+    def _deal_arrays(self, facts: _Facts, batch: List[Tuple]) -> Dict[str, Any]:
+        # (id, lead_id, created_at, updated_at, status, amount); NULL amount - NaN, как NULL в AVG/SUM
+        encode = facts.deal_statuses.encode
+        statuses = np.fromiter((encode(row[4]) for row in batch), dtype=np.int32, count=len(batch))
+        return {
+            "id": np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch)),
+            "lead_id": np.fromiter((row[1] for row in batch), dtype=np.int64, count=len(batch)),
+            "created_at": np.fromiter((to_epoch_us(row[2]) for row in batch), dtype=np.int64, count=len(batch)),
+            "status": statuses,
+            "amount": np.fromiter(
+                (np.nan if row[5] is None else row[5] for row in batch), dtype=np.float64, count=len(batch)
+            ),
+        }
+
+    async def run(self, session_factory: Callable, stop_event: asyncio.Event, interval: Optional[float] = None):
+        """Фоновое обновление: полная загрузка при старте, затем догрузка раз в interval"""
+        interval = interval or settings.analytics_engine_refresh_interval
+        while not stop_event.is_set():
+            try:
+                await asyncio.to_thread(self._refresh_with_session, session_factory)
+            except Exception as e:
+                logger.error(f"Error refreshing analytics engine: {str(e)}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _refresh_with_session(self, session_factory: Callable):
+        db = session_factory()
+        try:
+            self.refresh(db)
+        finally:
+            db.close()
+
+    # Расчеты
+
+    def _range_mask(self, created_at, start_date: Optional[datetime], end_date: Optional[datetime]):
+        mask = np.ones(len(created_at), dtype=bool)
+        if start_date is not None:
+            mask &= created_at >= to_epoch_us(start_date)
+        if end_date is not None:
+            mask &= created_at <= to_epoch_us(end_date)
+        return mask
+
+    def _lead_window(self, facts: _Facts, start_date, end_date, filters: Dict[str, Optional[str]]):
+        """
+        Срез лидов периода в порядке created_at и маска фильтров по нему
+
+        mask None - фильтров нет; срез пустой, если значение фильтра не
+        встречается в данных.
+        """
+        low = 0 if start_date is None else int(np.searchsorted(facts.lead_times, to_epoch_us(start_date), side="left"))
+        high = (
+            len(facts.lead_times) if end_date is None
+            else int(np.searchsorted(facts.lead_times, to_epoch_us(end_date), side="right"))
+        )
+        mask = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            code = facts.dictionaries[name].code(value)
+            if code is None:
+                return slice(0, 0), None
+            matches = facts.by_time[name][low:high] == code
+            mask = matches if mask is None else mask & matches
+        return slice(low, max(low, high)), mask
+
+    def count_leads(
+        self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, **filters: Optional[str]
+    ) -> int:
+        """Количество лидов за период (created_at в [start_date, end_date])"""
+        with self._lock:
+            window, mask = self._lead_window(self._facts, start_date, end_date, filters)
+            return window.stop - window.start if mask is None else int(np.count_nonzero(mask))
+
+    def leads_by(
+        self,
+        dimension: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        **filters: Optional[str]
+    ) -> Dict[Optional[str], int]:
+        """Количество лидов по значениям измерения (без нулевых)"""
+        with self._lock:
+            facts = self._facts
+            window, mask = self._lead_window(facts, start_date, end_date, filters)
+            codes = facts.by_time[dimension][window]
+            if mask is not None:
+                codes = codes[mask]
+            dictionary = facts.dictionaries[dimension]
+            counts = np.bincount(codes, minlength=len(dictionary))
+            return {dictionary.values[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+
+    def deal_totals(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        status: Optional[str] = None,
+        utm_source: Optional[str] = None
+    ) -> Tuple[int, float]:
+        """Количество сделок и сумма amount за период (utm_source - по лиду сделки)"""
+        with self._lock:
+            facts = self._facts
+            deals = facts.deals
+            mask = self._range_mask(deals.column("created_at"), start_date, end_date)
+            if status is not None:
+                code = facts.deal_statuses.code(status)
+                if code is None:
+                    return 0, 0.0
+                mask &= deals.column("status") == code
+            if utm_source is not None:
+                code = facts.dictionaries["utm_source"].code(utm_source)
+                if code is None:
+                    return 0, 0.0
+                lead_codes = self._deal_lead_values(facts, facts.leads.column("utm_source"))
+                mask &= lead_codes == code
+            return int(np.count_nonzero(mask)), float(np.nansum(deals.column("amount")[mask]))
+
+    def source_statistics(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Лиды периода по utm_source и средняя сумма их сделок"""
+        with self._lock:
+            facts = self._facts
+            dictionary = facts.dictionaries["utm_source"]
+            window, _ = self._lead_window(facts, start_date, end_date, {})
+            leads_count = np.bincount(facts.by_time["utm_source"][window], minlength=len(dictionary))
+            lead_mask = np.zeros(facts.leads.size, dtype=bool)
+            lead_mask[facts.lead_order[window]] = True
+            lead_sources = facts.leads.column("utm_source")
+
+            # Сделки лидов периода: код источника и признак "лид в периоде" через строку лида
+            deal_sources = self._deal_lead_values(facts, lead_sources)
+            deal_in_period = self._deal_lead_values(facts, lead_mask, missing=False)
+            amounts = facts.deals.column("amount")
+            deal_mask = deal_in_period & ~np.isnan(amounts)
+            amount_sum = np.bincount(deal_sources[deal_mask], weights=amounts[deal_mask], minlength=len(dictionary))
+            amount_count = np.bincount(deal_sources[deal_mask], minlength=len(dictionary))
+
+            return [
+                {
+                    "source": dictionary.values[code],
+                    "leads_count": int(leads_count[code]),
+                    "avg_deal_amount": float(amount_sum[code] / amount_count[code]) if amount_count[code] else 0
+                }
+                for code in np.flatnonzero(leads_count)
+                if dictionary.values[code]
+            ]
+
+    def _deal_lead_values(self, facts: _Facts, lead_values, missing=0):
+        """Значение колонки лида для каждой сделки (missing - лид не загружен)"""
+        lead_ids = facts.leads.column("id")
+        deal_lead_ids = facts.deals.column("lead_id")
+        positions = np.searchsorted(lead_ids, deal_lead_ids)
+        found = positions < len(lead_ids)
+        found[found] = lead_ids[positions[found]] == deal_lead_ids[found]
+        values = np.full(len(deal_lead_ids), missing, dtype=lead_values.dtype)
+        values[found] = lead_values[positions[found]]
+        return values
+
+    def stats(self) -> Dict[str, Any]:
+        """Размер данных и время последнего обновления"""
+        facts = self._facts
+        return {
+            "available": self.available,
+            "ready": self.ready,
+            "leads": facts.leads.size if facts else 0,
+            "deals": facts.deals.size if facts else 0,
+            "refreshes": self.refreshes,
+            "last_refresh_seconds": round(self.last_refresh_seconds, 6),
+            "lead_watermark": self._lead_watermark.isoformat() if self._lead_watermark else None,
+        }
+
+
+def _max_id(table: FactTable) -> int:
+    return int(table.column("id")[-1]) if table.size else 0
+
+
+def _max_watermark(current: Optional[datetime], batch: List[Tuple], columns: Tuple[int, int]) -> Optional[datetime]:
+    """Максимум created_at/updated_at (индексы колонок columns) с учетом текущего знака"""
+    for row in batch:
+        for index in columns:
+            value = row[index]
+            if value is not None and (current is None or value > current):
+                current = value
+    return current
+
+
+# Глобальный экземпляр, обновляется в фоне (см. lifespan в app/main.py)
+analytics_engine = AnalyticsEngine()
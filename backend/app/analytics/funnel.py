@@ -0,0 +1,239 @@
+"""
+Воронка лидов по журналу смен статуса (lead_status_history)
+
+Когорта - лиды, созданные в окне (и назначенные пользователю). Лиды и их
+смены статуса читаются одним запросом (LEFT JOIN), дальше все считается
+векторно по массивам NumPy:
+
+- визиты стадий: вход в начальный статус - created_at лида, затем каждая
+  смена статуса; выход - следующая смена того же лида;
+- стадия достигнута, если лид был на ней или на более поздней стадии
+  FUNNEL_STAGES (конверсия стадия -> следующая стадия);
+- время на стадии - перцентили завершенных визитов;
+- первый ответ - от created_at до первой смены статуса;
+- время конверсии - от created_at до первого входа в CONVERTED_STATUSES.
+
+Результаты кэшируются по окну когорты (app.core.cache, тег "leads").
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.analytics.engine import Dictionary, to_epoch_us
+from app.core.cache import cached
+from app.core.config import settings
+from app.models.lead import Lead
+from app.models.lead_status_history import LeadStatusHistory
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - метрики времени не считаются
+    np = None
+
+FUNNEL_STAGES = ("new", "contacted", "qualified", "proposal", "negotiation", "closed_won")
+CONVERTED_STATUSES = ("qualified", "closed_won")
+PERCENTILES = (50, 90, 95)
+
+US_PER_HOUR = 3_600_000_000
+
+
+def _hours(values) -> Optional[float]:
+    return round(float(values) / US_PER_HOUR, 3) if values is not None else None
+
+
+def _summary(durations, percentiles: Iterable[int] = PERCENTILES) -> Dict[str, Any]:
+    """Количество, среднее и перцентили длительностей (часы)"""
+    if not len(durations):
+        return {"count": 0, "avg_hours": None, **{f"p{p}_hours": None for p in percentiles}}
+    values = np.percentile(durations, percentiles)
+    return {
+        "count": int(len(durations)),
+        "avg_hours": _hours(durations.mean()),
+        **{f"p{p}_hours": _hours(value) for p, value in zip(percentiles, values)},
+    }
+
+
+class CohortFacts:
+    """Массивы когорты: лиды по id и их смены статуса в порядке времени"""
+
+    __slots__ = ("statuses", "created", "current", "history_lead", "history_from", "history_to", "history_time")
+
+    def __init__(self):
+        self.statuses = Dictionary()
+        self.created = None
+        self.current = None
+        # Индекс лида в массивах лидов
+        self.history_lead = None
+        self.history_from = None
+        self.history_to = None
+        self.history_time = None
+
+    @property
+    def size(self) -> int:
+        return len(self.created)
+
+
+class FunnelAnalytics:
+    """Метрики воронки для когорты лидов"""
+
+    def __init__(self, db: Session, stages: Tuple[str, ...] = FUNNEL_STAGES,
+                 converted_statuses: Tuple[str, ...] = CONVERTED_STATUSES):
+        self.db = db
+        self.stages = stages
+        self.converted_statuses = converted_statuses
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def default_window(self) -> Tuple[datetime, datetime]:
+        """Окно когорты по умолчанию: последние analytics_funnel_window_days дней"""
+        end_date = datetime.utcnow()
+        return end_date - timedelta(days=settings.analytics_funnel_window_days), end_date
+
+    # Загрузка
+
+    def load(self, start_date: Optional[datetime], end_date: Optional[datetime],
+             user_id: Optional[int] = None) -> CohortFacts:
+        """Лиды когорты и их журнал статусов одним запросом"""
+        query = (
+            select(
+                Lead.id, Lead.created_at, Lead.status,
+                LeadStatusHistory.from_status, LeadStatusHistory.to_status, LeadStatusHistory.changed_at
+            )
+            .outerjoin(LeadStatusHistory, LeadStatusHistory.lead_id == Lead.id)
+            .where(Lead.created_at.isnot(None))
+            .order_by(Lead.id, LeadStatusHistory.changed_at, LeadStatusHistory.id)
+        )
+        if start_date is not None:
+            query = query.where(Lead.created_at >= start_date)
+        if end_date is not None:
+            query = query.where(Lead.created_at <= end_date)
+        if user_id is not None:
+            query = query.where(Lead.assigned_to == user_id)
+
+        facts = CohortFacts()
+        encode = facts.statuses.encode
+        created: List[int] = []
+        current: List[int] = []
+        history_lead: List[int] = []
+        history_from: List[int] = []
+        history_to: List[int] = []
+        history_time: List[int] = []
+
+        last_id = None
+        for lead_id, created_at, status, from_status, to_status, changed_at in self.db.execute(query):
+            if lead_id != last_id:
+                last_id = lead_id
+                created.append(to_epoch_us(created_at))
+                current.append(encode(status))
+            if to_status is not None:
+                history_lead.append(len(created) - 1)
+                history_from.append(encode(from_status))
+                history_to.append(encode(to_status))
+                history_time.append(to_epoch_us(changed_at))
+
+        facts.created = np.array(created, dtype=np.int64)
+        facts.current = np.array(current, dtype=np.int32)
+        facts.history_lead = np.array(history_lead, dtype=np.int64)
+        facts.history_from = np.array(history_from, dtype=np.int32)
+        facts.history_to = np.array(history_to, dtype=np.int32)
+        facts.history_time = np.array(history_time, dtype=np.int64)
+        return facts
+
+    # Расчет
+
+    def compute(self, facts: CohortFacts) -> Dict[str, Any]:
+        """Конверсия по стадиям, время на стадиях, первый ответ и время конверсии"""
+        leads = facts.size
+        statuses = facts.statuses
+
+        # Начальный статус: from_status первой смены (если есть), иначе текущий
+        changed_leads, first_change = np.unique(facts.history_lead, return_index=True)
+        initial = facts.current.copy()
+        first_from = facts.history_from[first_change]
+        known = first_from != 0
+        initial[changed_leads[known]] = first_from[known]
+
+        # Визиты стадий в порядке (лид, время): начальный, затем смены
+        visit_lead = np.concatenate([np.arange(leads), facts.history_lead])
+        visit_status = np.concatenate([initial, facts.history_to])
+        visit_time = np.concatenate([facts.created, facts.history_time])
+        sequence = np.concatenate([np.zeros(leads, dtype=np.int64), np.arange(1, len(facts.history_lead) + 1)])
+        order = np.lexsort((sequence, visit_lead))
+        visit_lead, visit_status, visit_time = visit_lead[order], visit_status[order], visit_time[order]
+
+        # Длительность завершенных визитов (до следующей смены того же лида)
+        completed = np.zeros(len(visit_lead), dtype=bool)
+        completed[:-1] = visit_lead[1:] == visit_lead[:-1]
+        durations = np.zeros(len(visit_lead), dtype=np.int64)
+        durations[:-1] = visit_time[1:] - visit_time[:-1]
+        durations = np.maximum(durations, 0)
+
+        time_in_stage = {}
+        for status_code in np.unique(visit_status[completed]):
+            if status_code:
+                mask = completed & (visit_status == status_code)
+                time_in_stage[statuses.values[status_code]] = _summary(durations[mask])
+
+        # Достигнутая стадия: максимальный ранг среди визитов лида
+        rank = np.full(len(statuses), -1, dtype=np.int64)
+        for index, stage in enumerate(self.stages):
+            stage_code = statuses.code(stage)
+            if stage_code is not None:
+                rank[stage_code] = index
+        max_rank = np.full(leads, -1, dtype=np.int64)
+        np.maximum.at(max_rank, visit_lead, rank[visit_status])
+        at_rank = np.bincount(max_rank + 1, minlength=len(self.stages) + 1)[1:]
+        reached = np.cumsum(at_rank[::-1])[::-1]
+
+        stages = []
+        for index, stage in enumerate(self.stages):
+            following = reached[index + 1] if index + 1 < len(self.stages) else None
+            stages.append({
+                "stage": stage,
+                "reached": int(reached[index]),
+                "conversion_to_next": (
+                    round(float(following) / float(reached[index]) * 100, 2)
+                    if following is not None and reached[index] else None
+                ),
+            })
+
+        # Первый ответ: от создания до первой смены статуса
+        first_response = np.maximum(
+            facts.history_time[first_change] - facts.created[changed_leads], 0
+        )
+
+        # Время конверсии: от создания до первого входа в конверсионный статус
+        converted_codes = [statuses.code(status) for status in self.converted_statuses]
+        converted = np.isin(visit_status, [code for code in converted_codes if code is not None])
+        no_conversion = np.iinfo(np.int64).max
+        first_conversion = np.full(leads, no_conversion, dtype=np.int64)
+        np.minimum.at(first_conversion, visit_lead[converted], visit_time[converted])
+        converted_leads = first_conversion != no_conversion
+        time_to_convert = np.maximum(first_conversion[converted_leads] - facts.created[converted_leads], 0)
+
+        return {
+            "cohort_size": leads,
+            "status_changes": int(len(facts.history_lead)),
+            "stages": stages,
+            "time_in_stage": time_in_stage,
+            "first_response": _summary(first_response),
+            "time_to_convert": _summary(time_to_convert),
+        }
+
+    @cached("funnel", tags=("leads",))
+    def cohort_metrics(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                       user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Метрики воронки когорты лидов, созданных в окне (None - без NumPy)"""
+        if not self.available:
+            return None
+        result = self.compute(self.load(start_date, end_date, user_id))
+        result["window"] = {
+            "start": start_date.isoformat() if start_date else None,
+            "end": end_date.isoformat() if end_date else None,
+        }
+        return result
@@ -4,33 +4,40 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
 from app.models.lead import Lead
 from app.models.deal import Deal
+from app.models.lead_daily_rollup import LeadDailyRollup
+from app.analytics.engine import AnalyticsEngine, analytics_engine
+from app.analytics.rollup import count_leads, day_bounds, rollup_query
+from app.analytics.spend import SpendIndex, ad_spend
+from app.core.cache import cached, not_error
+from app.core.config import settings
 from app.core.logging import logger
 
 class AnalyticsCalculator:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, engine: Optional[AnalyticsEngine] = None, spend: Optional[SpendIndex] = None):
         self.db = db
+        if engine is None and settings.analytics_engine_enabled:
+            engine = analytics_engine
+        self.engine = engine
+        self.spend = spend or ad_spend
     
+    @property
+    def _engine_ready(self) -> bool:
+        """Расчет по колоночному движку в памяти (иначе - запросы к БД)"""
+        return self.engine is not None and self.engine.ready
+    
+    @cached("cpl", tags=("leads", "deals", "spend"), should_cache=not_error)
     def calculate_cpl(self, start_date: datetime, end_date: datetime, utm_source: Optional[str] = None) -> Dict[str, Any]:
         """Расчет CPL (Cost Per Lead)"""
         try:
-            # Базовый запрос для лидов
-            query = self.db.query(Lead).filter(
-                and_(
-                    Lead.created_at >= start_date,
-                    Lead.created_at <= end_date
-                )
-            )
+            # Целые дни - как в агрегате лидов и расходах на рекламу
+            start_date, end_date = day_bounds(start_date, end_date)
             
-            # Фильтр по UTM source если указан
-            if utm_source:
-                query = query.filter(Lead.utm_source == utm_source)
-            
-            # Получаем данные
-            leads = query.all()
-            total_leads = len(leads)
+            # Количество лидов (с фильтром по UTM source)
+            if self._engine_ready:
+                total_leads = self.engine.count_leads(start_date, end_date, utm_source=utm_source or None)
+            else:
+                total_leads = count_leads(self.db, start_date, end_date, utm_source=utm_source or None)
             
-            # Здесь должна быть логика получения стоимости рекламы
-            # Пока используем фиксированную стоимость для демонстрации
             total_cost = self._get_advertising_cost(start_date, end_date, utm_source)
             
             cpl = total_cost / total_leads if total_leads > 0 else 0
@@ -58,25 +65,28 @@ class AnalyticsCalculator:
                 "error": str(e)
             }
     
+    @cached("conversion_rate", should_cache=not_error)
     def calculate_conversion_rate(self, start_date: datetime, end_date: datetime, pipeline_id: Optional[int] = None) -> Dict[str, Any]:
         """Расчет Conversion Rate"""
         try:
-            # Общее количество лидов
-            total_leads = self.db.query(Lead).filter(
-                and_(
-                    Lead.created_at >= start_date,
-                    Lead.created_at <= end_date
-                )
-            ).count()
+            # Лиды и сделки - за одни и те же целые дни (как в агрегате лидов)
+            start_date, end_date = day_bounds(start_date, end_date)
             
-            # Количество завершенных сделок
-            completed_deals = self.db.query(Deal).filter(
-                and_(
-                    Deal.created_at >= start_date,
-                    Deal.created_at <= end_date,
-                    Deal.status == "completed"
-                )
-            ).count()
+            if self._engine_ready:
+                total_leads = self.engine.count_leads(start_date, end_date)
+                completed_deals, _ = self.engine.deal_totals(start_date, end_date, status="completed")
+            else:
+                # Общее количество лидов
+                total_leads = count_leads(self.db, start_date, end_date)
+                
+                # Количество завершенных сделок
+                completed_deals = self.db.query(Deal).filter(
+                    and_(
+                        Deal.created_at >= start_date,
+                        Deal.created_at <= end_date,
+                        Deal.status == "completed"
+                    )
+                ).count()
             
             conversion_rate = (completed_deals / total_leads * 100) if total_leads > 0 else 0
             
@@ -99,23 +109,32 @@ class AnalyticsCalculator:
                 "error": str(e)
             }
     
+    @cached("roi", tags=("leads", "deals", "spend"), should_cache=not_error)
     def calculate_roi(self, start_date: datetime, end_date: datetime, utm_source: Optional[str] = None) -> Dict[str, Any]:
         """Расчет ROI (Return on Investment)"""
         try:
+            # Выручка - за те же целые дни, что и расходы на рекламу
+            start_date, end_date = day_bounds(start_date, end_date)
+            
             # Получаем доходы от сделок
-            revenue_query = self.db.query(func.sum(Deal.amount)).filter(
-                and_(
-                    Deal.created_at >= start_date,
-                    Deal.created_at <= end_date,
-                    Deal.status == "completed"
+            if self._engine_ready:
+                _, total_revenue = self.engine.deal_totals(
+                    start_date, end_date, status="completed", utm_source=utm_source or None
                 )
-            )
-            
-            if utm_source:
-                # Фильтруем по UTM source через связанные лиды
-                revenue_query = revenue_query.join(Lead, Deal.lead_id == Lead.id).filter(Lead.utm_source == utm_source)
-            
-            total_revenue = revenue_query.scalar() or 0
+            else:
+                revenue_query = self.db.query(func.sum(Deal.amount)).filter(
+                    and_(
+                        Deal.created_at >= start_date,
+                        Deal.created_at <= end_date,
+                        Deal.status == "completed"
+                    )
+                )
+                
+                if utm_source:
+                    # Фильтруем по UTM source через связанные лиды
+                    revenue_query = revenue_query.join(Lead, Deal.lead_id == Lead.id).filter(Lead.utm_source == utm_source)
+                
+                total_revenue = revenue_query.scalar() or 0
             
             # Получаем затраты на рекламу
             total_cost = self._get_advertising_cost(start_date, end_date, utm_source)
@@ -142,6 +161,7 @@ class AnalyticsCalculator:
                 "error": str(e)
             }
     
+    @cached("calculator_dashboard", tags=("leads", "deals", "spend"), should_cache=not_error)
     def get_dashboard_data(self, period: str = "7d") -> Dict[str, Any]:
         """Получение данных для дашборда"""
         try:
@@ -182,45 +202,32 @@ class AnalyticsCalculator:
             }
     
     def _get_advertising_cost(self, start_date: datetime, end_date: datetime, utm_source: Optional[str] = None) -> float:
-        """Получение стоимости рекламы (заглушка)"""
-        # В реальном проекте здесь должна быть интеграция с рекламными платформами
-        # Пока используем фиксированные значения для демонстрации
-        
-        base_cost = 1000  # Базовая стоимость в день
-        
-        days = (end_date - start_date).days
-        total_cost = base_cost * days
-        
-        if utm_source:
-            # Разные источники имеют разную стоимость
-            source_costs = {
-                "google": 1.2,
-                "facebook": 0.8,
-                "instagram": 0.9,
-                "yandex": 1.1
-            }
-            multiplier = source_costs.get(utm_source, 1.0)
-            total_cost *= multiplier
-        
-        return total_cost
+        """Расходы на рекламу за период (таблица ad_spend, префиксные суммы в памяти)"""
+        self.spend.ensure_loaded(self.db)
+        return round(self.spend.total(start_date, end_date, utm_source=utm_source or None), 2)
     
     def _get_source_breakdown(self, start_date: datetime, end_date: datetime) -> Dict[str, float]:
         """Разбивка по источникам трафика"""
         try:
-            sources = self.db.query(
-                Lead.utm_source,
-                func.count(Lead.id).label('count')
-            ).filter(
-                and_(
-                    Lead.created_at >= start_date,
-                    Lead.created_at <= end_date,
-                    Lead.utm_source.isnot(None)
-                )
-            ).group_by(Lead.utm_source).all()
+            if self._engine_ready:
+                sources = [
+                    (source, count)
+                    for source, count in self.engine.leads_by("utm_source", start_date, end_date).items()
+                    if source
+                ]
+            else:
+                sources = rollup_query(
+                    self.db,
+                    LeadDailyRollup.utm_source,
+                    func.sum(LeadDailyRollup.leads_count).label('count'),
+                    start_date=start_date,
+                    end_date=end_date
+                ).filter(LeadDailyRollup.utm_source != "").group_by(LeadDailyRollup.utm_source).all()
             
+            self.spend.ensure_loaded(self.db)
             breakdown = {}
             for source, count in sources:
-                cost = self._get_advertising_cost(start_date, end_date, source)
+                cost = self.spend.total(start_date, end_date, utm_source=source)
                 breakdown[source] = round(cost / count, 2) if count > 0 else 0
             
             return breakdown
@@ -232,6 +239,9 @@ class AnalyticsCalculator:
     def _get_source_statistics(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
         """Статистика по источникам"""
         try:
+            if self._engine_ready:
+                return self.engine.source_statistics(start_date, end_date)
+            
             stats = self.db.query(
                 Lead.utm_source,
                 func.count(Lead.id).label('leads_count'),
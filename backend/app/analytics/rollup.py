@@ -0,0 +1,109 @@
+"""
+Чтение и восстановление дневного агрегата лидов (lead_daily_rollup)
+
+Аналитика за период читает O(дней x измерений) строк агрегата вместо
+всех лидов периода. Границы периода округляются до дней: лид попадает в
+период, если день его создания лежит в [start_date, end_date].
+Расчеты, которые читают агрегат, приводят к целым дням и остальные
+источники периода (day_bounds), чтобы результат не зависел от пути.
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple, Union
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Query, Session
+
+from app.core.logging import logger
+from app.models.lead import Lead
+from app.models.lead_daily_rollup import ROLLUP_DIMENSIONS, LeadDailyRollup
+
+DateLike = Union[date, datetime]
+
+
+def _as_day(value: DateLike) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def day_bounds(start_date: DateLike, end_date: DateLike) -> Tuple[datetime, datetime]:
+    """Период, расширенный до целых дней: [начало первого дня, конец последнего]"""
+    return (
+        datetime.combine(_as_day(start_date), time.min, tzinfo=getattr(start_date, "tzinfo", None)),
+        datetime.combine(_as_day(end_date), time.max, tzinfo=getattr(end_date, "tzinfo", None)),
+    )
+
+
+def rollup_query(
+    db: Session,
+    *columns,
+    start_date: Optional[DateLike] = None,
+    end_date: Optional[DateLike] = None,
+    **dimensions: Optional[str]
+) -> Query:
+    """
+    Запрос к агрегату за период с фильтрами по измерениям
+
+    dimensions: source, utm_source, utm_medium, utm_campaign, status;
+    None - без фильтра по измерению.
+    """
+    query = db.query(*columns)
+    if start_date is not None:
+        query = query.filter(LeadDailyRollup.day >= _as_day(start_date))
+    if end_date is not None:
+        query = query.filter(LeadDailyRollup.day <= _as_day(end_date))
+    for name, value in dimensions.items():
+        if name not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"Unknown rollup dimension: {name}")
+        if value is not None:
+            query = query.filter(getattr(LeadDailyRollup, name) == value)
+    return query
+
+
+def count_leads(db: Session, start_date: DateLike, end_date: DateLike, **dimensions: Optional[str]) -> int:
+    """Количество лидов за период"""
+    total = rollup_query(
+        db, func.sum(LeadDailyRollup.leads_count), start_date=start_date, end_date=end_date, **dimensions
+    ).scalar()
+    return int(total or 0)
+
+
+def rebuild_lead_rollup(db: Session, start_date: Optional[DateLike] = None, end_date: Optional[DateLike] = None) -> int:
+    """
+    Пересчет агрегата по таблице leads (весь или за период)
+
+    Удаляет строки периода и вставляет их заново одним INSERT ... SELECT
+    в текущей транзакции; commit - за вызывающим. Возвращает число строк.
+    """
+    table = LeadDailyRollup.__table__
+    # Ключ строится по тем же правилам, что и при инкрементальном обновлении:
+    # NULL и '' попадают в одну строку
+    keys = [func.date(Lead.created_at)] + [func.coalesce(getattr(Lead, name), "") for name in ROLLUP_DIMENSIONS]
+
+    clear = delete(table)
+    source = select(
+        *keys,
+        func.count(Lead.id),
+        func.coalesce(func.sum(Lead.revenue), 0.0),
+    ).where(Lead.created_at.isnot(None))
+
+    if start_date is not None:
+        start_day = _as_day(start_date)
+        clear = clear.where(table.c.day >= start_day)
+        source = source.where(Lead.created_at >= datetime.combine(start_day, datetime.min.time()))
+    if end_date is not None:
+        end_day = _as_day(end_date)
+        clear = clear.where(table.c.day <= end_day)
+        source = source.where(Lead.created_at < datetime.combine(end_day + timedelta(days=1), datetime.min.time()))
+
+    source = source.group_by(*keys)
+
+    db.execute(clear)
+    db.execute(
+        insert(table).from_select(
+            ["day", *ROLLUP_DIMENSIONS, "leads_count", "revenue"], source
+        )
+    )
+
+    rows = rollup_query(db, func.count(LeadDailyRollup.day), start_date=start_date, end_date=end_date).scalar()
+    logger.info(f"Lead daily rollup rebuilt: {rows} rows ({start_date or 'all'} - {end_date or 'all'})")
+    return rows
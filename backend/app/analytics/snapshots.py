@@ -0,0 +1,243 @@
+"""
+Снимки дашборда аналитики с фоновым обновлением (stale-while-revalidate)
+
+Дашборды периодов (7d/30d/90d) пересчитываются в фоне раз в
+analytics_snapshot_refresh_interval (как refresh_interval дашборда в
+админке, 300 секунд), варианты для пользователя - по первому запросу и
+далее, пока их запрашивают. Запрос всегда получает последний снимок
+сразу; устаревший снимок обновляется асинхронно. Если пересчет падает
+(недоступна БД), продолжает отдаваться последний удачный снимок с его
+возрастом в заголовке Age.
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.analytics.metrics import AnalyticsCalculator
+from app.core.config import settings
+from app.core.logging import logger
+from app.services.analytics_service import AnalyticsService
+
+SnapshotKey = Tuple[str, Optional[int]]
+
+# Секунды между проверками устаревших снимков в фоне
+SCHEDULER_TICK = 30.0
+
+
+def build_dashboard(db: Session, period: str, user_id: Optional[int] = None) -> Dict[str, Any]:
+    """Дашборд периода; для user_id - с показателями лидов пользователя"""
+    data = AnalyticsCalculator(db).get_dashboard_data(period=period)
+    if user_id is not None and "error" not in data:
+        data = {
+            **data,
+            "user_id": user_id,
+            "user": AnalyticsService(db).get_dashboard_data(user_id=user_id).model_dump(mode="json"),
+        }
+    return data
+
+
+class DashboardSnapshot:
+    """Посчитанный дашборд и время расчета (time.time())"""
+
+    __slots__ = ("data", "computed_at", "requested_at", "refresh_failed")
+
+    def __init__(self, data: Dict[str, Any], computed_at: float):
+        self.data = data
+        self.computed_at = computed_at
+        self.requested_at = computed_at
+        # Последняя попытка обновления не удалась - отдается прежний снимок
+        self.refresh_failed = False
+
+    @property
+    def age(self) -> float:
+        return max(time.time() - self.computed_at, 0.0)
+
+
+class DashboardSnapshotService:
+    """Хранилище снимков дашборда и их фоновое обновление"""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable] = None,
+        periods: Optional[Tuple[str, ...]] = None,
+        refresh_interval: Optional[float] = None,
+        user_ttl: Optional[float] = None,
+        max_user_variants: Optional[int] = None
+    ):
+        self.session_factory = session_factory
+        self.periods = periods or tuple(
+            period.strip() for period in settings.analytics_snapshot_periods.split(",") if period.strip()
+        )
+        self.refresh_interval = refresh_interval or settings.analytics_snapshot_refresh_interval
+        self.user_ttl = user_ttl or settings.analytics_snapshot_user_ttl
+        self.max_user_variants = max_user_variants or settings.analytics_snapshot_max_users
+        self._snapshots: Dict[SnapshotKey, DashboardSnapshot] = {}
+        self._refreshing: Dict[SnapshotKey, asyncio.Task] = {}
+
+        # Статистика
+        self.served = 0
+        self.stale_served = 0
+        self.degraded_served = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_refresh_seconds = 0.0
+
+    def is_stale(self, snapshot: DashboardSnapshot) -> bool:
+        return snapshot.age >= self.refresh_interval
+
+    # Расчет
+
+    def compute(self, period: str, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """Синхронный расчет дашборда в собственной сессии (в потоке пула)"""
+        session_factory = self.session_factory
+        if session_factory is None:
+            from app.core.db import SessionLocal
+            session_factory = SessionLocal
+        db = session_factory()
+        try:
+            data = build_dashboard(db, period, user_id)
+        finally:
+            db.close()
+        # Калькулятор возвращает ошибку в ответе - для снимка это неудачный пересчет
+        if "error" in data:
+            raise RuntimeError(data["error"])
+        return data
+
+    async def _refresh(self, key: SnapshotKey) -> DashboardSnapshot:
+        started = time.perf_counter()
+        try:
+            data = await asyncio.to_thread(self.compute, *key)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            previous = self._snapshots.get(key)
+            if previous is not None:
+                previous.refresh_failed = True
+            logger.error(f"Error refreshing dashboard snapshot {key}: {str(e)}")
+            raise
+
+        snapshot = DashboardSnapshot(data, time.time())
+        previous = self._snapshots.get(key)
+        if previous is not None:
+            snapshot.requested_at = previous.requested_at
+        self._snapshots[key] = snapshot
+        self.refreshes += 1
+        self.last_refresh_seconds = time.perf_counter() - started
+        return snapshot
+
+    def _start_refresh(self, key: SnapshotKey) -> asyncio.Task:
+        """Пересчет ключа; одновременные запросы ждут одну задачу"""
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda done: self._finish_refresh(key, done))
+        return task
+
+    def _finish_refresh(self, key: SnapshotKey, task: asyncio.Task):
+        if self._refreshing.get(key) is task:
+            del self._refreshing[key]
+        if not task.cancelled():
+            # Ошибка уже учтена в _refresh; фоновой задаче ее некому вернуть
+            task.exception()
+
+    # Выдача
+
+    async def get(self, period: str, user_id: Optional[int] = None) -> DashboardSnapshot:
+        """
+        Последний снимок (устаревший - с фоновым обновлением)
+
+        Без снимка дашборд считается сразу; ошибка расчета пробрасывается.
+        """
+        key = (period, user_id)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            if user_id is not None:
+                self._evict_user_variants(self.max_user_variants - 1)
+            snapshot = await asyncio.shield(self._start_refresh(key))
+        elif self.is_stale(snapshot):
+            self._start_refresh(key)
+            self.stale_served += 1
+
+        snapshot.requested_at = time.time()
+        self.served += 1
+        if snapshot.refresh_failed:
+            self.degraded_served += 1
+        return snapshot
+
+    def headers(self, snapshot: DashboardSnapshot) -> Dict[str, str]:
+        """Заголовки ответа: возраст снимка и признаки устаревания"""
+        headers = {"Age": str(int(snapshot.age))}
+        if self.is_stale(snapshot):
+            headers["X-Snapshot-Stale"] = "true"
+        if snapshot.refresh_failed:
+            headers["X-Snapshot-Degraded"] = "true"
+        return headers
+
+    # Фоновое обновление
+
+    def _evict_user_variants(self, limit: int):
+        """Удаление пользовательских снимков, которые давно не запрашивали (и сверх лимита)"""
+        now = time.time()
+        user_keys = sorted(
+            (key for key in self._snapshots if key[1] is not None),
+            key=lambda key: self._snapshots[key].requested_at
+        )
+        for index, key in enumerate(user_keys):
+            if now - self._snapshots[key].requested_at >= self.user_ttl or len(user_keys) - index > limit:
+                del self._snapshots[key]
+
+    async def refresh_stale(self):
+        """Пересчет отсутствующих снимков периодов и всех устаревших снимков"""
+        self._evict_user_variants(self.max_user_variants)
+        keys = [(period, None) for period in self.periods]
+        keys += [key for key in self._snapshots if key[1] is not None]
+        for key in keys:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and not self.is_stale(snapshot):
+                continue
+            try:
+                await self._start_refresh(key)
+            except Exception:
+                # Ошибка залогирована; снимок остается прежним до следующей попытки
+                pass
+
+    async def run(self, session_factory: Callable, stop_event: asyncio.Event):
+        """Фоновое обновление снимков до stop_event"""
+        self.session_factory = session_factory
+        tick = min(self.refresh_interval, SCHEDULER_TICK)
+        while not stop_event.is_set():
+            try:
+                await self.refresh_stale()
+            except Exception as e:
+                logger.error(f"Error refreshing dashboard snapshots: {str(e)}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=tick)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Снимки, их возраст и счетчики выдачи/обновления"""
+        return {
+            "refresh_interval": self.refresh_interval,
+            "snapshots": {
+                period if user_id is None else f"{period}:user:{user_id}": round(snapshot.age, 3)
+                for (period, user_id), snapshot in self._snapshots.items()
+            },
+            "refreshing": len(self._refreshing),
+            "served": self.served,
+            "stale_served": self.stale_served,
+            "degraded_served": self.degraded_served,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_refresh_seconds": round(self.last_refresh_seconds, 6),
+        }
+
+
+# Глобальный экземпляр
+dashboard_snapshots = DashboardSnapshotService()
@@ -0,0 +1,411 @@
+"""
+Расходы на рекламу: потоковый импорт и индекс префиксных сумм в памяти
+
+Импорт читает CSV, NDJSON или JSON массив по одной записи и пишет их
+пачками upsert в ad_spend: память не зависит от размера файла.
+
+Для расчетов таблица загружается в SpendIndex: по каждому ряду (все
+источники, источник, источник + кампания) хранится массив накопленных
+сумм по дням, поэтому расход за любой период - разность двух элементов,
+O(1) без обращения к БД. Индекс перечитывается, когда меняется
+max(updated_at) таблицы (проверка не чаще ad_spend_reload_interval).
+"""
+
+import csv
+import json
+import threading
+import time
+from array import array
+from datetime import date, datetime
+from itertools import accumulate
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.core.cache import invalidate_cache
+from app.core.config import settings
+from app.core.logging import logger
+from app.models.ad_spend import AdSpend
+
+DateLike = Union[date, datetime]
+SpendKey = Tuple[date, str, str]
+
+SPEND_FORMATS = ("csv", "json")
+SPEND_MODES = ("replace", "add")
+
+# Допустимые названия полей выгрузок рекламных кабинетов
+SPEND_FIELD_ALIASES = {
+    "day": ("day", "date"),
+    "utm_source": ("utm_source", "source"),
+    "utm_campaign": ("utm_campaign", "campaign"),
+    "cost": ("cost", "spend", "amount"),
+}
+
+JSON_CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 20
+
+
+# Чтение файлов
+
+def iter_csv_records(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Записи CSV с заголовком"""
+    yield from csv.DictReader(stream)
+
+
+def iter_json_records(stream: TextIO, chunk_size: int = JSON_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Объекты JSON массива или NDJSON без чтения файла целиком
+
+    В буфере - не больше одной записи и одного куска файла.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    while True:
+        # Пропуск пробелов, запятых и скобок массива между объектами
+        while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+            position += 1
+        if position >= len(buffer):
+            buffer = stream.read(chunk_size)
+            position = 0
+            if not buffer:
+                return
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise ValueError(f"Invalid JSON near: {buffer[position:position + 80]!r}") from e
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        eof = False
+        if not isinstance(record, dict):
+            raise ValueError(f"Spend record must be a JSON object, got {type(record).__name__}")
+        yield record
+        position = end
+
+
+def iter_spend_records(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    if fmt == "csv":
+        return iter_csv_records(stream)
+    if fmt == "json":
+        return iter_json_records(stream)
+    raise ValueError(f"Unknown spend format: {fmt}")
+
+
+def _field(record: Dict[str, Any], name: str) -> Any:
+    for alias in SPEND_FIELD_ALIASES[name]:
+        value = record.get(alias)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def parse_spend_record(record: Dict[str, Any]) -> Tuple[SpendKey, float]:
+    """Ключ (день, источник, кампания) и расход записи; ValueError - некорректная запись"""
+    day = _field(record, "day")
+    source = _field(record, "utm_source")
+    cost = _field(record, "cost")
+    if day is None or source is None or cost is None:
+        raise ValueError("day, utm_source and cost are required")
+    if not isinstance(day, date):
+        day = date.fromisoformat(str(day)[:10])
+    elif isinstance(day, datetime):
+        day = day.date()
+    campaign = _field(record, "utm_campaign") or ""
+    return (day, str(source).strip(), str(campaign).strip()), float(cost)
+
+
+# Импорт
+
+class SpendImportResult:
+    """Итог импорта: записанные и пропущенные строки, период данных"""
+
+    __slots__ = ("rows", "skipped", "errors", "first_day", "last_day")
+
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.errors: List[str] = []
+        self.first_day: Optional[date] = None
+        self.last_day: Optional[date] = None
+
+    def add(self, day: date):
+        self.rows += 1
+        self.first_day = day if self.first_day is None else min(self.first_day, day)
+        self.last_day = day if self.last_day is None else max(self.last_day, day)
+
+    def skip(self, number: int, error: Exception):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"record {number}: {str(error)}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "first_day": self.first_day.isoformat() if self.first_day else None,
+            "last_day": self.last_day.isoformat() if self.last_day else None,
+        }
+
+
+def _write_batch(connection, batch: Dict[SpendKey, float], mode: str):
+    table = AdSpend.__table__
+    rows = [
+        {"day": day, "utm_source": source, "utm_campaign": campaign, "cost": cost}
+        for (day, source, campaign), cost in batch.items()
+    ]
+
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table)
+        cost = statement.excluded.cost if mode == "replace" else table.c.cost + statement.excluded.cost
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.utm_source, table.c.utm_campaign],
+            set_={"cost": cost, "updated_at": func.now()}
+        )
+        connection.execute(statement, rows)
+        return
+
+    # Прочие диалекты: UPDATE, при отсутствии строки - INSERT
+    for row in rows:
+        cost = row["cost"] if mode == "replace" else table.c.cost + row["cost"]
+        result = connection.execute(
+            update(table).where(
+                table.c.day == row["day"],
+                table.c.utm_source == row["utm_source"],
+                table.c.utm_campaign == row["utm_campaign"]
+            ).values(cost=cost, updated_at=func.now())
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+def import_spend(
+    db: Session,
+    records: Iterable[Dict[str, Any]],
+    mode: str = "replace",
+    batch_size: Optional[int] = None
+) -> SpendImportResult:
+    """
+    Запись расходов пачками upsert в текущей транзакции (commit - за вызывающим)
+
+    mode="replace": строка задает расход по ключу целиком (повтор ключа -
+    последнее значение); mode="add": расход прибавляется к записанному.
+    """
+    if mode not in SPEND_MODES:
+        raise ValueError(f"Unknown spend import mode: {mode}")
+    batch_size = batch_size or settings.ad_spend_import_batch_size
+    result = SpendImportResult()
+    batch: Dict[SpendKey, float] = {}
+
+    for number, record in enumerate(records, 1):
+        try:
+            key, cost = parse_spend_record(record)
+        except (ValueError, TypeError) as e:
+            result.skip(number, e)
+            continue
+        batch[key] = batch.get(key, 0.0) + cost if mode == "add" else cost
+        result.add(key[0])
+        if len(batch) >= batch_size:
+            _write_batch(db.connection(), batch, mode)
+            batch = {}
+
+    if batch:
+        _write_batch(db.connection(), batch, mode)
+
+    logger.info(
+        f"Ad spend imported: {result.rows} rows, {result.skipped} skipped "
+        f"({result.first_day} - {result.last_day}, mode={mode})"
+    )
+    return result
+
+
+def import_spend_file(
+    stream: TextIO,
+    fmt: str,
+    mode: str = "replace",
+    session_factory: Optional[Callable] = None
+) -> SpendImportResult:
+    """Импорт файла одной транзакцией в собственной сессии"""
+    if session_factory is None:
+        from app.core.db import SessionLocal
+        session_factory = SessionLocal
+    db = session_factory()
+    try:
+        result = import_spend(db, iter_spend_records(stream, fmt), mode=mode)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    ad_spend.mark_stale()
+    return result
+
+
+# Индекс префиксных сумм
+
+class SpendSeries:
+    """Накопленные суммы ряда по дням: prefix[i] - расход первых i дней с start"""
+
+    __slots__ = ("start", "prefix")
+
+    def __init__(self, start: int, costs: List[float]):
+        self.start = start
+        self.prefix = array("d", accumulate(costs, initial=0.0))
+
+    def total(self, first: int, last: int) -> float:
+        """Расход за дни [first, last] (ordinal)"""
+        low = max(first - self.start, 0)
+        high = min(last - self.start + 1, len(self.prefix) - 1)
+        return self.prefix[high] - self.prefix[low] if high > low else 0.0
+
+
+# Ключ ряда: (None, None) - все источники, (source, None) - источник
+SeriesKey = Tuple[Optional[str], Optional[str]]
+
+
+def _build_series(rows: Iterable[Tuple], key_size: int) -> Iterator[Tuple[Tuple, SpendSeries]]:
+    """Ряды из строк (*ключ, день, расход), отсортированных по ключу и дню"""
+    key = None
+    days: Dict[int, float] = {}
+
+    def flush():
+        start = min(days)
+        costs = [0.0] * (max(days) - start + 1)
+        for ordinal, cost in days.items():
+            costs[ordinal - start] += cost
+        return key, SpendSeries(start, costs)
+
+    for row in rows:
+        row_key = tuple(row[:key_size])
+        if row_key != key and days:
+            yield flush()
+            days = {}
+        key = row_key
+        ordinal = row[key_size].toordinal()
+        days[ordinal] = days.get(ordinal, 0.0) + float(row[key_size + 1] or 0.0)
+    if days:
+        yield flush()
+
+
+def _as_ordinal(value: DateLike) -> int:
+    return (value.date() if isinstance(value, datetime) else value).toordinal()
+
+
+class SpendIndex:
+    """Расходы в памяти: период любой длины - O(1) на ряд"""
+
+    def __init__(self, reload_interval: Optional[float] = None, batch_size: Optional[int] = None):
+        self.reload_interval = (
+            reload_interval if reload_interval is not None else settings.ad_spend_reload_interval
+        )
+        self.batch_size = batch_size or settings.ad_spend_import_batch_size
+        self._series: Optional[Dict[SeriesKey, SpendSeries]] = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._stale = False
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.last_load_seconds = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._series is not None
+
+    def mark_stale(self):
+        """Перечитать таблицу при следующем обращении (после импорта или удаления)"""
+        self._stale = True
+
+    def ensure_loaded(self, db: Session):
+        """Загрузка или перезагрузка индекса, если таблица изменилась"""
+        if self._series is not None and not self._stale and time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if self._series is not None and not self._stale and time.monotonic() - self._checked_at < self.reload_interval:
+                return
+            # Индекс ix_ad_spend_updated_at: проверка не сканирует таблицу
+            stamp = db.query(func.max(AdSpend.updated_at)).scalar()
+            self._checked_at = time.monotonic()
+            if self._series is not None and not self._stale and stamp == self._stamp:
+                return
+            reloaded = self._series is not None
+            self._stale = False
+            self._load(db)
+            self._stamp = stamp
+        if reloaded:
+            invalidate_cache("spend")
+
+    def _load(self, db: Session):
+        started = time.perf_counter()
+        day_column = AdSpend.day
+        queries = (
+            (0, select(day_column, func.sum(AdSpend.cost)).group_by(day_column).order_by(day_column)),
+            (1, select(AdSpend.utm_source, day_column, func.sum(AdSpend.cost))
+                .group_by(AdSpend.utm_source, day_column).order_by(AdSpend.utm_source, day_column)),
+            (2, select(AdSpend.utm_source, AdSpend.utm_campaign, day_column, AdSpend.cost)
+                .order_by(AdSpend.utm_source, AdSpend.utm_campaign, day_column)),
+        )
+        series: Dict[SeriesKey, SpendSeries] = {}
+        for key_size, query in queries:
+            rows = db.execute(query.execution_options(yield_per=self.batch_size))
+            for key, item in _build_series(rows, key_size):
+                series[(key + (None, None))[:2]] = item
+        self._series = series
+        self.loads += 1
+        self.last_load_seconds = time.perf_counter() - started
+        logger.info(f"Ad spend index loaded: {len(series)} series in {self.last_load_seconds:.3f}s")
+
+    def total(
+        self,
+        start_date: DateLike,
+        end_date: DateLike,
+        utm_source: Optional[str] = None,
+        utm_campaign: Optional[str] = None
+    ) -> float:
+        """Расход за дни периода (включительно); без источника - по всем"""
+        if utm_source is None:
+            utm_campaign = None
+        series = (self._series or {}).get((utm_source, utm_campaign))
+        if series is None:
+            return 0.0
+        return series.total(_as_ordinal(start_date), _as_ordinal(end_date))
+
+    def total_for_sources(self, start_date: DateLike, end_date: DateLike, sources: Iterable[str]) -> float:
+        """Расход набора источников: O(число источников)"""
+        return sum(self.total(start_date, end_date, utm_source=source) for source in set(sources))
+
+    def by_source(self, start_date: DateLike, end_date: DateLike) -> Dict[str, float]:
+        """Расход за период по источникам (без нулевых)"""
+        first, last = _as_ordinal(start_date), _as_ordinal(end_date)
+        totals = {}
+        for (source, campaign), series in (self._series or {}).items():
+            if source is not None and campaign is None:
+                cost = series.total(first, last)
+                if cost:
+                    totals[source] = cost
+        return totals
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "series": len(self._series or {}),
+            "loads": self.loads,
+            "last_load_seconds": round(self.last_load_seconds, 6),
+            "stamp": self._stamp.isoformat() if hasattr(self._stamp, "isoformat") else self._stamp,
+        }
+
+
+# Глобальный экземпляр
+ad_spend = SpendIndex()
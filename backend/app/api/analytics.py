@@ -1,12 +1,20 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+import asyncio
+import io
 from datetime import datetime, timedelta
 from typing import Optional
 from app.core.db import get_db
 from app.models.lead import Lead
 from app.models.deal import Deal
+from app.analytics.funnel import FunnelAnalytics
 from app.analytics.metrics import AnalyticsCalculator
+from app.analytics.snapshots import build_dashboard, dashboard_snapshots
+from app.analytics.spend import SPEND_FORMATS, SPEND_MODES, import_spend_file
+from app.core.dependencies import get_current_superuser
+from app.models.user import User
+from app.core.cache import result_cache
+from app.core.config import settings
 
 router = APIRouter()
 
@@ -21,30 +29,20 @@ async def get_cpl(
     Получение CPL (Cost Per Lead) метрик
     """
     try:
-        calculator = AnalyticsCalculator(db)
-        
         # Парсинг дат
         start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else datetime.now() - timedelta(days=30)
         end = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
         
-        cpl_data = await calculator.calculate_cpl(
-            start_date=start,
-            end_date=end,
-            utm_source=utm_source
+        # Расчет целиком (запросы, цикл по строкам, NumPy, Redis уровень кэша) - в потоке
+        # пула: AsyncSession.run_sync выполнял бы его в потоке event loop
+        return await asyncio.to_thread(
+            lambda: AnalyticsCalculator(db).calculate_cpl(
+                start_date=start,
+                end_date=end,
+                utm_source=utm_source
+            )
         )
         
-        return {
-            "metric": "CPL",
-            "period": {
-                "start": start.isoformat(),
-                "end": end.isoformat()
-            },
-            "value": cpl_data["cpl"],
-            "leads_count": cpl_data["leads_count"],
-            "total_cost": cpl_data["total_cost"],
-            "breakdown": cpl_data["breakdown"]
-        }
-        
     except Exception as e:
         return {"error": str(e)}
 
@@ -59,30 +57,18 @@ async def get_conversion_rate(
     Получение Conversion Rate метрик
     """
     try:
-        calculator = AnalyticsCalculator(db)
-        
         # Парсинг дат
         start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else datetime.now() - timedelta(days=30)
         end = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
         
-        cr_data = await calculator.calculate_conversion_rate(
-            start_date=start,
-            end_date=end,
-            pipeline_id=pipeline_id
+        return await asyncio.to_thread(
+            lambda: AnalyticsCalculator(db).calculate_conversion_rate(
+                start_date=start,
+                end_date=end,
+                pipeline_id=pipeline_id
+            )
         )
         
-        return {
-            "metric": "Conversion Rate",
-            "period": {
-                "start": start.isoformat(),
-                "end": end.isoformat()
-            },
-            "value": cr_data["conversion_rate"],
-            "leads_count": cr_data["leads_count"],
-            "deals_count": cr_data["deals_count"],
-            "pipeline_breakdown": cr_data["pipeline_breakdown"]
-        }
-        
     except Exception as e:
         return {"error": str(e)}
 
@@ -97,63 +83,117 @@ async def get_roi(
     Получение ROI (Return on Investment) метрик
     """
     try:
-        calculator = AnalyticsCalculator(db)
-        
         # Парсинг дат
         start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else datetime.now() - timedelta(days=30)
         end = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
         
-        roi_data = await calculator.calculate_roi(
-            start_date=start,
-            end_date=end,
-            utm_source=utm_source
+        return await asyncio.to_thread(
+            lambda: AnalyticsCalculator(db).calculate_roi(
+                start_date=start,
+                end_date=end,
+                utm_source=utm_source
+            )
         )
         
-        return {
-            "metric": "ROI",
-            "period": {
-                "start": start.isoformat(),
-                "end": end.isoformat()
-            },
-            "value": roi_data["roi"],
-            "revenue": roi_data["revenue"],
-            "cost": roi_data["cost"],
-            "profit": roi_data["profit"],
-            "breakdown": roi_data["breakdown"]
-        }
+    except Exception as e:
+        return {"error": str(e)}
+
+@router.get("/funnel")
+async def get_funnel(
+    start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+    user_id: Optional[int] = Query(None, description="Лиды пользователя"),
+    db: Session = Depends(get_db)
+):
+    """
+    Воронка когорты лидов, созданных в периоде: конверсия по стадиям,
+    время на стадиях (перцентили), первый ответ и время конверсии
+    """
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end = datetime.strptime(end_date, "%Y-%m-%d").replace(hour=23, minute=59, second=59) if end_date else None
+
+        def compute():
+            funnel = FunnelAnalytics(db)
+            if start is None and end is None:
+                return funnel.cohort_metrics(*funnel.default_window(), user_id=user_id)
+            return funnel.cohort_metrics(start, end, user_id=user_id)
+
+        result = await asyncio.to_thread(compute)
+        if result is None:
+            return {"error": "NumPy is not installed"}
+        return result
         
     except Exception as e:
         return {"error": str(e)}
 
 @router.get("/dashboard")
 async def get_dashboard_data(
+    response: Response,
     period: str = Query("30d", description="Period: 7d, 30d, 90d"),
+    user_id: Optional[int] = Query(None, description="Показатели лидов пользователя"),
     db: Session = Depends(get_db)
 ):
     """
     Получение данных для дашборда
+
+    Периоды из analytics_snapshot_periods отдаются из снимка (заголовок
+    Age - его возраст в секундах); устаревший снимок обновляется в фоне.
     """
     try:
-        calculator = AnalyticsCalculator(db)
-        
-        # Определение периода
-        days_map = {"7d": 7, "30d": 30, "90d": 90}
-        days = days_map.get(period, 30)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        dashboard_data = await calculator.get_dashboard_data(
-            start_date=start_date,
-            end_date=end_date
-        )
-        
-        return {
-            "period": period,
-            "metrics": dashboard_data["metrics"],
-            "charts": dashboard_data["charts"],
-            "top_sources": dashboard_data["top_sources"],
-            "recent_leads": dashboard_data["recent_leads"]
-        }
+        if settings.analytics_snapshots_enabled and period in dashboard_snapshots.periods:
+            snapshot = await dashboard_snapshots.get(period, user_id)
+            response.headers.update(dashboard_snapshots.headers(snapshot))
+            return snapshot.data
+
+        return await asyncio.to_thread(build_dashboard, db, period, user_id)
         
     except Exception as e:
         return {"error": str(e)}
+
+@router.get("/dashboard/snapshots/stats")
+async def dashboard_snapshot_stats():
+    """
+    Возраст снимков дашборда и счетчики их выдачи и обновления
+    """
+    return {
+        "enabled": settings.analytics_snapshots_enabled,
+        "timestamp": datetime.utcnow().isoformat(),
+        **dashboard_snapshots.stats()
+    }
+
+@router.get("/cache/stats")
+async def analytics_cache_stats():
+    """
+    Hit ratio и время пересчета кэша результатов аналитики
+    """
+    return {
+        "enabled": settings.cache_enabled,
+        "timestamp": datetime.utcnow().isoformat(),
+        **result_cache.stats()
+    }
+
+@router.post("/spend/import")
+async def import_ad_spend(
+    file: UploadFile = File(..., description="CSV или JSON (массив / NDJSON): day, utm_source, utm_campaign, cost"),
+    format: Optional[str] = Query(None, description="csv | json (по умолчанию - по расширению файла)"),
+    mode: str = Query("replace", description="replace - заменить расход по ключу, add - прибавить"),
+    current_user: User = Depends(get_current_superuser)
+):
+    """
+    Потоковый импорт расходов на рекламу по дням
+    """
+    fmt = format or ("json" if (file.filename or "").lower().endswith((".json", ".ndjson", ".jsonl")) else "csv")
+    if fmt not in SPEND_FORMATS or mode not in SPEND_MODES:
+        raise HTTPException(status_code=400, detail=f"format: {SPEND_FORMATS}, mode: {SPEND_MODES}")
+
+    # Файл уже во временном файле (UploadFile); разбор и запись - в потоке пула
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        result = await asyncio.to_thread(import_spend_file, stream, fmt, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    finally:
+        stream.detach()
+
+    return {"format": fmt, "mode": mode, **result.to_dict()}
@@ -0,0 +1,60 @@
+"""
+API роутер потоковой выгрузки (лиды, сделки, уведомления)
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+
+from app.core.dependencies import get_current_active_user
+from app.models.user import User
+from app.schemas.leads import LeadFilter
+from app.services.export_service import EXPORT_FORMATS, MEDIA_TYPES, export_service, parquet_available
+
+router = APIRouter()
+
+
+@router.get("/{dataset}")
+def export_dataset(
+    dataset: str,
+    format: str = Query("csv", description=f"{' | '.join(EXPORT_FORMATS)}"),
+    status: Optional[str] = Query(None, description="Фильтр по статусу лида"),
+    source: Optional[str] = Query(None, description="Фильтр по источнику лида"),
+    assigned_to: Optional[int] = Query(None, description="Фильтр по назначенному пользователю"),
+    created_after: Optional[datetime] = Query(None, description="Создан не раньше"),
+    created_before: Optional[datetime] = Query(None, description="Создан не позже"),
+    search: Optional[str] = Query(None, description="Поиск по тексту"),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Потоковая выгрузка leads | deals | notifications с фильтрами LeadFilter
+
+    Сделки - лидов, подходящих под фильтр; уведомления - только по датам
+    создания и пользователю (assigned_to). Ответ передается чанками по мере
+    чтения серверным курсором.
+    """
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Формат parquet недоступен: pyarrow не установлен")
+
+    try:
+        filters = LeadFilter(
+            status=status,
+            source=source,
+            assigned_to=assigned_to,
+            created_after=created_after,
+            created_before=created_before,
+            search=search
+        )
+        chunks = export_service.stream(dataset, format, filters)
+    except (ValidationError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    filename = f"{dataset}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel, EmailStr, validator
 from typing import Optional, Dict, Any
-from sqlalchemy.orm import Session
-from app.core.db import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.db import get_async_db
+from app.core.exceptions import ValidationError
+from app.core.pagination import keyset_filter, keyset_order, make_page
 from app.integrations.amo.client import AmoCRMClient
+from app.models.lead_status_history import record_status_change
+from app.services.lead_search import lead_search_for
 from app.core.logging import logger
 import re
 
@@ -60,8 +65,26 @@ class LeadResponse(BaseModel):
     status: str
     created_at: str
 
+    @classmethod
+    def from_lead(cls, lead) -> "LeadResponse":
+        return cls(
+            id=lead.id,
+            name=lead.name,
+            phone=lead.phone,
+            email=lead.email,
+            amocrm_contact_id=lead.amocrm_contact_id,
+            amocrm_lead_id=lead.amocrm_lead_id,
+            status=lead.status,
+            created_at=lead.created_at.isoformat()
+        )
+
+class LeadPageResponse(BaseModel):
+    items: list[LeadResponse]
+    next_cursor: Optional[str] = None
+    has_more: bool
+
 @router.post("/", response_model=LeadResponse)
-async def create_lead(lead_data: LeadCreate, db: Session = Depends(get_db)):
+async def create_lead(lead_data: LeadCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Создание нового лида с автоматической интеграцией в amoCRM
     """
@@ -134,8 +157,8 @@ async def create_lead(lead_data: LeadCreate, db: Session = Depends(get_db)):
         )
         
         db.add(db_lead)
-        db.commit()
-        db.refresh(db_lead)
+        await db.commit()
+        await db.refresh(db_lead)
         
         logger.info(f"Lead created successfully: {db_lead.id} -> amoCRM: {amo_lead['id']}")
         
@@ -159,48 +182,78 @@ async def get_leads(
     skip: int = 0, 
     limit: int = 100, 
     status: Optional[str] = None,
-    db: Session = Depends(get_db)
+    q: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Получение списка лидов с фильтрацией
+    Получение списка лидов с фильтрацией и поиском (q - по имени, email, телефону)
     """
     try:
         from app.models.lead import Lead
         
-        query = db.query(Lead)
+        query = select(Lead)
         
         if status:
-            query = query.filter(Lead.status == status)
-        
-        leads = query.offset(skip).limit(limit).all()
-        
-        return [
-            LeadResponse(
-                id=lead.id,
-                name=lead.name,
-                phone=lead.phone,
-                email=lead.email,
-                amocrm_contact_id=lead.amocrm_contact_id,
-                amocrm_lead_id=lead.amocrm_lead_id,
-                status=lead.status,
-                created_at=lead.created_at.isoformat()
-            )
-            for lead in leads
-        ]
+            query = query.where(Lead.status == status)
+        
+        if q:
+            # Полнотекстовый индекс, сортировка по релевантности
+            query = lead_search_for(db).apply(query, q)
+        else:
+            # Стабильный порядок по индексу (created_at, id); для глубоких страниц - /page
+            query = query.order_by(*keyset_order(Lead.created_at, Lead.id))
+        leads = (await db.execute(query.offset(skip).limit(limit))).scalars().all()
+        
+        return [LeadResponse.from_lead(lead) for lead in leads]
         
     except Exception as e:
         logger.error(f"Error getting leads: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to get leads: {str(e)}")
 
+@router.get("/page", response_model=LeadPageResponse)
+async def get_leads_page(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    status: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Страница лидов по курсору: время ответа не зависит от глубины страницы
+    """
+    from app.models.lead import Lead
+    
+    query = select(Lead)
+    if status:
+        query = query.where(Lead.status == status)
+    
+    try:
+        if cursor:
+            query = query.where(keyset_filter(Lead.created_at, Lead.id, cursor))
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=e.message) from e
+    
+    try:
+        query = query.order_by(*keyset_order(Lead.created_at, Lead.id)).limit(limit + 1)
+        page = make_page((await db.execute(query)).scalars().all(), limit)
+    except Exception as e:
+        logger.error(f"Error getting leads page: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get leads: {str(e)}") from e
+    
+    return LeadPageResponse(
+        items=[LeadResponse.from_lead(lead) for lead in page.items],
+        next_cursor=page.next_cursor,
+        has_more=page.has_more
+    )
+
 @router.get("/{lead_id}", response_model=LeadResponse)
-async def get_lead(lead_id: int, db: Session = Depends(get_db)):
+async def get_lead(lead_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Получение информации о конкретном лиде
     """
     try:
         from app.models.lead import Lead
         
-        lead = db.query(Lead).filter(Lead.id == lead_id).first()
+        lead = await db.get(Lead, lead_id)
         
         if not lead:
             raise HTTPException(status_code=404, detail="Lead not found")
@@ -224,7 +277,7 @@ async def get_lead(lead_id: int, db: Session = Depends(get_db)):
 async def update_lead_status(
     lead_id: int, 
     status: str, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Обновление статуса лида с синхронизацией в amoCRM
@@ -232,14 +285,14 @@ async def update_lead_status(
     try:
         from app.models.lead import Lead
         
-        lead = db.query(Lead).filter(Lead.id == lead_id).first()
+        lead = await db.get(Lead, lead_id)
         
         if not lead:
             raise HTTPException(status_code=404, detail="Lead not found")
         
-        # Обновляем статус в локальной БД
-        lead.status = status
-        db.commit()
+        # Обновляем статус в локальной БД (с записью в lead_status_history)
+        await db.run_sync(lambda session: record_status_change(session, lead, status, source="api"))
+        await db.commit()
         
         # Синхронизируем с amoCRM если есть ID сделки
         if lead.amocrm_lead_id:
@@ -267,14 +320,14 @@ async def update_lead_status(
         raise HTTPException(status_code=500, detail=f"Failed to update lead status: {str(e)}")
 
 @router.get("/{lead_id}/amo")
-async def get_lead_amo_info(lead_id: int, db: Session = Depends(get_db)):
+async def get_lead_amo_info(lead_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Получение информации о лиде из amoCRM
     """
     try:
         from app.models.lead import Lead
         
-        lead = db.query(Lead).filter(Lead.id == lead_id).first()
+        lead = await db.get(Lead, lead_id)
         
         if not lead:
             raise HTTPException(status_code=404, detail="Lead not found")
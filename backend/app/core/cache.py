@@ -0,0 +1,507 @@
+"""
+Кэширование: in-process LRU кэш с TTL, клиент Redis и кэш результатов
+
+ResultCache и декоратор cached - двухуровневый кэш вычисленных
+результатов (аналитика) с защитой от stampede и инвалидацией по записи.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import record_cache_lookup, record_cache_recompute
+
+try:
+    import redis
+    import redis.asyncio as redis_asyncio
+except ImportError:  # pragma: no cover - redis опционален
+    redis = None
+    redis_asyncio = None
+
+_MISSING = object()
+
+# Как часто перечитывать поколения тегов из Redis (секунды)
+GENERATION_CHECK_INTERVAL = 1.0
+
+
+class TTLCache:
+    """Потокобезопасный LRU кэш с ограничением размера и TTL"""
+
+    def __init__(self, max_entries: int = 10000, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Получение значения (обновляет позицию в LRU)"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохранение значения с вытеснением самых старых записей"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_redis_client = None
+_async_redis_client = None
+
+
+def get_redis_client():
+    """Ленивое создание клиента Redis (None, если redis недоступен)"""
+    global _redis_client
+    if _redis_client is None:
+        if redis is None:
+            logger.warning("redis package is not installed, Redis cache tier disabled")
+            return None
+        _redis_client = redis.Redis.from_url(
+            settings.redis_url,
+            db=settings.redis_db,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+    return _redis_client
+
+
+def get_async_redis_client():
+    """Ленивое создание асинхронного клиента Redis (None, если redis недоступен)"""
+    global _async_redis_client
+    if _async_redis_client is None:
+        if redis_asyncio is None:
+            logger.warning("redis package is not installed, Redis cache tier disabled")
+            return None
+        _async_redis_client = redis_asyncio.Redis.from_url(
+            settings.redis_url,
+            db=settings.redis_db,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+    return _async_redis_client
+
+
+# Кэш результатов (аналитика)
+
+class CacheEntry:
+    """Значение с абсолютным сроком (time.time()) и временем пересчета"""
+
+    __slots__ = ("value", "expires_at", "delta")
+
+    def __init__(self, value: Any, expires_at: float, delta: float):
+        self.value = value
+        self.expires_at = expires_at
+        self.delta = delta
+
+
+class _Flight:
+    """Выполняющийся пересчет ключа (single-flight)"""
+
+    __slots__ = ("done",)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+def _wait_for_flight(flight: _Flight, timeout: float) -> bool:
+    """
+    Ожидание чужого пересчета без блокировки event loop
+
+    В рабочем потоке - обычное ожидание. В потоке event loop ждать нельзя:
+    False, вызывающий считает сам.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return flight.done.wait(timeout)
+    return False
+
+
+def _json_default(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def _key_value(value: Any, time_bucket: int) -> Any:
+    """Аргумент для ключа: datetime округляется до time_bucket секунд"""
+    if isinstance(value, datetime) and time_bucket:
+        timestamp = value.timestamp()
+        return value.fromtimestamp(timestamp - timestamp % time_bucket, value.tzinfo).isoformat()
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return value
+
+
+def make_cache_key(arguments: Dict[str, Any], time_bucket: Optional[int] = None) -> str:
+    """Стабильный ключ по аргументам вызова (порядок и типы не важны для JSON-совместимых значений)"""
+    time_bucket = settings.cache_time_bucket if time_bucket is None else time_bucket
+    normalized = {name: _key_value(value, time_bucket) for name, value in arguments.items()}
+    raw = json.dumps(normalized, sort_keys=True, default=_json_default, separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш вычисленных результатов: in-process LRU с TTL + опционально Redis
+
+    - single-flight: одновременные промахи по ключу пересчитывает один вызов;
+    - ранний вероятностный пересчет (XFetch): чем ближе истечение и чем
+      дольше пересчет, тем вероятнее, что очередной вызов обновит значение
+      заранее, пока остальные получают текущее;
+    - инвалидация по тегам ("leads", "deals"): поколение тега входит в
+      ключ, запись меняет поколение (в Redis - общее для всех процессов).
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        use_redis: Optional[bool] = None,
+        redis_client=None,
+        beta: Optional[float] = None,
+        lock_timeout: Optional[float] = None,
+        enabled: Optional[bool] = None
+    ):
+        self.ttl = ttl or settings.cache_ttl
+        self.local = TTLCache(max_entries or settings.cache_max_entries, self.ttl)
+        self.use_redis = settings.cache_redis if use_redis is None else use_redis
+        self.beta = settings.cache_early_refresh_beta if beta is None else beta
+        self.lock_timeout = lock_timeout or settings.cache_lock_timeout
+        self.enabled = settings.cache_enabled if enabled is None else enabled
+        self._redis = redis_client
+        self._prefix = f"{settings.cache_prefix}result:"
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, _Flight] = {}
+        self._generations: Dict[str, int] = {}
+        self._remote_generations: Dict[str, int] = {}
+        self._remote_checked_at = 0.0
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def redis(self):
+        if self._redis is None and self.use_redis:
+            self._redis = get_redis_client()
+        return self._redis
+
+    # Поколения тегов
+
+    def _generation_key(self, tag: str) -> str:
+        return f"{self._prefix}generation:{tag}"
+
+    def _generation(self, tags: Tuple[str, ...]) -> str:
+        if self.redis is not None and tags and time.monotonic() - self._remote_checked_at >= GENERATION_CHECK_INTERVAL:
+            try:
+                values = self.redis.mget([self._generation_key(tag) for tag in tags])
+                self._remote_generations.update({tag: int(value or 0) for tag, value in zip(tags, values)})
+                self._remote_checked_at = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Redis cache generation lookup failed: {str(e)}")
+        return ",".join(
+            f"{tag}={self._generations.get(tag, 0)}.{self._remote_generations.get(tag, 0)}" for tag in tags
+        )
+
+    def invalidate(self, *tags: str):
+        """Инвалидация всех результатов, зависящих от тегов"""
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+        if self.redis is not None and tags:
+            try:
+                pipeline = self.redis.pipeline()
+                for tag in tags:
+                    pipeline.incr(self._generation_key(tag))
+                for tag, value in zip(tags, pipeline.execute()):
+                    self._remote_generations[tag] = int(value)
+            except Exception as e:
+                logger.warning(f"Redis cache invalidation failed: {str(e)}")
+
+    # Чтение и пересчет
+
+    def get_or_compute(
+        self,
+        metric: str,
+        key: str,
+        compute: Callable[[], Any],
+        ttl: Optional[float] = None,
+        tags: Tuple[str, ...] = (),
+        decode: Optional[Callable[[Any], Any]] = None,
+        should_cache: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """Значение из кэша или результат compute() (с сохранением)"""
+        if not self.enabled:
+            return compute()
+
+        full_key = f"{metric}:{key}:{self._generation(tags)}"
+        entry = self._lookup(full_key, decode)
+        if entry is not None:
+            if not self._refresh_early(entry):
+                self._count(metric, "hits")
+                return entry.value
+            # Ранний пересчет выполняет один вызов, остальные получают текущее значение
+            flight = self._claim(full_key)
+            if flight is None:
+                self._count(metric, "hits")
+                return entry.value
+            self._count(metric, "early_refreshes")
+            return self._compute(metric, full_key, compute, ttl, should_cache, flight)
+
+        self._count(metric, "misses")
+        flight = self._claim(full_key)
+        if flight is not None:
+            return self._compute(metric, full_key, compute, ttl, should_cache, flight)
+
+        # Тот же ключ уже считается: ждем результат
+        self._count(metric, "coalesced")
+        with self._lock:
+            running = self._inflight.get(full_key)
+        if running is not None and _wait_for_flight(running, self.lock_timeout):
+            entry = self._lookup(full_key, decode)
+            if entry is not None:
+                return entry.value
+        # Результат не сохранен (ошибка, таймаут) - считаем сами
+        return self._compute(metric, full_key, compute, ttl, should_cache, None)
+
+    def _refresh_early(self, entry: CacheEntry) -> bool:
+        if not self.beta or not entry.delta:
+            return False
+        return time.time() - entry.delta * self.beta * math.log(1.0 - random.random()) >= entry.expires_at
+
+    def _claim(self, full_key: str) -> Optional[_Flight]:
+        with self._lock:
+            if full_key in self._inflight:
+                return None
+            flight = self._inflight[full_key] = _Flight()
+            return flight
+
+    def _compute(self, metric, full_key, compute, ttl, should_cache, flight: Optional[_Flight]) -> Any:
+        started = time.perf_counter()
+        try:
+            value = compute()
+            delta = time.perf_counter() - started
+            self._record_recompute(metric, delta)
+            if should_cache is None or should_cache(value):
+                self._store(full_key, value, ttl or self.ttl, delta)
+            return value
+        finally:
+            if flight is not None:
+                with self._lock:
+                    self._inflight.pop(full_key, None)
+                flight.done.set()
+
+    def _lookup(self, full_key: str, decode) -> Optional[CacheEntry]:
+        entry = self.local.get(full_key)
+        if entry is not None and entry.expires_at > time.time():
+            return entry
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(self._prefix + full_key)
+        except Exception as e:
+            logger.warning(f"Redis cache lookup failed, using local tier only: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        value = decode(data["value"]) if decode is not None else data["value"]
+        entry = CacheEntry(value, data["expires_at"], data["delta"])
+        self.local.set(full_key, entry, ttl=max(entry.expires_at - time.time(), 0.001))
+        return entry
+
+    def _store(self, full_key: str, value: Any, ttl: float, delta: float):
+        entry = CacheEntry(value, time.time() + ttl, delta)
+        self.local.set(full_key, entry, ttl=ttl)
+        if self.redis is not None:
+            try:
+                payload = json.dumps(
+                    {"value": value, "expires_at": entry.expires_at, "delta": delta}, default=_json_default
+                )
+                self.redis.set(self._prefix + full_key, payload, ex=max(int(math.ceil(ttl)), 1))
+            except Exception as e:
+                logger.warning(f"Redis cache store failed: {str(e)}")
+
+    # Наблюдаемость
+
+    def _metric_stats(self, metric: str) -> Dict[str, float]:
+        stats = self._stats.get(metric)
+        if stats is None:
+            stats = self._stats.setdefault(metric, dict.fromkeys(
+                ("hits", "misses", "early_refreshes", "coalesced", "recomputes", "recompute_seconds", "recompute_max"),
+                0
+            ))
+        return stats
+
+    def _count(self, metric: str, name: str):
+        with self._lock:
+            self._metric_stats(metric)[name] += 1
+        if name == "hits":
+            record_cache_lookup(metric, "hit")
+        elif name == "misses":
+            record_cache_lookup(metric, "miss")
+
+    def _record_recompute(self, metric: str, seconds: float):
+        with self._lock:
+            stats = self._metric_stats(metric)
+            stats["recomputes"] += 1
+            stats["recompute_seconds"] += seconds
+            stats["recompute_max"] = max(stats["recompute_max"], seconds)
+        record_cache_recompute(metric, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratio и время пересчета по метрикам и в целом"""
+        with self._lock:
+            metrics = {}
+            for metric, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                metrics[metric] = {
+                    "hits": int(stats["hits"]),
+                    "misses": int(stats["misses"]),
+                    "hit_ratio": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+                    "early_refreshes": int(stats["early_refreshes"]),
+                    "coalesced": int(stats["coalesced"]),
+                    "recomputes": int(stats["recomputes"]),
+                    "recompute_avg_seconds": round(stats["recompute_seconds"] / stats["recomputes"], 6)
+                    if stats["recomputes"] else 0.0,
+                    "recompute_max_seconds": round(stats["recompute_max"], 6),
+                }
+            hits = sum(item["hits"] for item in metrics.values())
+            lookups = hits + sum(item["misses"] for item in metrics.values())
+            return {
+                "redis_enabled": self.use_redis,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "local_entries": len(self.local),
+                "in_flight": len(self._inflight),
+                "generations": dict(self._generations),
+                "metrics": metrics,
+            }
+
+    def clear(self):
+        self.local.clear()
+        with self._lock:
+            self._stats.clear()
+
+
+# Глобальный экземпляр для аналитики
+result_cache = ResultCache()
+
+
+def not_error(result: Any) -> bool:
+    """Результаты калькулятора с ключом "error" не кэшируются"""
+    return not (isinstance(result, dict) and "error" in result)
+
+
+def cached(
+    metric: str,
+    tags: Tuple[str, ...] = ("leads", "deals"),
+    ttl: Optional[float] = None,
+    decode: Optional[Callable[[Any], Any]] = None,
+    should_cache: Optional[Callable[[Any], bool]] = None,
+    cache: Optional[ResultCache] = None
+):
+    """
+    Кэширование результата метода по (metric, аргументы вызова)
+
+    Ключ строится из всех аргументов, кроме self (период, фильтры,
+    user_id); decode восстанавливает значение из Redis (например,
+    Model.model_validate). Исходная функция доступна как .uncached.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            arguments.pop("self", None)
+            return (cache or result_cache).get_or_compute(
+                metric,
+                make_cache_key(arguments),
+                lambda: func(*args, **kwargs),
+                ttl=ttl,
+                tags=tags,
+                decode=decode,
+                should_cache=should_cache
+            )
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
+
+def invalidate_cache(*tags: str):
+    """Инвалидация результатов по тегам (после записи лидов/сделок)"""
+    result_cache.invalidate(*tags)
+
+
+# Инвалидация при фиксации записей через ORM: таблицы, измененные во flush,
+# запоминаются в session.info и инвалидируются только после commit
+CACHE_TAGGED_TABLES = frozenset({"leads", "deals"})
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_cache_tags(session: Session, flush_context):
+    tags = session.info.setdefault("cache_tags", set())
+    for obj in session.new | session.deleted:
+        tags.add(getattr(obj, "__tablename__", None))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            tags.add(getattr(obj, "__tablename__", None))
+    tags &= CACHE_TAGGED_TABLES
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_tags(session: Session):
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        result_cache.invalidate(*sorted(tags))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_tags(session: Session):
+    session.info.pop("cache_tags", None)
@@ -17,12 +17,24 @@ class Settings(BaseSettings):
     amocrm_refresh_token: Optional[str] = None
     amocrm_domain: Optional[str] = None
     amocrm_webhook_secret: Optional[str] = None
+    amocrm_field_mapping_raw: str = ""  # JSON: {"<account_id>|*": {"phone": 123456, ...}}
+    amocrm_field_mapping_ttl: float = 300.0  # секунды до перечитывания маппинга (0 - без перечитывания)
+    amocrm_field_mapping_retry_interval: float = 30.0  # секунды до повтора после ошибки загрузки маппинга
+    
+    @property
+    def amocrm_field_mapping(self) -> dict:
+        """Маппинг кастомных полей amoCRM по аккаунтам"""
+        if not self.amocrm_field_mapping_raw:
+            return {}
+        return json.loads(self.amocrm_field_mapping_raw)
     
     # База данных
     db_url: str = "postgresql://asia:asia@db:5432/asia_crm_staging"
     database_url: Optional[str] = None
     db_pool_size: int = 10
     db_max_overflow: int = 20
+    admin_db_url: Optional[str] = None  # БД админ-панели (APIIntegration.config)
+    admin_db_connect_timeout: int = 3  # секунды на подключение к БД админ-панели
     
     # Redis
     redis_url: str = "redis://redis:6379"
@@ -37,6 +49,23 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     jwt_expire_minutes: int = 30
     
+    # Rate limiting (лимиты в формате "запросов/секунд")
+    rate_limit_backend: str = "memory"  # memory | shared (воркеры одного хоста) | redis
+    rate_limit_default: str = "100/3600"
+    rate_limit_webhooks: str = "600/60"  # /api/webhooks/*
+    rate_limit_lead_forms: str = "20/60"  # POST /api/leads (публичные формы заявок)
+    rate_limit_max_keys: int = 100000  # клиентов в памяти процесса
+    rate_limit_shm_path: str = "/dev/shm/apex-rate-limit"
+    rate_limit_shm_slots: int = 65536
+    rate_limit_redis_retry_interval: float = 5.0  # секунды локального лимита после ошибки Redis
+    
+    # Idempotency-Key
+    idempotency_ttl: int = 86400  # секунды хранения ответа
+    idempotency_max_entries: int = 10000
+    idempotency_max_body_bytes: int = 1048576  # ответы больше не кэшируются
+    idempotency_lock_timeout: float = 30.0  # секунды ожидания запроса с тем же ключом
+    idempotency_redis: bool = False  # Общий уровень ответов и блокировок в Redis
+    
     # CORS
     allowed_hosts_raw: str = "*"  # Сырая строка из переменной окружения
     cors_origins_raw: str = "*"   # Сырая строка из переменной окружения
@@ -79,19 +108,67 @@ class Settings(BaseSettings):
     # Мониторинг
     enable_metrics: bool = True
     metrics_port: int = 9090
+    metrics_sidecar: bool = False  # Отдельный listener метрик на metrics_port
     
     # Логирование
     log_format: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     log_file: Optional[str] = None
+    log_json: bool = False  # JSON строки вместо log_format
+    log_queue_enabled: bool = True  # Вывод логов в фоновом потоке (QueueHandler + QueueListener)
+    log_queue_size: int = 10000  # при переполнении записи отбрасываются
+    log_sampling: str = ""  # "app.requests=0.1" - доля записей INFO/DEBUG горячих логгеров
+    log_rate_limits: str = ""  # "app.webhooks.payload=10/1" - записей/секунд
     
     # Кэширование
     cache_ttl: int = 3600  # 1 час
     cache_prefix: str = "apex:"
+    cache_enabled: bool = True  # Кэш результатов аналитики (app.core.cache.result_cache)
+    cache_max_entries: int = 2048  # записей в in-process уровне (LRU)
+    cache_redis: bool = False  # второй уровень в Redis, общий для воркеров
+    cache_early_refresh_beta: float = 1.0  # ранний пересчет до истечения TTL (0 - выключен)
+    cache_lock_timeout: float = 30.0  # секунды ожидания чужого пересчета того же ключа
+    cache_time_bucket: int = 60  # секунды: округление datetime аргументов в ключе
+    
+    # Аналитика
+    analytics_engine_enabled: bool = True  # Колоночный in-memory движок (NumPy) для CPL/CR/ROI
+    analytics_engine_refresh_interval: float = 5.0  # секунды между догрузками изменений
+    analytics_engine_full_refresh_interval: float = 3600.0  # секунды между полными перезагрузками (удаления)
+    analytics_engine_overlap: float = 5.0  # секунды перекрытия водяного знака (поздние коммиты)
+    analytics_engine_batch_size: int = 50000  # строк на пачку серверного курсора
+    analytics_snapshots_enabled: bool = True  # Снимки дашборда с фоновым обновлением
+    analytics_snapshot_periods: str = "7d,30d,90d"  # периоды, пересчитываемые в фоне
+    analytics_snapshot_refresh_interval: float = 300.0  # секунды (refresh_interval дашборда в админке)
+    analytics_snapshot_user_ttl: float = 3600.0  # секунды без запросов до удаления снимка пользователя
+    analytics_snapshot_max_users: int = 500  # снимков пользователей в памяти
+    analytics_funnel_window_days: int = 90  # когорта воронки и метрик времени на дашборде
+    ad_spend_reload_interval: float = 60.0  # секунды между проверками изменений ad_spend
+    ad_spend_import_batch_size: int = 5000  # строк на пачку upsert при импорте расходов
+    
+    # Экспорт
+    export_batch_size: int = 5000  # строк на пачку серверного курсора и чанк ответа
     
     # Уведомления
     notification_queue: str = "notifications"
     notification_retry_attempts: int = 3
     
+    # Webhooks amoCRM
+    webhook_async_mode: bool = False  # Быстрый ответ 202 + обработка очереди воркерами
+    webhook_workers: int = 2
+    webhook_queue_poll_interval: float = 1.0  # секунды
+    webhook_queue_max_attempts: int = 5
+    webhook_queue_visibility_timeout: int = 300  # секунды до повторного захвата зависшей задачи
+    webhook_queue_drain_timeout: float = 30.0  # секунды на дообработку очереди при остановке
+    webhook_dedup_enabled: bool = True  # Пропуск повторных доставок событий
+    webhook_dedup_ttl: int = 86400  # секунды
+    webhook_dedup_max_entries: int = 100000
+    webhook_dedup_redis: bool = False  # Общий уровень дедупликации в Redis
+    webhook_coalesce_enabled: bool = True  # Схлопывание обновлений одного лида
+    webhook_coalesce_window: float = 0.0  # секунды буферизации обновлений (0 - только внутри payload)
+    webhook_lanes: int = 0  # Параллельные полосы по (аккаунт, лид); 0 - весь payload одной транзакцией
+    webhook_capture_enabled: bool = False  # Запись очищенных payload для replay
+    webhook_capture_path: str = "logs/webhook_capture.jsonl.gz"
+    webhook_capture_queue_size: int = 1000  # payload в очереди записи (при переполнении отбрасываются)
+    
     # Интеграции
     enable_amocrm: bool = True
     enable_email: bool = False
@@ -1,9 +1,41 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.core.config import settings
+from app.core.metrics import instrument_engine
+
+# Асинхронные драйверы для синхронных URL из настроек
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def _pool_options(url: str) -> dict:
+    """Размер пула из db_pool_size/db_max_overflow (SQLite пул не настраивается)"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": True,
+    }
+
+
+def get_async_url(url: str) -> str:
+    """URL с асинхронным драйвером для переданного URL БД"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    if driver is None:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
 
 # Создание движка базы данных
-engine = create_engine(settings.db_url)
+engine = create_engine(settings.db_url, **_pool_options(settings.db_url))
+instrument_engine(engine, "sync")
 
 # Создание сессии
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -18,3 +50,46 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Асинхронный движок создается при первом обращении (драйвер грузится лениво)
+_async_engine = None
+_async_session_factory = None
+
+
+def get_async_engine():
+    """Асинхронный движок с пулом из настроек"""
+    global _async_engine
+    if _async_engine is None:
+        url = get_async_url(settings.db_url)
+        _async_engine = create_async_engine(url, **_pool_options(url))
+        instrument_engine(_async_engine.sync_engine, "async")
+    return _async_engine
+
+
+def get_async_session_factory() -> async_sessionmaker:
+    """Фабрика AsyncSession"""
+    global _async_session_factory
+    if _async_session_factory is None:
+        _async_session_factory = async_sessionmaker(
+            get_async_engine(),
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False
+        )
+    return _async_session_factory
+
+
+# Dependency для получения асинхронной сессии БД
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
+
+
+async def dispose_async_engine():
+    """Закрытие пула асинхронного движка при остановке приложения"""
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    _async_session_factory = None
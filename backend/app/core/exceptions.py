@@ -113,6 +113,13 @@ class RateLimitError(APEXException):
         super().__init__(message, status.HTTP_429_TOO_MANY_REQUESTS)
 
 
+class IdempotencyConflictError(APEXException):
+    """Запрос с тем же Idempotency-Key еще выполняется"""
+    
+    def __init__(self, message: str = "Запрос с этим Idempotency-Key еще выполняется"):
+        super().__init__(message, status.HTTP_409_CONFLICT)
+
+
 class ConfigurationError(APEXException):
     """Ошибка конфигурации"""
     
@@ -0,0 +1,190 @@
+"""
+Хранилище ответов для Idempotency-Key
+
+Первый уровень - in-process LRU с TTL, второй (опционально) - Redis,
+общий для всех воркеров и реплик. Одновременные запросы с одним ключом
+выполняются один раз: остальные ждут результат первого (внутри процесса
+через asyncio.Event, между процессами - через блокировку SET NX в Redis).
+"""
+
+import asyncio
+import base64
+import json
+from typing import Any, Dict, Optional
+
+from app.core.cache import TTLCache, get_async_redis_client
+from app.core.config import settings
+from app.core.exceptions import IdempotencyConflictError
+from app.core.logging import logger
+
+# Пауза между проверками, когда ключ удерживает другой процесс
+REMOTE_POLL_INTERVAL = 0.05
+
+
+def encode_response(response: Dict[str, Any]) -> str:
+    """Сериализация ответа для Redis"""
+    return json.dumps({
+        "status_code": response["status_code"],
+        "headers": [[key.decode("latin-1"), value.decode("latin-1")] for key, value in response["headers"]],
+        "content": base64.b64encode(response["content"]).decode("ascii")
+    })
+
+
+def decode_response(raw) -> Dict[str, Any]:
+    data = json.loads(raw)
+    return {
+        "status_code": data["status_code"],
+        "headers": [(key.encode("latin-1"), value.encode("latin-1")) for key, value in data["headers"]],
+        "content": base64.b64decode(data["content"])
+    }
+
+
+class IdempotencyStore:
+    """Сохраненные ответы и учет выполняющихся запросов по ключу"""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[int] = None,
+        use_redis: Optional[bool] = None,
+        redis_client=None,
+        lock_timeout: Optional[float] = None
+    ):
+        self.ttl = ttl or settings.idempotency_ttl
+        self.local = TTLCache(max_entries or settings.idempotency_max_entries, self.ttl)
+        self.use_redis = settings.idempotency_redis if use_redis is None else use_redis
+        self.lock_timeout = lock_timeout or settings.idempotency_lock_timeout
+        self._redis = redis_client
+        self._prefix = f"{settings.cache_prefix}idempotency:"
+        self._inflight: Dict[str, asyncio.Event] = {}
+        self._remote_locks = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def redis(self):
+        if self._redis is None and self.use_redis:
+            self._redis = get_async_redis_client()
+        return self._redis
+
+    async def begin(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Сохраненный ответ для ключа или захват ключа (None)
+
+        Пока ключ выполняет другой запрос, ждет его результата; если он не
+        появился за lock_timeout, выбрасывает IdempotencyConflictError.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_timeout
+        waited = False
+        while True:
+            response = await self.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+            if await self.acquire(key):
+                # Предыдущий владелец мог сохранить ответ между проверкой и захватом
+                response = await self.get(key)
+                if response is None:
+                    self.misses += 1
+                    return None
+                await self.release(key)
+                self.hits += 1
+                return response
+            if not waited:
+                self.coalesced += 1
+                waited = True
+            if not await self.wait(key, deadline - loop.time()):
+                raise IdempotencyConflictError()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Сохраненный ответ для ключа"""
+        response = self.local.get(key)
+        if response is None and self.redis is not None:
+            try:
+                raw = await self.redis.get(self._prefix + key)
+                if raw is not None:
+                    response = decode_response(raw)
+                    self.local.set(key, response)
+            except Exception as e:
+                logger.warning(f"Redis idempotency lookup failed, using local tier only: {str(e)}")
+        return response
+
+    async def set(self, key: str, response: Dict[str, Any]):
+        """Сохранение ответа на TTL"""
+        self.local.set(key, response)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self._prefix + key, encode_response(response), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Redis idempotency store failed: {str(e)}")
+
+    async def acquire(self, key: str) -> bool:
+        """Захват ключа на время выполнения запроса; False - ключ уже выполняется"""
+        if key in self._inflight:
+            return False
+        self._inflight[key] = asyncio.Event()
+
+        if self.redis is not None:
+            try:
+                locked = await self.redis.set(
+                    f"{self._prefix}lock:{key}", 1, nx=True, px=int(self.lock_timeout * 1000)
+                )
+                if not locked:
+                    self._inflight.pop(key).set()
+                    return False
+                self._remote_locks.add(key)
+            except Exception as e:
+                logger.warning(f"Redis idempotency lock failed, using local lock only: {str(e)}")
+        return True
+
+    async def release(self, key: str):
+        """Освобождение ключа и пробуждение ожидающих запросов"""
+        if key in self._remote_locks:
+            self._remote_locks.discard(key)
+            try:
+                await self.redis.delete(f"{self._prefix}lock:{key}")
+            except Exception as e:
+                logger.warning(f"Redis idempotency unlock failed: {str(e)}")
+        event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, key: str, timeout: float) -> bool:
+        """Ожидание завершения запроса с тем же ключом; False - истек timeout"""
+        if timeout <= 0:
+            return False
+        event = self._inflight.get(key)
+        if event is None:
+            # Ключ удерживает другой процесс: результат появится в Redis
+            await asyncio.sleep(min(REMOTE_POLL_INTERVAL, timeout))
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий, промахов и объединенных запросов"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "local_entries": len(self.local),
+            "redis_enabled": self.use_redis
+        }
+
+    def clear(self):
+        self.local.clear()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+
+# Глобальный экземпляр для IdempotencyMiddleware
+idempotency_store = IdempotencyStore()
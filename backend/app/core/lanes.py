@@ -0,0 +1,57 @@
+"""
+Партиционированный исполнитель: N упорядоченных полос
+
+Задачи с одинаковым ключом партиции всегда попадают в одну полосу и
+выполняются строго в порядке отправки; разные полосы работают
+параллельно.
+"""
+
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from app.core.logging import logger
+
+
+def partition_for(key: Any, lanes: int) -> int:
+    """Номер полосы для ключа (стабилен между процессами, в отличие от hash())"""
+    return zlib.crc32(repr(key).encode("utf-8")) % lanes
+
+
+class PartitionedExecutor:
+    """Набор однопоточных полос с FIFO порядком внутри полосы"""
+
+    def __init__(self, lanes: int, name: str = "lane"):
+        if lanes < 1:
+            raise ValueError("PartitionedExecutor requires at least one lane")
+        self.lanes = lanes
+        self._executors: List[ThreadPoolExecutor] = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-{index}")
+            for index in range(lanes)
+        ]
+        self._lock = threading.Lock()
+        self._submitted = [0] * lanes
+
+    def lane_for(self, key: Any) -> int:
+        return partition_for(key, self.lanes)
+
+    def submit(self, key: Any, fn: Callable, *args, **kwargs) -> Future:
+        """Постановка задачи в полосу ключа"""
+        return self.submit_to_lane(self.lane_for(key), fn, *args, **kwargs)
+
+    def submit_to_lane(self, lane: int, fn: Callable, *args, **kwargs) -> Future:
+        """Постановка задачи в конкретную полосу"""
+        with self._lock:
+            self._submitted[lane] += 1
+        return self._executors[lane].submit(fn, *args, **kwargs)
+
+    def stats(self) -> dict:
+        """Количество задач, отправленных в каждую полосу"""
+        with self._lock:
+            return {"lanes": self.lanes, "submitted": list(self._submitted)}
+
+    def shutdown(self, wait: bool = True):
+        for executor in self._executors:
+            executor.shutdown(wait=wait)
+        logger.info(f"Partitioned executor with {self.lanes} lanes stopped")
@@ -1,11 +1,197 @@
+"""
+Логирование
+
+Обработчики (консоль, файл) работают в фоновом потоке QueueListener, а
+корневой логгер только кладет записи в ограниченную очередь: вывод и
+форматирование не выполняются в event loop. Для горячих путей есть
+именованные логгеры с семплированием (LOG_SAMPLING) и ограничением
+частоты (LOG_RATE_LIMITS), а дорогие поля можно передавать через lazy() -
+они вычисляются, только если запись прошла фильтры.
+"""
+
+import atexit
+import copy
+import json
 import logging
 import logging.handlers
+import queue
+import random
 import sys
+import threading
+import time
 from pathlib import Path
+from typing import Any, Callable, Dict, Optional
 from app.core.config import settings
 
+# Стандартные атрибуты LogRecord (все остальные - поля из extra)
+LOG_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class LazyValue:
+    """Значение, вычисляемое только при выводе записи"""
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func: Callable, *args):
+        self.func = func
+        self.args = args
+
+    def __call__(self) -> Any:
+        return self.func(*self.args)
+
+    def __str__(self) -> str:
+        return str(self())
+
+
+def lazy(func: Callable, *args) -> LazyValue:
+    """Отложенное вычисление аргумента лога: logger.debug("%s", lazy(json.dumps, body))"""
+    return LazyValue(func, *args)
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записи в одну JSON строку (поля extra - на верхнем уровне)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "timestamp": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in LOG_RECORD_ATTRS:
+                data[key] = value() if isinstance(value, LazyValue) else value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в потоке вызова
+
+    Аргументы сообщения и lazy поля вычисляются здесь (объекты могут
+    измениться после возврата из вызова логгера), а форматирование и
+    вывод - в потоке QueueListener. При переполнении очереди запись
+    отбрасывается, а не блокирует вызывающий код.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        for key, value in record.__dict__.items():
+            if isinstance(value, LazyValue):
+                record.__dict__[key] = value()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей ниже WARNING"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """Не более limit записей ниже WARNING за window секунд (token bucket)"""
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.rate = limit / window
+        self.tokens = float(limit)
+        self.updated_at = time.monotonic()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.limit, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+
+def parse_logger_options(raw: str) -> Dict[str, str]:
+    """Разбор строки вида "app.requests=0.1,app.webhooks.payload=0.01" """
+    options = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            options[name.strip()] = value.strip()
+    return options
+
+
+def configure_hot_path_filters():
+    """Семплирование и лимиты частоты для именованных логгеров"""
+    for name, rate in parse_logger_options(settings.log_sampling).items():
+        hot_logger = logging.getLogger(name)
+        hot_logger.filters = [f for f in hot_logger.filters if not isinstance(f, SamplingFilter)]
+        hot_logger.addFilter(SamplingFilter(float(rate)))
+    for name, value in parse_logger_options(settings.log_rate_limits).items():
+        limit, _, window = value.partition("/")
+        hot_logger = logging.getLogger(name)
+        hot_logger.filters = [f for f in hot_logger.filters if not isinstance(f, RateLimitFilter)]
+        hot_logger.addFilter(RateLimitFilter(int(limit), float(window or 1)))
+
+
+_exception_formatter = logging.Formatter()
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[LogQueueHandler] = None
+
+
+def stop_logging():
+    """Остановка фонового потока логирования с выводом оставшихся записей"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    _queue_handler = None
+
+
+def logging_stats() -> Dict[str, Any]:
+    """Состояние очереди логов"""
+    if _queue_handler is None:
+        return {"queue_enabled": False}
+    return {
+        "queue_enabled": True,
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped
+    }
+
+
 def setup_logging():
     """Настройка логирования для приложения"""
+    global _listener, _queue_handler
     
     # Создаем директорию для логов если её нет
     log_dir = Path("logs")
@@ -16,10 +202,13 @@ def setup_logging():
         print("⚠️  Предупреждение: Нет прав на создание директории логов. Используется только консольное логирование.")
     
     # Настраиваем форматтер
-    formatter = logging.Formatter(
-        fmt=settings.log_format,
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
+    if settings.log_json:
+        formatter = JsonFormatter(datefmt="%Y-%m-%dT%H:%M:%S")
+    else:
+        formatter = logging.Formatter(
+            fmt=settings.log_format,
+            datefmt="%Y-%m-%d %H:%M:%S"
+        )
     
     # Настраиваем уровень логирования
     log_level = getattr(logging, settings.log_level.upper(), logging.INFO)
@@ -29,13 +218,15 @@ def setup_logging():
     root_logger.setLevel(log_level)
     
     # Очищаем существующие обработчики
+    stop_logging()
     root_logger.handlers.clear()
+    handlers = []
     
     # Консольный обработчик
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(log_level)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
+    handlers.append(console_handler)
     
     # Файловый обработчик (если указан файл логов)
     if settings.log_file:
@@ -63,12 +254,26 @@ def setup_logging():
             )
             file_handler.setLevel(log_level)
             file_handler.setFormatter(formatter)
-            root_logger.addHandler(file_handler)
+            handlers.append(file_handler)
             print(f"✅ Файловое логирование настроено: {log_file_full_path}")
         except (PermissionError, OSError) as e:
             print(f"⚠️  Предупреждение: Не удалось настроить файловое логирование: {e}")
             print("📝 Используется только консольное логирование")
     
+    # Обработчики работают в фоновом потоке, корневой логгер пишет в очередь
+    if settings.log_queue_enabled:
+        _queue_handler = LogQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+        _listener = logging.handlers.QueueListener(
+            _queue_handler.queue, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+        root_logger.addHandler(_queue_handler)
+    else:
+        for handler in handlers:
+            root_logger.addHandler(handler)
+    
+    configure_hot_path_filters()
+    
     # Настраиваем логи для внешних библиотек
     logging.getLogger("uvicorn").setLevel(logging.INFO)
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
@@ -85,5 +290,8 @@ def get_logger(name: str) -> logging.Logger:
     """Получить логгер с указанным именем"""
     return logging.getLogger(name)
 
+# Дописываем очередь при завершении процесса
+atexit.register(stop_logging)
+
 # Создаем глобальный логгер для импорта
 logger = logging.getLogger(__name__)
@@ -0,0 +1,237 @@
+"""
+Метрики Prometheus
+
+Метки маршрутов берутся из шаблона пути (``/api/leads/{lead_id}``) и
+привязываются к маршрутам один раз при старте, поэтому на запрос
+приходится только поиск дочерней метрики по HTTP методу. Без пакета
+``prometheus_client`` или при ``ENABLE_METRICS=false`` все функции
+модуля ничего не делают.
+"""
+
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logging import logger
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        Counter,
+        Gauge,
+        Histogram,
+        REGISTRY,
+        generate_latest,
+        start_http_server,
+    )
+except ImportError:  # pragma: no cover - prometheus_client опционален
+    Counter = Gauge = Histogram = None
+
+METRICS_ENABLED = settings.enable_metrics and Histogram is not None
+
+# Бакеты для быстрых операций (ожидание соединения из пула)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+if METRICS_ENABLED:
+    HTTP_REQUEST_DURATION = Histogram(
+        "apex_http_request_duration_seconds",
+        "Время обработки HTTP запроса",
+        ["method", "route"]
+    )
+    HTTP_REQUESTS_IN_FLIGHT = Gauge(
+        "apex_http_requests_in_flight",
+        "Запросы в обработке",
+        ["method", "route"]
+    )
+    HTTP_RESPONSES = Counter(
+        "apex_http_responses_total",
+        "Ответы по статусам",
+        ["method", "route", "status"]
+    )
+    DB_POOL_CHECKOUT_DURATION = Histogram(
+        "apex_db_pool_checkout_seconds",
+        "Ожидание соединения из пула БД",
+        ["pool"],
+        buckets=FAST_BUCKETS
+    )
+    DB_POOL_CHECKED_OUT = Gauge(
+        "apex_db_pool_checked_out",
+        "Соединения, выданные из пула БД",
+        ["pool"]
+    )
+    AMOCRM_REQUEST_DURATION = Histogram(
+        "apex_amocrm_request_duration_seconds",
+        "Время запросов к API amoCRM",
+        ["method", "endpoint", "status"]
+    )
+    WEBHOOK_EVENTS = Counter(
+        "apex_webhook_events_total",
+        "События webhook amoCRM по типу и результату",
+        ["event", "outcome"]
+    )
+    CACHE_LOOKUPS = Counter(
+        "apex_cache_lookups_total",
+        "Обращения к кэшу результатов по метрике и результату",
+        ["metric", "result"]
+    )
+    CACHE_RECOMPUTE_DURATION = Histogram(
+        "apex_cache_recompute_duration_seconds",
+        "Время пересчета закэшированных результатов",
+        ["metric"],
+        buckets=FAST_BUCKETS
+    )
+
+
+class RouteMetrics:
+    """ASGI обертка маршрута с заранее привязанными метриками"""
+
+    __slots__ = ("app", "route", "children")
+
+    def __init__(self, app, route: str, methods):
+        self.app = app
+        self.route = route
+        self.children: Dict[str, Tuple] = {
+            method: (
+                HTTP_REQUEST_DURATION.labels(method, route),
+                HTTP_REQUESTS_IN_FLIGHT.labels(method, route)
+            )
+            for method in methods
+        }
+
+    async def __call__(self, scope, receive, send):
+        method = scope.get("method")
+        children = self.children.get(method)
+        if children is None:
+            await self.app(scope, receive, send)
+            return
+
+        duration, in_flight = children
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration.observe(time.perf_counter() - started)
+            in_flight.dec()
+            HTTP_RESPONSES.labels(method, self.route, str(status)).inc()
+
+
+def instrument_routes(app):
+    """Оборачивание всех HTTP маршрутов приложения"""
+    if not METRICS_ENABLED:
+        return
+    for route in app.routes:
+        methods = getattr(route, "methods", None)
+        if methods and hasattr(route, "app") and not isinstance(route.app, RouteMetrics):
+            route.app = RouteMetrics(route.app, route.path, methods)
+
+
+def instrument_engine(engine, pool_name: str):
+    """Замер ожидания соединения из пула SQLAlchemy"""
+    if not METRICS_ENABLED:
+        return
+    pool = engine.pool
+    if getattr(pool, "_apex_instrumented", False):
+        return
+
+    checkout_duration = DB_POOL_CHECKOUT_DURATION.labels(pool_name)
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            checkout_duration.observe(time.perf_counter() - started)
+
+    pool._do_get = timed_do_get
+    pool._apex_instrumented = True
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.labels(pool_name).set_function(pool.checkedout)
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def _endpoint_label(path: str) -> str:
+    """Нормализация пути API amoCRM: ID заменяются на {id}"""
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+async def _on_amocrm_request(request):
+    request.extensions["apex_started"] = time.perf_counter()
+
+
+async def _on_amocrm_response(response):
+    started = response.request.extensions.get("apex_started")
+    if started is not None:
+        AMOCRM_REQUEST_DURATION.labels(
+            response.request.method,
+            _endpoint_label(response.request.url.path),
+            str(response.status_code)
+        ).observe(time.perf_counter() - started)
+
+
+def amocrm_event_hooks() -> Dict[str, list]:
+    """Event hooks httpx для замера запросов к amoCRM"""
+    if not METRICS_ENABLED:
+        return {}
+    return {"request": [_on_amocrm_request], "response": [_on_amocrm_response]}
+
+
+def record_webhook_events(counts: Dict[Tuple[str, str], int]):
+    """Учет событий webhook: {(event, outcome): количество}"""
+    if not METRICS_ENABLED:
+        return
+    for (event, outcome), count in counts.items():
+        if count:
+            WEBHOOK_EVENTS.labels(event, outcome).inc(count)
+
+
+def record_cache_lookup(metric: str, result: str):
+    """Учет обращения к кэшу результатов (hit / miss)"""
+    if not METRICS_ENABLED:
+        return
+    CACHE_LOOKUPS.labels(metric, result).inc()
+
+
+def record_cache_recompute(metric: str, seconds: float):
+    """Учет времени пересчета результата"""
+    if not METRICS_ENABLED:
+        return
+    CACHE_RECOMPUTE_DURATION.labels(metric).observe(seconds)
+
+
+def setup_metrics(app):
+    """Инструментирование маршрутов и endpoint /metrics"""
+    if not METRICS_ENABLED:
+        if settings.enable_metrics:
+            logger.warning("prometheus_client is not installed, metrics are disabled")
+        return
+
+    from fastapi import Response
+
+    instrument_routes(app)
+
+    # Endpoint добавляется после инструментирования и сам не измеряется
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server(port: Optional[int] = None):
+    """Отдельный listener метрик (sidecar) на metrics_port"""
+    if not METRICS_ENABLED:
+        return
+    port = port or settings.metrics_port
+    start_http_server(port)
+    logger.info(f"Prometheus metrics listener started on port {port}")
@@ -1,150 +1,202 @@
 """
 Middleware для безопасности и логирования
+
+Все middleware реализованы как чистые ASGI приложения: без
+BaseHTTPMiddleware, промежуточных Request/Response объектов и отдельной
+задачи на каждый запрос. Политики (разрешенные хосты, security headers)
+компилируются один раз при создании стека.
 """
 
 import time
 import uuid
-from typing import Callable
-from fastapi import Request, Response
+from typing import Dict, Iterable, List, Optional, Tuple
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import URL
+from starlette.requests import Request
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.core.config import settings
-from app.core.logging import logger
-from app.core.security import check_rate_limit, validate_cors_origin
+from app.core.exceptions import IdempotencyConflictError
+from app.core.idempotency import IdempotencyStore, idempotency_store
+from app.core.logging import get_logger, lazy
+from app.core.security import SecurityUtils, check_rate_limit, validate_cors_origin
+
+# Security headers в виде готовых пар ASGI заголовков
+SECURITY_HEADERS: Tuple[Tuple[bytes, bytes], ...] = (
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+)
+PRODUCTION_HEADERS: Tuple[Tuple[bytes, bytes], ...] = (
+    (b"content-security-policy", b"default-src 'self'"),
+)
+
+IDEMPOTENT_METHODS = frozenset({"POST", "PUT", "PATCH"})
+IDEMPOTENT_REPLAY_HEADER = (b"idempotent-replayed", b"true")
+# Ответы, зависящие от момента запроса, а не от операции: rate limit и авторизация
+UNCACHED_STATUSES = frozenset({401, 403, 429})
+
+# Логгер горячего пути: семплирование через LOG_SAMPLING=app.requests=...
+request_logger = get_logger("app.requests")
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[str]:
+    """Значение заголовка запроса (name в нижнем регистре)"""
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _request_url(scope: Scope) -> str:
+    return str(URL(scope=scope))
+
 
+async def send_json(scope: Scope, receive: Receive, send: Send, status_code: int, content: dict):
+    """Отправка JSON ответа, минуя остальную цепочку"""
+    await JSONResponse(status_code=status_code, content=content)(scope, receive, send)
 
-class SecurityMiddleware(BaseHTTPMiddleware):
+
+class HostPolicy:
+    """Предкомпилированный список разрешенных хостов"""
+
+    __slots__ = ("allow_all", "exact", "suffixes")
+
+    def __init__(self, allowed_hosts: Iterable[str]):
+        allowed_hosts = list(allowed_hosts)
+        self.allow_all = "*" in allowed_hosts
+        self.exact = frozenset(host for host in allowed_hosts if not host.startswith("*."))
+        # "*.example.com" -> ".example.com": поддомены, как в TrustedHostMiddleware
+        self.suffixes = tuple(host[1:] for host in allowed_hosts if host.startswith("*."))
+
+    def is_allowed(self, host: str) -> bool:
+        if self.allow_all:
+            return True
+        # Убираем порт из host для проверки
+        host = host.split(":", 1)[0]
+        return host in self.exact or (bool(self.suffixes) and host.endswith(self.suffixes))
+
+
+class SecurityMiddleware:
     """Middleware для безопасности"""
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Проверка trusted hosts
-        if settings.environment != "development":
-            host = request.headers.get("host", "")
-            # Убираем порт из host для проверки
-            host_without_port = host.split(":")[0] if ":" in host else host
-            
-            # Проверяем точное совпадение или wildcard
-            allowed = False
-            for allowed_host in settings.allowed_hosts:
-                if allowed_host == "*":
-                    allowed = True
-                    break
-                elif allowed_host.startswith("*."):
-                    # Проверяем wildcard домен
-                    domain = allowed_host[2:]  # Убираем "*."
-                    if host_without_port.endswith(domain):
-                        allowed = True
-                        break
-                elif allowed_host == host_without_port:
-                    allowed = True
-                    break
-            
-            if not allowed:
-                return JSONResponse(
-                    status_code=403,
-                    content={"detail": "Host not allowed"}
-                )
+    def __init__(
+        self,
+        app: ASGIApp,
+        allowed_hosts: Optional[Iterable[str]] = None,
+        environment: Optional[str] = None
+    ):
+        self.app = app
+        environment = environment or settings.environment
+
+        # Проверка trusted hosts только вне development
+        self.host_policy: Optional[HostPolicy] = None
+        if environment != "development":
+            self.host_policy = HostPolicy(
+                settings.allowed_hosts if allowed_hosts is None else allowed_hosts
+            )
+
+        headers = SECURITY_HEADERS
+        if environment == "production":
+            headers = headers + PRODUCTION_HEADERS
+        self.headers = headers
+        self.header_names = frozenset(name for name, _ in headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.host_policy is not None and not self.host_policy.is_allowed(get_header(scope, b"host") or ""):
+            await send_json(scope, receive, send, 403, {"detail": "Host not allowed"})
+            return
 
         # Проверка rate limit для API endpoints
-        if request.url.path.startswith("/api/"):
+        if scope["path"].startswith("/api/"):
             try:
-                await check_rate_limit(request)
+                await check_rate_limit(Request(scope))
             except Exception as e:
-                return JSONResponse(
-                    status_code=429,
-                    content={"detail": str(e)}
-                )
-
-        # Добавление security headers
-        response = await call_next(request)
-        
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        
-        if settings.environment == "production":
-            response.headers["Content-Security-Policy"] = "default-src 'self'"
-
-        return response
-
-
-class LoggingMiddleware(BaseHTTPMiddleware):
+                await send_json(scope, receive, send, 429, {"detail": str(e)})
+                return
+
+        headers = self.headers
+        header_names = self.header_names
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                # Security headers заменяют одноименные заголовки ответа
+                message["headers"] = [
+                    header for header in message.get("headers", ())
+                    if header[0].lower() not in header_names
+                ] + list(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class LoggingMiddleware:
     """Middleware для логирования запросов"""
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Генерируем уникальный ID для запроса
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Генерируем уникальный ID для запроса (доступен как request.state.request_id)
         request_id = str(uuid.uuid4())
-        request.state.request_id = request_id
-        
+        scope.setdefault("state", {})["request_id"] = request_id
+        request_id_header = (b"x-request-id", request_id.encode("latin-1"))
+
         # Проверяем, является ли это health check
-        is_health_check = request.url.path == "/health"
-        
+        is_health_check = scope["path"] == "/health"
+        method = scope["method"]
+
         # Логируем детали всех запросов (кроме health checks)
         if not is_health_check:
-            logger.info(
-                f"Request details - Method: {request.method}, Path: {request.url.path}, "
-                f"Client IP: {request.client.host if request.client else 'unknown'}, "
-                f"User-Agent: {request.headers.get('user-agent', 'N/A')}, "
-                f"Host: {request.headers.get('host', 'N/A')}, "
-                f"Is Health Check: {is_health_check}"
+            client = scope.get("client")
+            client_ip = client[0] if client else "unknown"
+            user_agent = get_header(scope, b"user-agent")
+            request_logger.info(
+                "Request details - Method: %s, Path: %s, Client IP: %s, User-Agent: %s, Host: %s, Is Health Check: %s",
+                method, scope["path"], client_ip, user_agent or "N/A",
+                get_header(scope, b"host") or "N/A", is_health_check
             )
-        
-        # Логируем начало запроса (только для не-health check запросов)
-        start_time = time.time()
-        
-        if not is_health_check:
-            logger.info(
-                f"Request started",
+            request_logger.info(
+                "Request started",
                 extra={
                     "request_id": request_id,
-                    "method": request.method,
-                    "url": str(request.url),
-                    "client_ip": request.client.host if request.client else "unknown",
-                    "user_agent": request.headers.get("user-agent", "")
+                    "method": method,
+                    "url": lazy(_request_url, scope),
+                    "client_ip": client_ip,
+                    "user_agent": user_agent or ""
                 }
             )
 
+        start_time = time.time()
+        status_code = 500
+
+        async def send_with_request_id(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Добавляем request ID в заголовки
+                message["headers"] = list(message.get("headers", ())) + [request_id_header]
+            await send(message)
+
         try:
-            response = await call_next(request)
-            
-            # Логируем ответ для всех запросов
-            process_time = time.time() - start_time
-            
-            if not is_health_check:
-                logger.info(
-                    f"Request completed",
-                    extra={
-                        "request_id": request_id,
-                        "status_code": response.status_code,
-                        "process_time": process_time
-                    }
-                )
-            elif response.status_code >= 400:
-                # Логируем ошибки health check как WARNING
-                logger.warning(
-                    f"Health check failed",
-                    extra={
-                        "request_id": request_id,
-                        "status_code": response.status_code,
-                        "process_time": process_time
-                    }
-                )
-            
-            # Добавляем request ID в заголовки
-            response.headers["X-Request-ID"] = request_id
-            
-            return response
-            
+            await self.app(scope, receive, send_with_request_id)
         except Exception as e:
             # Логируем ошибку (всегда, включая health checks)
             process_time = time.time() - start_time
-            logger.error(
-                f"Request failed: {str(e)}",
+            request_logger.error(
+                "Request failed: %s", e,
                 extra={
                     "request_id": request_id,
                     "error": str(e),
@@ -154,85 +206,155 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             )
             raise
 
+        process_time = time.time() - start_time
+        if not is_health_check:
+            request_logger.info(
+                "Request completed",
+                extra={
+                    "request_id": request_id,
+                    "status_code": status_code,
+                    "process_time": process_time
+                }
+            )
+        elif status_code >= 400:
+            # Логируем ошибки health check как WARNING
+            request_logger.warning(
+                "Health check failed",
+                extra={
+                    "request_id": request_id,
+                    "status_code": status_code,
+                    "process_time": process_time
+                }
+            )
+
 
-class IdempotencyMiddleware(BaseHTTPMiddleware):
+class IdempotencyMiddleware:
     """Middleware для идемпотентности запросов"""
 
-    def __init__(self, app, cache=None):
-        super().__init__(app)
-        self.cache = cache or {}  # В реальном проекте используется Redis
+    def __init__(self, app: ASGIApp, store: Optional[IdempotencyStore] = None, max_body_bytes: Optional[int] = None):
+        self.app = app
+        self.store = store or idempotency_store
+        self.max_body_bytes = max_body_bytes or settings.idempotency_max_body_bytes
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         # Проверяем только для POST/PUT/PATCH запросов
-        if request.method in ["POST", "PUT", "PATCH"]:
-            idempotency_key = request.headers.get("Idempotency-Key")
-            
-            if idempotency_key:
-                # Проверяем, был ли уже обработан запрос с таким ключом
-                if idempotency_key in self.cache:
-                    cached_response = self.cache[idempotency_key]
-                    return JSONResponse(
-                        status_code=cached_response["status_code"],
-                        content=cached_response["content"],
-                        headers=cached_response["headers"]
-                    )
-                
-                # Обрабатываем запрос
-                response = await call_next(request)
-                
-                # Кэшируем ответ
-                self.cache[idempotency_key] = {
-                    "status_code": response.status_code,
-                    "content": response.body.decode() if hasattr(response, 'body') else "",
-                    "headers": dict(response.headers)
-                }
-                
-                return response
-        
-        return await call_next(request)
+        if scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = get_header(scope, b"idempotency-key")
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        # Один ключ на разных endpoint - разные операции
+        key = f"{scope['method']}:{scope['path']}:{idempotency_key}"
+
+        # Сохраненный ответ или ожидание запроса с тем же ключом
+        try:
+            cached_response = await self.store.begin(key)
+        except IdempotencyConflictError as e:
+            await send_json(scope, receive, send, e.status_code, {"detail": e.message})
+            return
+
+        if cached_response is not None:
+            await send({
+                "type": "http.response.start",
+                "status": cached_response["status_code"],
+                "headers": cached_response["headers"] + [IDEMPOTENT_REPLAY_HEADER]
+            })
+            await send({"type": "http.response.body", "body": cached_response["content"]})
+            return
 
+        # Обрабатываем запрос, собирая ответ (в т.ч. потоковый) из отправляемых сообщений
+        response: Dict = {"status_code": 500, "headers": [], "content": b""}
+        chunks: List[bytes] = []
+        size = 0
+        complete = False
 
-class WebhookSignatureMiddleware(BaseHTTPMiddleware):
+        async def send_and_capture(message: Message):
+            nonlocal size, complete
+            if message["type"] == "http.response.start":
+                response["status_code"] = message["status"]
+                response["headers"] = list(message.get("headers", ()))
+            elif message["type"] == "http.response.body" and size <= self.max_body_bytes:
+                body = message.get("body", b"")
+                size += len(body)
+                chunks.append(body)
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_capture)
+            # Ошибки сервера, 429 и 401/403 не кэшируются: повтор запроса должен выполниться заново
+            status_code = response["status_code"]
+            if (complete and size <= self.max_body_bytes and status_code < 500
+                    and status_code not in UNCACHED_STATUSES):
+                response["content"] = b"".join(chunks)
+                await self.store.set(key, response)
+        finally:
+            await self.store.release(key)
+
+
+class WebhookSignatureMiddleware:
     """Middleware для проверки подписи webhook"""
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
         # Проверяем только для webhook endpoints
-        if request.url.path.startswith("/api/webhooks/"):
-            signature = request.headers.get("X-Webhook-Signature")
-            
-            if not signature:
-                return JSONResponse(
-                    status_code=401,
-                    content={"detail": "Missing webhook signature"}
-                )
-            
-            # Читаем тело запроса
-            body = await request.body()
-            
-            # Проверяем подпись
-            from app.core.security import SecurityUtils
-            if not SecurityUtils.verify_webhook_signature(
-                body.decode(),
-                signature,
-                settings.amocrm_webhook_secret
-            ):
-                return JSONResponse(
-                    status_code=401,
-                    content={"detail": "Invalid webhook signature"}
-                )
-        
-        return await call_next(request)
+        if scope["type"] != "http" or not scope["path"].startswith("/api/webhooks/"):
+            await self.app(scope, receive, send)
+            return
+
+        signature = get_header(scope, b"x-webhook-signature")
+        if not signature:
+            await send_json(scope, receive, send, 401, {"detail": "Missing webhook signature"})
+            return
+
+        # Читаем тело запроса
+        chunks: List[bytes] = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+
+        # Проверяем подпись
+        if not SecurityUtils.verify_webhook_signature(
+            body.decode(),
+            signature,
+            settings.amocrm_webhook_secret
+        ):
+            await send_json(scope, receive, send, 401, {"detail": "Invalid webhook signature"})
+            return
+
+        # Прочитанное тело передается дальше одним сообщением
+        body_sent = False
+
+        async def replay_receive() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
 
 
 def setup_middleware(app):
     """Настройка всех middleware"""
-    
+
     # Trusted Host Middleware
     app.add_middleware(
         TrustedHostMiddleware,
         allowed_hosts=settings.allowed_hosts
     )
-    
+
     # CORS Middleware
     app.add_middleware(
         CORSMiddleware,
@@ -241,15 +363,15 @@ def setup_middleware(app):
         allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
         allow_headers=["*"],
     )
-    
+
     # Security Middleware
     app.add_middleware(SecurityMiddleware)
-    
+
     # Logging Middleware
     app.add_middleware(LoggingMiddleware)
-    
+
     # Idempotency Middleware
     app.add_middleware(IdempotencyMiddleware)
-    
+
     # Webhook Signature Middleware
     app.add_middleware(WebhookSignatureMiddleware)
@@ -0,0 +1,63 @@
+"""
+Keyset (cursor) пагинация по (created_at, id)
+
+Страница выбирается условием ``(created_at, id) < (курсор)`` в порядке
+``created_at DESC, id DESC`` по составному индексу, поэтому стоимость
+запроса не зависит от глубины страницы (в отличие от OFFSET). Курсор -
+непрозрачная строка base64url с ключом последней строки страницы.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import desc, tuple_
+
+from app.core.exceptions import ValidationError
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Курсор на строку с ключом (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Ключ (created_at, id) из курсора"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValidationError("Некорректный курсор пагинации", {"cursor": cursor}) from e
+
+
+def keyset_order(created_column, id_column) -> Tuple[Any, Any]:
+    """Порядок выдачи: новые сначала, id - для однозначности при равном created_at"""
+    return desc(created_column), desc(id_column)
+
+
+def keyset_filter(created_column, id_column, cursor: str):
+    """Условие "строки после курсора" для порядка keyset_order"""
+    created_at, row_id = decode_cursor(cursor)
+    return tuple_(created_column, id_column) < tuple_(created_at, row_id)
+
+
+class KeysetPage:
+    """Страница результатов и курсор следующей страницы"""
+
+    __slots__ = ("items", "next_cursor", "has_more")
+
+    def __init__(self, items: List[Any], next_cursor: Optional[str], has_more: bool):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_more = has_more
+
+
+def make_page(rows: Sequence[Any], limit: int) -> KeysetPage:
+    """Страница из limit + 1 выбранных строк (лишняя строка - признак has_more)"""
+    items = list(rows[:limit])
+    has_more = len(rows) > limit
+    next_cursor = encode_cursor(items[-1].created_at, items[-1].id) if has_more and items else None
+    return KeysetPage(items, next_cursor, has_more)
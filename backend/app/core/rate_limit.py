@@ -0,0 +1,302 @@
+"""
+Rate limiting: token bucket с O(1) обновлением и подключаемыми хранилищами
+
+Состояние клиента - два числа (токены и время последнего обновления),
+поэтому проверка не зависит от величины лимита. Запись, бакет которой
+успел наполниться целиком, неотличима от отсутствующей и вытесняется.
+
+Хранилища:
+    memory - словарь процесса (LRU с ограничением размера);
+    shared - файл в /dev/shm, общий для воркеров uvicorn на одном хосте;
+    redis  - Lua скрипт, общий для всех реплик (асинхронный клиент: acquire
+             - корутина, остальные хранилища синхронные и не делают I/O).
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logging import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl есть только на POSIX
+    fcntl = None
+
+
+class RateLimit:
+    """Лимит: limit запросов за window секунд"""
+
+    __slots__ = ("name", "limit", "window", "rate")
+
+    def __init__(self, limit: int, window: float, name: str = "default"):
+        if limit < 1 or window <= 0:
+            raise ValueError(f"Invalid rate limit {limit}/{window}")
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window  # токенов в секунду
+
+    @classmethod
+    def parse(cls, value: str, name: str = "default") -> "RateLimit":
+        """Разбор строки вида "100/3600" (запросов/секунд)"""
+        limit, _, window = value.partition("/")
+        return cls(int(limit), float(window or 1), name)
+
+    def __repr__(self) -> str:
+        return f"RateLimit({self.name}: {self.limit}/{self.window:g}s)"
+
+
+def take_token(tokens: float, updated_at: float, now: float, limit: RateLimit, cost: float = 1) -> Tuple[bool, float]:
+    """Пополнение бакета на прошедшее время и попытка списать cost токенов"""
+    tokens = min(float(limit.limit), tokens + max(0.0, now - updated_at) * limit.rate)
+    if tokens >= cost:
+        return True, tokens - cost
+    return False, tokens
+
+
+def full_at(tokens: float, now: float, limit: RateLimit) -> float:
+    """Момент, когда бакет наполнится и запись можно удалить"""
+    return now + (limit.limit - tokens) / limit.rate
+
+
+class MemoryBackend:
+    """Бакеты в памяти процесса"""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at, full_at]; порядок - по последнему обращению
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, limit: RateLimit, cost: float = 1) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                allowed, tokens = take_token(limit.limit, now, now, limit, cost)
+                self._buckets[key] = [tokens, now, full_at(tokens, now, limit)]
+            else:
+                allowed, tokens = take_token(bucket[0], bucket[1], now, limit, cost)
+                bucket[0], bucket[1], bucket[2] = tokens, now, full_at(tokens, now, limit)
+                self._buckets.move_to_end(key)
+            self._evict(now)
+        return allowed
+
+    def _evict(self, now: float):
+        """Удаление простаивающих записей с начала LRU (амортизированно O(1))"""
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if bucket[2] > now and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SharedMemoryBackend:
+    """
+    Бакеты в разделяемой памяти (mmap файла), общие для процессов хоста
+
+    Таблица фиксированного размера с открытой адресацией: ключ хэшируется
+    в слот, при коллизии проверяется PROBES соседних слотов. Если все они
+    заняты активными бакетами, вытесняется тот, что наполнится раньше.
+    Доступ сериализуется flock на том же файле.
+    """
+
+    name = "shared"
+    SLOT = struct.Struct("<Qddd")  # хэш ключа, токены, updated_at, full_at
+    PROBES = 8
+
+    def __init__(self, path: str, slots: int = 65536):
+        if fcntl is None:
+            raise RuntimeError("Shared memory rate limiter requires fcntl (POSIX)")
+        self.path = path
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # 0 означает пустой слот
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def acquire(self, key: str, limit: RateLimit, cost: float = 1) -> bool:
+        key_hash = self._hash(key)
+        start = key_hash % self.slots
+        now = time.time()  # общее для процессов время
+        slot_size = self.SLOT.size
+
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                target = None
+                free = None
+                victim, victim_full_at = start * slot_size, math.inf
+                for probe in range(self.PROBES):
+                    offset = ((start + probe) % self.slots) * slot_size
+                    slot_hash, tokens, updated_at, slot_full_at = self.SLOT.unpack_from(self._map, offset)
+                    if slot_hash == key_hash:
+                        target = (offset, tokens, updated_at)
+                        break
+                    if slot_hash == 0 or slot_full_at <= now:
+                        # Пустой или простаивающий слот
+                        if free is None:
+                            free = offset
+                    elif slot_full_at < victim_full_at:
+                        victim, victim_full_at = offset, slot_full_at
+
+                if target is None:
+                    target = (victim if free is None else free, float(limit.limit), now)
+
+                offset, tokens, updated_at = target
+                allowed, tokens = take_token(tokens, updated_at, now, limit, cost)
+                self.SLOT.pack_into(self._map, offset, key_hash, tokens, now, full_at(tokens, now, limit))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return allowed
+
+    def reset(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(len(self._map))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+# Token bucket целиком на стороне Redis: одно обращение на запрос
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1])
+local updated_at = tonumber(state[2])
+if tokens == nil or updated_at == nil then
+    tokens = capacity
+    updated_at = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return allowed
+"""
+
+
+class RedisBackend:
+    """
+    Бакеты в Redis (асинхронный клиент); при недоступности Redis - локальный
+    fallback, следующая попытка обратиться к Redis - через retry_interval
+    """
+
+    name = "redis"
+
+    def __init__(self, redis_client=None, prefix: Optional[str] = None, fallback: Optional[MemoryBackend] = None,
+                 retry_interval: Optional[float] = None):
+        self._redis = redis_client
+        self._script = None
+        self.prefix = prefix if prefix is not None else f"{settings.cache_prefix}ratelimit:"
+        self.fallback = fallback or MemoryBackend(settings.rate_limit_max_keys)
+        self.retry_interval = settings.rate_limit_redis_retry_interval if retry_interval is None else retry_interval
+        self._retry_at = 0.0
+
+    @property
+    def script(self):
+        if self._script is None:
+            if self._redis is None:
+                from app.core.cache import get_async_redis_client
+                self._redis = get_async_redis_client()
+            if self._redis is not None:
+                self._script = self._redis.register_script(TOKEN_BUCKET_LUA)
+        return self._script
+
+    async def acquire(self, key: str, limit: RateLimit, cost: float = 1) -> bool:
+        if time.monotonic() >= self._retry_at:
+            try:
+                script = self.script
+                if script is not None:
+                    return bool(await script(
+                        keys=[self.prefix + key],
+                        args=[limit.limit, limit.rate, time.time(), cost]
+                    ))
+            except Exception as e:
+                self._retry_at = time.monotonic() + self.retry_interval
+                logger.warning(
+                    f"Redis rate limit failed, using local limiter for {self.retry_interval:g}s: {str(e)}"
+                )
+        return self.fallback.acquire(key, limit, cost)
+
+    def reset(self):
+        self.fallback.reset()
+
+
+def create_backend(name: Optional[str] = None):
+    """Хранилище бакетов из настроек (RATE_LIMIT_BACKEND)"""
+    name = name or settings.rate_limit_backend
+    if name == "redis":
+        return RedisBackend()
+    if name == "shared":
+        try:
+            return SharedMemoryBackend(settings.rate_limit_shm_path, settings.rate_limit_shm_slots)
+        except Exception as e:
+            logger.warning(f"Shared memory rate limiter unavailable, using in-process limiter: {str(e)}")
+    elif name != "memory":
+        logger.warning(f"Unknown rate limit backend '{name}', using in-process limiter")
+    return MemoryBackend(settings.rate_limit_max_keys)
+
+
+class RouteLimits:
+    """Классы лимитов по маршрутам: первое совпадение (метод, префикс пути)"""
+
+    def __init__(self, rules: Iterable[Tuple[Optional[str], str, RateLimit]], default: RateLimit):
+        self.rules: List[Tuple[Optional[str], str, RateLimit]] = list(rules)
+        self.default = default
+
+    def resolve(self, method: str, path: str) -> RateLimit:
+        for rule_method, prefix, limit in self.rules:
+            if (rule_method is None or rule_method == method) and path.startswith(prefix):
+                return limit
+        return self.default
+
+
+def build_route_limits() -> RouteLimits:
+    """Классы лимитов из настроек"""
+    webhooks = RateLimit.parse(settings.rate_limit_webhooks, "webhooks")
+    lead_forms = RateLimit.parse(settings.rate_limit_lead_forms, "lead_forms")
+    return RouteLimits(
+        [
+            (None, "/api/webhooks/", webhooks),
+            ("POST", "/api/leads", lead_forms),
+        ],
+        default=RateLimit.parse(settings.rate_limit_default, "default")
+    )
@@ -11,9 +11,11 @@ from passlib.context import CryptContext
 import secrets
 import hashlib
 import hmac
+import inspect
 
 from app.core.config import settings
 from app.core.exceptions import AuthenticationError, AuthorizationError
+from app.core.rate_limit import MemoryBackend, RateLimit, build_route_limits, create_backend
 from app.models.user import User
 
 # Схема безопасности для JWT токенов
@@ -88,36 +90,23 @@ class SecurityUtils:
 
 
 class RateLimiter:
-    """Rate limiter для API запросов"""
+    """Rate limiter для API запросов (token bucket, хранилище - app.core.rate_limit)"""
 
-    def __init__(self):
-        self.requests = {}  # В реальном проекте используется Redis
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
 
-    def is_allowed(self, client_id: str, limit: int = 100, window: int = 3600) -> bool:
+    async def is_allowed(self, client_id: str, limit: int = 100, window: int = 3600) -> bool:
         """Проверка лимита запросов"""
-        now = datetime.utcnow()
-        window_start = now - timedelta(seconds=window)
-        
-        if client_id not in self.requests:
-            self.requests[client_id] = []
-        
-        # Удаляем старые запросы
-        self.requests[client_id] = [
-            req_time for req_time in self.requests[client_id]
-            if req_time > window_start
-        ]
-        
-        # Проверяем лимит
-        if len(self.requests[client_id]) >= limit:
-            return False
-        
-        # Добавляем новый запрос
-        self.requests[client_id].append(now)
-        return True
+        allowed = self.backend.acquire(client_id, RateLimit(limit, window))
+        # RedisBackend.acquire - корутина, локальные хранилища отвечают сразу
+        if inspect.isawaitable(allowed):
+            allowed = await allowed
+        return allowed
 
 
-# Глобальный экземпляр rate limiter
-rate_limiter = RateLimiter()
+# Глобальный экземпляр rate limiter и классы лимитов по маршрутам
+rate_limiter = RateLimiter(create_backend())
+route_limits = build_route_limits()
 
 
 async def get_current_user_from_token(
@@ -179,11 +168,16 @@ def require_permissions(permissions: List[str]):
     return decorator
 
 
-async def check_rate_limit(request: Request, limit: int = 100, window: int = 3600):
-    """Проверка rate limit для запроса"""
+async def check_rate_limit(request: Request, limit: Optional[int] = None, window: Optional[int] = None):
+    """Проверка rate limit для запроса (по умолчанию - класс лимита маршрута)"""
     client_id = request.client.host if request.client else "unknown"
+
+    if limit is None:
+        route_limit = route_limits.resolve(request.method, request.scope["path"])
+        client_id = f"{route_limit.name}:{client_id}"
+        limit, window = route_limit.limit, route_limit.window
     
-    if not rate_limiter.is_allowed(client_id, limit, window):
+    if not await rate_limiter.is_allowed(client_id, limit, window or 3600):
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Превышен лимит запросов"
@@ -0,0 +1,176 @@
+"""
+Запись webhook трафика amoCRM для последующего воспроизведения
+
+Payload и заголовки очищаются от персональных данных (имена, телефоны,
+email заменяются стабильными хэшами) и дописываются в архив JSONL,
+сжатый gzip. Формат строки::
+
+    {"ts": <unix time>, "headers": {...}, "body": {...}}
+
+Из обработчика webhook тело ставится в ограниченную очередь (submit),
+очистка, сжатие и запись выполняются фоновым потоком.
+"""
+
+import gzip
+import hashlib
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional, Union
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.integrations.amo.field_mapping import CONTACT_FIELDS, field_mapping_registry
+
+
+# Заголовки, которые сохраняются в архиве (подписи и токены не пишем)
+CAPTURED_HEADERS = ("content-type", "user-agent", "x-account-id", "x-client-uuid")
+
+
+def _mask(value: Any) -> str:
+    """Стабильная замена значения: одинаковые значения дают одинаковый хэш"""
+    digest = hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:12]
+    return f"masked-{digest}"
+
+
+def sanitize_payload(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия payload без персональных данных с сохранением структуры"""
+    fields = field_mapping_registry.get((body.get("account") or {}).get("id"))
+    pii_field_ids = {int(fields.mapping[target]) for target in CONTACT_FIELDS if target in fields.mapping}
+
+    def clean(entity: Dict[str, Any]) -> Dict[str, Any]:
+        entity = dict(entity)
+        if "name" in entity:
+            entity["name"] = _mask(entity["name"])
+        custom_fields = entity.get("custom_fields_values")
+        if custom_fields:
+            entity["custom_fields_values"] = [
+                {
+                    **field,
+                    "values": [
+                        {**value, "value": _mask(value.get("value"))}
+                        for value in field.get("values") or []
+                    ]
+                } if field.get("field_id") in pii_field_ids else field
+                for field in custom_fields
+            ]
+        return entity
+
+    sanitized = dict(body)
+    for section in ("leads", "contacts"):
+        section_data = body.get(section)
+        if not isinstance(section_data, dict):
+            continue
+        sanitized[section] = {
+            event_type: [clean(event) if isinstance(event, dict) else event for event in events or []]
+            for event_type, events in section_data.items()
+        }
+    return sanitized
+
+
+def _captured_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    return {name: headers[name] for name in CAPTURED_HEADERS if headers.get(name) is not None}
+
+
+class WebhookRecorder:
+    """
+    Потокобезопасная запись webhook в сжатый JSONL архив
+
+    record - синхронная запись; submit - постановка в очередь фонового
+    потока записи (при переполнении запись отбрасывается, а не блокирует
+    обработчик webhook).
+    """
+
+    def __init__(self, path: Optional[str] = None, queue_size: Optional[int] = None):
+        self.path = Path(path or settings.webhook_capture_path)
+        self._lock = threading.Lock()
+        self._file = None
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size or settings.webhook_capture_queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.dropped = 0
+
+    def record(self, body: Dict[str, Any], headers: Mapping[str, str], timestamp: Optional[float] = None):
+        """Добавление webhook в архив"""
+        self._write(body, _captured_headers(headers), timestamp, flush=True)
+
+    def submit(self, body: Union[bytes, Dict[str, Any]], headers: Mapping[str, str]):
+        """
+        Добавление webhook в очередь записи
+
+        body - тело запроса (bytes разбираются в потоке записи, поэтому
+        изменения payload при обработке в архив не попадают).
+        """
+        item = (body, _captured_headers(headers), time.time())
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="webhook-capture", daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        """Поток записи: сброс gzip на диск, когда очередь опустела"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            body, headers, timestamp = item
+            try:
+                if isinstance(body, bytes):
+                    body = json.loads(body)
+                self._write(body, headers, timestamp, flush=self._queue.empty())
+            except Exception as e:
+                logger.warning(f"Webhook capture failed: {str(e)}")
+
+    def _write(self, body: Dict[str, Any], headers: Dict[str, str], timestamp: Optional[float], flush: bool):
+        entry = {
+            "ts": timestamp if timestamp is not None else time.time(),
+            "headers": headers,
+            "body": sanitize_payload(body)
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Режим append создает новый gzip member - архив остается читаемым целиком
+                self._file = gzip.open(self.path, "at", encoding="utf-8")
+            self._file.write(line)
+            if flush:
+                self._file.flush()
+            self.recorded += 1
+
+    def close(self):
+        """Запись оставшейся очереди и закрытие архива"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """Чтение записей архива (пропуская поврежденные строки)"""
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line_number, line in enumerate(archive, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed webhook capture line {line_number} in {path}")
+
+
+# Глобальный экземпляр для режима записи
+webhook_recorder = WebhookRecorder()
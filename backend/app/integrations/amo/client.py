@@ -2,6 +2,7 @@ import httpx
 from typing import Dict, Any, Optional, List
 from app.core.config import settings
 from app.core.logging import logger
+from app.core.metrics import amocrm_event_hooks
 from app.integrations.amo.auth import AmoCRMAuth
 
 class AmoCRMClient:
@@ -71,7 +72,7 @@ class AmoCRMClient:
     async def _find_contact_by_phone(self, phone: str, access_token: str) -> Optional[Dict[str, Any]]:
         """Поиск контакта по телефону"""
         try:
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/v4/contacts",
                     headers={"Authorization": f"Bearer {access_token}"},
@@ -113,7 +114,7 @@ class AmoCRMClient:
             })
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.post(
                     f"{self.base_url}/api/v4/contacts",
                     headers={"Authorization": f"Bearer {access_token}"},
@@ -145,7 +146,7 @@ class AmoCRMClient:
             }]
         
         try:
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.patch(
                     f"{self.base_url}/api/v4/contacts/{contact_id}",
                     headers={"Authorization": f"Bearer {access_token}"},
@@ -189,7 +190,7 @@ class AmoCRMClient:
                                 "values": [{"value": utm_value}]
                             })
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.post(
                     f"{self.base_url}/api/v4/leads",
                     headers={"Authorization": f"Bearer {access_token}"},
@@ -217,7 +218,7 @@ class AmoCRMClient:
                 "status_id": status_id
             }
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.patch(
                     f"{self.base_url}/api/v4/leads/{lead_id}",
                     headers={"Authorization": f"Bearer {access_token}"},
@@ -237,7 +238,7 @@ class AmoCRMClient:
         try:
             access_token = await self._get_access_token()
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/v4/leads/{lead_id}",
                     headers={"Authorization": f"Bearer {access_token}"}
@@ -256,7 +257,7 @@ class AmoCRMClient:
         try:
             access_token = await self._get_access_token()
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/v4/contacts/{contact_id}",
                     headers={"Authorization": f"Bearer {access_token}"}
@@ -285,7 +286,7 @@ class AmoCRMClient:
                 }
             }
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.patch(
                     f"{self.base_url}/api/v4/leads/{lead_id}",
                     headers={"Authorization": f"Bearer {access_token}"},
@@ -303,7 +304,7 @@ class AmoCRMClient:
         """Получение или создание тега"""
         try:
             # Поиск существующего тега
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/v4/leads/note_types",
                     headers={"Authorization": f"Bearer {access_token}"}
@@ -348,7 +349,7 @@ class AmoCRMClient:
         try:
             access_token = await self._get_access_token()
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/v4/account",
                     headers={"Authorization": f"Bearer {access_token}"}
@@ -366,7 +367,7 @@ class AmoCRMClient:
         try:
             access_token = await self._get_access_token()
             
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(event_hooks=amocrm_event_hooks()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/v4/account",
                     headers={"Authorization": f"Bearer {access_token}"}
@@ -0,0 +1,273 @@
+"""
+Схлопывание повторных обновлений одного лида из webhook amoCRM
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.logging import logger
+
+
+def _event_version(event: Dict[str, Any]) -> int:
+    """Версия события для упорядочивания (last_modified/updated_at)"""
+    version = event.get("last_modified") or event.get("updated_at") or 0
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return 0
+
+
+def merge_update_events(base: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """Слияние двух событий leads.update: значения более нового события побеждают"""
+    merged = dict(base)
+    for key, value in newer.items():
+        if key == "custom_fields_values":
+            fields = {field.get("field_id"): field for field in merged.get(key) or []}
+            for field in value or []:
+                fields[field.get("field_id")] = field
+            merged[key] = list(fields.values())
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_lead_updates(events: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Схлопывание событий по id лида с сохранением порядка первого появления"""
+    merged: Dict[Any, Dict[str, Any]] = {}
+    passthrough: List[Dict[str, Any]] = []
+
+    # Стабильная сортировка: при равных версиях сохраняется порядок доставки
+    for event in sorted(events, key=_event_version):
+        lead_id = event.get("id") if isinstance(event, dict) else None
+        if not lead_id:
+            passthrough.append(event)
+            continue
+        if lead_id in merged:
+            merged[lead_id] = merge_update_events(merged[lead_id], event)
+        else:
+            merged[lead_id] = event
+
+    return list(merged.values()) + passthrough
+
+
+class BufferedUpdate:
+    """
+    Обновление лида в буфере окна, задачи очереди, из которых оно собрано,
+    и ключи дедупликации исходных событий (отмечаются после записи)
+    """
+
+    __slots__ = ("event", "deadline", "sources", "keys")
+
+    def __init__(self, event: Dict[str, Any], deadline: float, sources: Set[Any],
+                 keys: Optional[List[str]] = None):
+        self.event = event
+        self.deadline = deadline
+        self.sources = sources
+        self.keys = keys or []
+
+
+class LeadUpdateCoalescer:
+    """
+    Схлопывание leads.update внутри payload и (опционально) во временном окне
+
+    При ``window > 0`` обновления буферизуются (только после commit
+    payload) и записываются одним событием на лид по истечении окна.
+    Неудачная запись возвращает обновления в буфер. Для каждого
+    обновления хранятся задачи очереди webhook, из которых оно собрано:
+    задача отмечается выполненной, когда записаны все ее обновления, а
+    после падения процесса захватывается повторно (см. webhook_queue).
+    Счетчик ``saved_writes`` показывает, сколько записей удалось избежать.
+    """
+
+    def __init__(self, window: Optional[float] = None):
+        self.window = settings.webhook_coalesce_window if window is None else window
+        self._pending: Dict[Tuple[Any, Any], BufferedUpdate] = {}
+        # Задача очереди -> число обновлений в буфере; задачи, все обновления которых записаны
+        self._source_refs: Dict[Any, int] = {}
+        self._completed: Set[Any] = set()
+        self._lock = threading.Lock()
+        self.received = 0
+        self.saved_writes = 0
+        self.failed_flushes = 0
+
+    def coalesce(self, events: List[Dict[str, Any]], count: bool = True) -> List[Dict[str, Any]]:
+        """Схлопывание обновлений внутри одного payload (count=False - запись буфера)"""
+        result = merge_lead_updates(events)
+        if count:
+            with self._lock:
+                self.received += len(events)
+                self.saved_writes += len(events) - len(result)
+        return result
+
+    def _release(self, sources: Iterable[Any]):
+        """Обновление записано или отменено; под self._lock"""
+        for source in sources:
+            refs = self._source_refs.get(source, 0) - 1
+            if refs > 0:
+                self._source_refs[source] = refs
+            else:
+                self._source_refs.pop(source, None)
+                self._completed.add(source)
+
+    def _merge(self, key: Tuple[Any, Any], event: Dict[str, Any], sources: Set[Any], deadline: float,
+               event_keys: List[str], retained: bool = False) -> bool:
+        """
+        Добавление обновления в буфер; под self._lock. retained - источники
+        уже учтены в _source_refs (возврат неудачной записи)
+        """
+        buffered = self._pending.get(key)
+        if buffered is None:
+            self._pending[key] = BufferedUpdate(event, deadline, set(sources), list(event_keys))
+            new_sources = set() if retained else sources
+        else:
+            buffered.event = merge_lead_updates([buffered.event, event])[0]
+            buffered.deadline = min(buffered.deadline, deadline)
+            buffered.keys.extend(event_keys)
+            if retained:
+                # Источник в обеих записях теперь учитывается один раз
+                self._release(sources & buffered.sources)
+                new_sources = set()
+            else:
+                new_sources = sources - buffered.sources
+            buffered.sources |= sources
+        for source in new_sources:
+            self._source_refs[source] = self._source_refs.get(source, 0) + 1
+        return buffered is not None
+
+    def buffer(self, account_id: Any, events: List[Dict[str, Any]], source: Any = None,
+               keys: Optional[Dict[Any, List[str]]] = None):
+        """
+        Добавление обновлений зафиксированного payload в буфер окна;
+        keys - ключи дедупликации исходных событий по id лида
+        """
+        deadline = time.monotonic() + self.window
+        sources = {source} if source is not None else set()
+        keys = keys or {}
+        with self._lock:
+            for event in events:
+                lead_id = event.get("id")
+                if self._merge((account_id, lead_id), event, sources, deadline, keys.get(lead_id, [])):
+                    self.saved_writes += 1
+
+    def discard(self, account_id: Any, lead_ids: Iterable[Any]):
+        """Удаление буферизованных обновлений (например, лид удален)"""
+        with self._lock:
+            for lead_id in lead_ids:
+                buffered = self._pending.pop((account_id, lead_id), None)
+                if buffered is not None:
+                    self._release(buffered.sources)
+                    self.saved_writes += 1
+
+    def drain(self, force: bool = False) -> Dict[Any, List[Dict[str, Any]]]:
+        """Извлечение обновлений с истекшим окном, сгруппированных по аккаунту"""
+        return {
+            account_id: [buffered.event for _, buffered in entries]
+            for account_id, entries in self._drain_entries(force).items()
+        }
+
+    def _drain_entries(self, force: bool) -> Dict[Any, List[Tuple[Tuple[Any, Any], BufferedUpdate]]]:
+        now = time.monotonic()
+        due: Dict[Any, List[Tuple[Tuple[Any, Any], BufferedUpdate]]] = {}
+        with self._lock:
+            for key, buffered in list(self._pending.items()):
+                if force or buffered.deadline <= now:
+                    del self._pending[key]
+                    due.setdefault(key[0], []).append((key, buffered))
+        return due
+
+    def _restore(self, entries: List[Tuple[Tuple[Any, Any], BufferedUpdate]]):
+        """Возврат неудачно записанных обновлений в буфер (повтор через окно)"""
+        deadline = time.monotonic() + self.window
+        with self._lock:
+            self.failed_flushes += 1
+            for key, buffered in entries:
+                self._merge(key, buffered.event, buffered.sources, deadline, buffered.keys, retained=True)
+
+    def flush(self, session_factory: Callable, force: bool = False) -> int:
+        """Запись накопленных обновлений в БД"""
+        from app.services.webhook_service import WebhookService
+
+        written = 0
+        for account_id, entries in self._drain_entries(force).items():
+            events = [buffered.event for _, buffered in entries]
+            # Ключи доставленных событий отмечаются вместе с записью схлопнутого
+            update_keys = {key[1]: buffered.keys for key, buffered in entries if key[1] and buffered.keys}
+            try:
+                db = session_factory()
+                try:
+                    body = {"account": {"id": account_id}, "leads": {"update": events}}
+                    result = WebhookService(
+                        db, coalescer=self, buffer_updates=False, update_keys=update_keys
+                    ).process_payload(body)
+                finally:
+                    db.close()
+            except Exception as e:
+                result = {"committed": False, "processed": 0, "errors": [str(e)]}
+
+            if not result["committed"]:
+                logger.error(f"Coalesced lead updates were not saved, will retry: {result['errors']}")
+                self._restore(entries)
+                continue
+
+            written += result["processed"]
+            with self._lock:
+                for _, buffered in entries:
+                    self._release(buffered.sources)
+
+        self._complete_sources(session_factory)
+        return written
+
+    def _complete_sources(self, session_factory: Callable):
+        """Отметка задач очереди, все обновления которых записаны"""
+        with self._lock:
+            completed, self._completed = self._completed, set()
+        if not completed:
+            return
+
+        from app.services.webhook_queue import complete_buffered_items
+
+        try:
+            db = session_factory()
+            try:
+                # Задачи, результат которых еще не зафиксирован, - при следующей записи
+                retry = complete_buffered_items(db, completed)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.error(f"Error completing buffered webhook queue items: {str(e)}")
+            retry = completed
+        if retry:
+            with self._lock:
+                self._completed |= retry
+
+    async def run(self, session_factory: Callable, stop_event: asyncio.Event):
+        """Фоновая запись буфера; при остановке буфер сбрасывается полностью"""
+        interval = max(self.window / 2, 0.05)
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.to_thread(self.flush, session_factory, stop_event.is_set())
+            except Exception as e:
+                logger.error(f"Error flushing coalesced lead updates: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика схлопывания для подбора размера окна"""
+        with self._lock:
+            return {
+                "window": self.window,
+                "received": self.received,
+                "saved_writes": self.saved_writes,
+                "pending": len(self._pending),
+                "pending_sources": len(self._source_refs),
+                "failed_flushes": self.failed_flushes
+            }
+
+
+# Глобальный экземпляр для webhook pipeline
+lead_update_coalescer = LeadUpdateCoalescer()
@@ -0,0 +1,130 @@
+"""
+Дедупликация повторных доставок webhook событий amoCRM
+"""
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Iterable, Optional, Set
+
+from app.core.cache import TTLCache, get_redis_client
+from app.core.config import settings
+from app.core.logging import logger
+
+
+def event_key(account_id: Any, entity: str, event: Dict[str, Any]) -> Optional[str]:
+    """
+    Ключ события: (аккаунт, сущность, id, last_modified/updated_at, дайджест тела)
+
+    Метки времени amoCRM - в целых секундах: две разные правки сущности
+    за одну секунду отличаются только телом события, поэтому пропускается
+    лишь повторная доставка того же самого события.
+
+    Для событий без метки времени ключ не строится (кроме удалений) -
+    такие события нельзя отличить от новой версии той же сущности.
+    """
+    entity_id = event.get("id")
+    if not entity_id:
+        return None
+
+    version = event.get("last_modified") or event.get("updated_at")
+    if version is None:
+        if not entity.endswith(".delete"):
+            return None
+        version = "-"
+
+    digest = hashlib.sha1(
+        json.dumps(event, sort_keys=True, separators=(",", ":"), default=str).encode()
+    ).hexdigest()[:16]
+    return f"{account_id or '-'}:{entity}:{entity_id}:{version}:{digest}"
+
+
+class EventDeduplicator:
+    """
+    Хранилище уже обработанных событий
+
+    Первый уровень - in-process LRU с TTL, второй (опционально) - Redis,
+    общий для всех воркеров и реплик.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[int] = None,
+        use_redis: Optional[bool] = None,
+        redis_client=None
+    ):
+        self.ttl = ttl or settings.webhook_dedup_ttl
+        self.local = TTLCache(max_entries or settings.webhook_dedup_max_entries, self.ttl)
+        self.use_redis = settings.webhook_dedup_redis if use_redis is None else use_redis
+        self._redis = redis_client
+        self._prefix = f"{settings.cache_prefix}webhook:seen:"
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def redis(self):
+        if self._redis is None and self.use_redis:
+            self._redis = get_redis_client()
+        return self._redis
+
+    def filter_seen(self, keys: Iterable[str]) -> Set[str]:
+        """Возвращает подмножество ключей, которые уже были обработаны"""
+        keys = list(dict.fromkeys(keys))
+        seen = {key for key in keys if key in self.local}
+        remaining = [key for key in keys if key not in seen]
+
+        if remaining and self.redis is not None:
+            try:
+                values = self.redis.mget([self._prefix + key for key in remaining])
+                for key, value in zip(remaining, values):
+                    if value is not None:
+                        seen.add(key)
+                        self.local.set(key, True)
+            except Exception as e:
+                logger.warning(f"Redis dedup lookup failed, using local tier only: {str(e)}")
+
+        with self._lock:
+            self.hits += len(seen)
+            self.misses += len(keys) - len(seen)
+        return seen
+
+    def mark(self, keys: Iterable[str]):
+        """Отметка событий как обработанных"""
+        keys = list(keys)
+        if not keys:
+            return
+
+        for key in keys:
+            self.local.set(key, True)
+
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.set(self._prefix + key, 1, ex=self.ttl)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Redis dedup mark failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "local_entries": len(self.local),
+            "redis_enabled": self.use_redis
+        }
+
+    def clear(self):
+        self.local.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+# Глобальный экземпляр для webhook pipeline
+webhook_deduplicator = EventDeduplicator()
@@ -0,0 +1,204 @@
+"""
+Маппинг кастомных полей amoCRM на поля лида
+
+Конфигурация хранится по аккаунту amoCRM (``APIIntegration.config`` в
+админ-панели) в виде ``{"field_mapping": {"phone": 123456, ...}}`` и
+компилируется в плоскую таблицу ``field_id -> setter``, поэтому разбор
+``custom_fields_values`` выполняется за один проход независимо от
+количества настроенных полей.
+"""
+
+import json
+import math
+import threading
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from app.core.config import settings
+from app.core.logging import logger
+
+
+# Маппинг по умолчанию (поля тестового аккаунта amoCRM)
+DEFAULT_FIELD_MAPPING = {
+    "phone": 123456,         # Телефон
+    "email": 123457,         # Email
+    "utm_source": 123458,    # UTM Source
+    "utm_medium": 123459,    # UTM Medium
+    "utm_campaign": 123460,  # UTM Campaign
+    "utm_content": 123461,   # UTM Content
+    "utm_term": 123462       # UTM Term
+}
+
+UTM_FIELDS = ("utm_source", "utm_medium", "utm_campaign", "utm_content", "utm_term")
+CONTACT_FIELDS = ("phone", "email")
+SUPPORTED_FIELDS = frozenset(UTM_FIELDS + CONTACT_FIELDS)
+
+Setter = Callable[[Dict[str, Any], Dict[str, Any]], None]
+
+
+def _set_first_value(target: str, result: Dict[str, Any], field: Dict[str, Any]):
+    """Запись первого значения кастомного поля"""
+    values = field.get("values")
+    if values:
+        result[target] = values[0].get("value")
+
+
+class CompiledFieldMapping:
+    """Скомпилированная таблица ``field_id -> setter`` одного аккаунта"""
+
+    def __init__(self, mapping: Dict[str, Any]):
+        self.mapping = dict(mapping)
+        self.setters: Dict[int, Setter] = {}
+
+        for target, field_id in self.mapping.items():
+            if target not in SUPPORTED_FIELDS:
+                logger.warning(f"Unsupported amoCRM field mapping target: {target}")
+                continue
+            try:
+                self.setters[int(field_id)] = partial(_set_first_value, target)
+            except (TypeError, ValueError):
+                logger.warning(f"Invalid amoCRM field id for {target}: {field_id}")
+
+    def extract(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Один проход по ``custom_fields_values`` события"""
+        result: Dict[str, Any] = {}
+        setters = self.setters
+        for field in data.get("custom_fields_values") or []:
+            setter = setters.get(field.get("field_id"))
+            if setter is not None:
+                setter(result, field)
+        return result
+
+
+def _load_from_settings(account_id: Any) -> Optional[Dict[str, Any]]:
+    """Маппинг из AMOCRM_FIELD_MAPPING (JSON, ключ - ID аккаунта или "*")"""
+    config = settings.amocrm_field_mapping
+    return config.get(str(account_id)) or config.get("*")
+
+
+# Движок БД админ-панели: один на процесс, создается при первой загрузке
+_admin_engine = None
+_admin_engine_url: Optional[str] = None
+_admin_engine_lock = threading.Lock()
+
+
+def get_admin_engine():
+    """Движок БД админ-панели с коротким таймаутом подключения"""
+    global _admin_engine, _admin_engine_url
+    url = settings.admin_db_url
+    with _admin_engine_lock:
+        if _admin_engine is None or _admin_engine_url != url:
+            if _admin_engine is not None:
+                _admin_engine.dispose()
+            connect_args = {}
+            if make_url(url).get_backend_name() == "postgresql":
+                connect_args["connect_timeout"] = settings.admin_db_connect_timeout
+            _admin_engine = create_engine(url, pool_pre_ping=True, connect_args=connect_args)
+            _admin_engine_url = url
+        return _admin_engine
+
+
+def _load_from_admin(account_id: Any) -> Optional[Dict[str, Any]]:
+    """Маппинг из ``APIIntegration.config`` активной интеграции amoCRM"""
+    if not settings.admin_db_url:
+        return None
+
+    with get_admin_engine().connect() as conn:
+        rows = conn.execute(text(
+            "SELECT config FROM integrations_apiintegration "
+            "WHERE integration_type = 'amocrm' AND status = 'active'"
+        )).fetchall()
+
+    fallback = None
+    for (config,) in rows:
+        if isinstance(config, str):
+            config = json.loads(config)
+        mapping = (config or {}).get("field_mapping")
+        if not mapping:
+            continue
+        if str(config.get("account_id")) == str(account_id):
+            return mapping
+        if config.get("account_id") is None and fallback is None:
+            fallback = mapping
+    return fallback
+
+
+class FieldMappingRegistry:
+    """
+    Реестр скомпилированных маппингов по аккаунтам
+
+    Маппинг загружается при первом обращении и перезагружается через ttl
+    секунд (изменения в админке применяются без перезапуска). Если
+    загрузчик упал (например, БД админки недоступна), до повтора через
+    retry_interval секунд используется последний успешно загруженный
+    маппинг, а если его нет - маппинг по умолчанию. Поэтому недоступная
+    БД админки не задерживает каждый webhook попыткой подключения.
+    """
+
+    def __init__(self, loaders: Optional[Iterable[Callable[[Any], Optional[Dict[str, Any]]]]] = None,
+                 ttl: Optional[float] = None, retry_interval: Optional[float] = None):
+        self.loaders = list(loaders) if loaders is not None else [_load_from_admin, _load_from_settings]
+        self.ttl = settings.amocrm_field_mapping_ttl if ttl is None else ttl
+        self.retry_interval = (
+            settings.amocrm_field_mapping_retry_interval if retry_interval is None else retry_interval
+        )
+        # account_id -> (маппинг, момент устаревания по time.monotonic)
+        self._compiled: Dict[Any, Tuple[CompiledFieldMapping, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, account_id: Any) -> CompiledFieldMapping:
+        """Маппинг аккаунта (компилируется при первом обращении и по истечении ttl)"""
+        key = str(account_id) if account_id is not None else None
+        entry = self._compiled.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        mapping, complete = self._load(account_id)
+        if complete:
+            compiled = CompiledFieldMapping(mapping)
+            expires_at = now + self.ttl if self.ttl > 0 else math.inf
+        else:
+            # Последний успешный маппинг (или по умолчанию) - до повтора загрузки
+            compiled = entry[0] if entry is not None else CompiledFieldMapping(mapping)
+            expires_at = now + self.retry_interval
+        with self._lock:
+            self._compiled[key] = (compiled, expires_at)
+        return compiled
+
+    def register(self, account_id: Any, mapping: Dict[str, Any]):
+        """Явная регистрация маппинга (не устаревает до invalidate)"""
+        with self._lock:
+            self._compiled[str(account_id)] = (
+                CompiledFieldMapping({**DEFAULT_FIELD_MAPPING, **mapping}), math.inf
+            )
+
+    def invalidate(self, account_id: Any = None):
+        """Сброс маппинга аккаунта (или всех) для повторной загрузки"""
+        with self._lock:
+            if account_id is None:
+                self._compiled.clear()
+            else:
+                self._compiled.pop(str(account_id), None)
+
+    def _load(self, account_id: Any) -> Tuple[Dict[str, Any], bool]:
+        """Маппинг аккаунта и признак, что ни один загрузчик не упал"""
+        complete = True
+        for loader in self.loaders:
+            try:
+                mapping = loader(account_id)
+            except Exception as e:
+                logger.warning(f"amoCRM field mapping loader {loader.__name__} failed: {str(e)}")
+                complete = False
+                continue
+            if mapping:
+                return {**DEFAULT_FIELD_MAPPING, **mapping}, complete
+        return dict(DEFAULT_FIELD_MAPPING), complete
+
+
+# Глобальный реестр для webhook pipeline
+field_mapping_registry = FieldMappingRegistry()
@@ -0,0 +1,315 @@
+"""
+Воспроизведение записанного webhook трафика amoCRM через ASGI транспорт
+
+Архив из ``WebhookRecorder`` подается в приложение внутри процесса (без
+сети), с записанной скоростью, с ускорением в N раз или максимально
+быстро. По итогам считаются события/с, перцентили задержки и число SQL
+запросов на событие.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.core.db import Base, get_async_db, get_async_url, get_db
+
+WEBHOOK_PATH = "/api/webhooks/amo"
+
+
+def count_events(body: Dict[str, Any]) -> int:
+    """Число событий в payload"""
+    total = 0
+    for section in ("leads", "contacts"):
+        section_data = body.get(section)
+        if isinstance(section_data, dict):
+            total += sum(len(events or []) for events in section_data.values())
+    return total
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Перцентиль по отсортированной выборке (nearest-rank)"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class StatementCounter:
+    """Счетчик SQL запросов движка"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._before_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._before_execute)
+
+
+@contextmanager
+def rate_limit_disabled():
+    """Отключение rate limit API на время воспроизведения"""
+    from app.core import security
+
+    async def allow(*args, **kwargs):
+        return True
+
+    original = security.rate_limiter.is_allowed
+    security.rate_limiter.is_allowed = allow
+    try:
+        yield
+    finally:
+        security.rate_limiter.is_allowed = original
+
+
+class ReplayDatabase:
+    """
+    БД прогона: синхронный движок (webhook обрабатывается в пуле потоков
+    и в полосах) и асинхронный движок на той же БД
+    """
+
+    __slots__ = ("engine", "sync_engine", "session_factory", "_lanes", "_lanes_session_factory")
+
+    def __init__(self, engine, sync_engine, session_factory):
+        self.engine = engine
+        self.sync_engine = sync_engine
+        self.session_factory = session_factory
+        self._lanes = None
+        self._lanes_session_factory = None
+
+    def attach_lanes(self, processor):
+        """Запись полос (PartitionedWebhookProcessor) в БД прогона"""
+        self._lanes = processor
+        self._lanes_session_factory = processor.session_factory
+        processor.session_factory = self.session_factory
+
+    async def close(self, asgi_app):
+        """Снятие подмен зависимостей и закрытие движков"""
+        asgi_app.dependency_overrides.pop(get_db, None)
+        asgi_app.dependency_overrides.pop(get_async_db, None)
+        if self._lanes is not None:
+            self._lanes.session_factory = self._lanes_session_factory
+            self._lanes = None
+        await self.engine.dispose()
+        self.sync_engine.dispose()
+
+
+def _is_memory_sqlite(database_url: str) -> bool:
+    url = make_url(database_url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _replay_url(database_url: str) -> str:
+    """
+    In-memory SQLite у каждого соединения своя: синхронный и асинхронный
+    движки прогона работают с одной именованной БД с общим кэшем
+    """
+    if _is_memory_sqlite(database_url):
+        return f"sqlite:///file:replay-{uuid.uuid4().hex}?mode=memory&cache=shared&uri=true"
+    return database_url
+
+
+async def setup_replay_database(asgi_app, database_url: str = "sqlite://") -> ReplayDatabase:
+    """
+    Движки для прогона и подмена зависимостей ``get_db`` и ``get_async_db``
+
+    При WEBHOOK_LANES>0 полосы тоже пишут в БД прогона; им нужна БД на
+    диске или сервере (in-memory SQLite одна на соединение и не
+    допускает параллельной записи) - иначе ValueError.
+    Вызывающий отвечает за ``close()``.
+    """
+    import app.models  # noqa: F401 - регистрация моделей в metadata
+    import app.models.user  # noqa: F401
+    import app.models.notification  # noqa: F401
+    from app.services.webhook_lanes import get_partitioned_processor
+
+    lanes = get_partitioned_processor()
+    memory = _is_memory_sqlite(database_url)
+    if lanes is not None and memory:
+        raise ValueError("WEBHOOK_LANES>0: replay requires an on-disk or server database (--database-url)")
+
+    database_url = _replay_url(database_url)
+    url = get_async_url(database_url)
+    if memory:
+        engine = create_async_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        sync_engine = create_engine(
+            database_url, connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+    elif url.startswith("sqlite"):
+        engine = create_async_engine(url, connect_args={"check_same_thread": False})
+        sync_engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    else:
+        engine = create_async_engine(url)
+        sync_engine = create_engine(database_url)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async_session_factory = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    session_factory = sessionmaker(bind=sync_engine, autocommit=False, autoflush=False)
+
+    async def override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    asgi_app.dependency_overrides[get_async_db] = override_get_async_db
+    asgi_app.dependency_overrides[get_db] = override_get_db
+    database = ReplayDatabase(engine, sync_engine, session_factory)
+    if lanes is not None:
+        database.attach_lanes(lanes)
+    return database
+
+
+def _sign(content: bytes) -> str:
+    """Подпись тела для WebhookSignatureMiddleware"""
+    return hmac.new(
+        (settings.amocrm_webhook_secret or "").encode(),
+        content,
+        hashlib.sha256
+    ).hexdigest()
+
+
+async def replay_records(
+    records: Iterable[Dict[str, Any]],
+    app,
+    speed: float = 0.0,
+    statement_counter: Optional[StatementCounter] = None
+) -> Dict[str, Any]:
+    """
+    Подача записей в приложение
+
+    ``speed``: 0 - максимально быстро, 1 - с записанной скоростью,
+    N - с ускорением в N раз.
+    """
+    latencies: List[float] = []
+    status_counts: Dict[int, int] = {}
+    events = 0
+    first_ts = None
+    start_statements = statement_counter.count if statement_counter else 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        started = time.perf_counter()
+        for record in records:
+            if speed > 0 and record.get("ts") is not None:
+                if first_ts is None:
+                    first_ts = record["ts"]
+                delay = (record["ts"] - first_ts) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            content = json.dumps(record["body"], ensure_ascii=False).encode("utf-8")
+            headers = dict(record.get("headers") or {})
+            headers["content-type"] = "application/json"
+            headers["X-Webhook-Signature"] = _sign(content)
+
+            request_started = time.perf_counter()
+            response = await client.post(WEBHOOK_PATH, content=content, headers=headers)
+            latencies.append(time.perf_counter() - request_started)
+
+            status_counts[response.status_code] = status_counts.get(response.status_code, 0) + 1
+            events += count_events(record["body"])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    statements = (statement_counter.count - start_statements) if statement_counter else None
+    return {
+        "requests": len(latencies),
+        "events": events,
+        "elapsed_seconds": round(elapsed, 4),
+        "events_per_second": round(events / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3)
+        },
+        "statements_per_event": round(statements / events, 3) if statements is not None and events else None,
+        "status_counts": status_counts
+    }
+
+
+def synthetic_records(count: int, seed: int = 42, interval: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    Детерминированный архив в формате payload из scripts/test_webhook_server.py
+
+    Смесь новых лидов с UTM, контактов, повторных обновлений и удалений.
+    """
+    rng = random.Random(seed)
+    sources = ["google", "yandex", "facebook", "vk", "direct"]
+    records = []
+    next_lead_id = 10000
+    known_leads: List[int] = []
+
+    for index in range(count):
+        ts = 1700000000 + index * interval
+        body: Dict[str, Any] = {"account": {"id": "replay-account"}, "leads": {}, "contacts": {}}
+
+        roll = rng.random()
+        if roll < 0.4 or not known_leads:
+            lead_id = next_lead_id
+            next_lead_id += 1
+            known_leads.append(lead_id)
+            body["leads"]["add"] = [{
+                "id": lead_id,
+                "name": f"Лид {lead_id}",
+                "status_id": 1,
+                "created_at": int(ts),
+                "custom_fields_values": [
+                    {"field_id": 123458, "values": [{"value": rng.choice(sources)}]},
+                    {"field_id": 123459, "values": [{"value": "cpc"}]}
+                ],
+                "_embedded": {"contacts": [{"id": lead_id + 50000}]}
+            }]
+            body["contacts"]["add"] = [{
+                "id": lead_id + 50000,
+                "name": f"Контакт {lead_id}",
+                "custom_fields_values": [
+                    {"field_id": 123456, "values": [{"value": f"+7900{lead_id:07d}"}]},
+                    {"field_id": 123457, "values": [{"value": f"lead{lead_id}@example.com"}]}
+                ]
+            }]
+        elif roll < 0.9:
+            # Пачка обновлений, часто по одному и тому же лиду
+            lead_ids = [rng.choice(known_leads) for _ in range(rng.randint(1, 5))]
+            body["leads"]["update"] = [
+                {"id": lead_id, "status_id": rng.randint(1, 7), "updated_at": int(ts) + offset}
+                for offset, lead_id in enumerate(lead_ids)
+            ]
+        else:
+            body["leads"]["delete"] = [{"id": rng.choice(known_leads)}]
+
+        records.append({
+            "ts": ts,
+            "headers": {"x-account-id": "replay-account", "x-client-uuid": "replay-client"},
+            "body": body
+        })
+
+    return records
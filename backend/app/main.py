@@ -21,10 +21,74 @@ async def lifespan(app: FastAPI):
     logger.info(f"Debug mode: {settings.debug}")
     logger.info(f"Log level: {settings.log_level}")
     
+    # Отдельный listener метрик
+    if settings.enable_metrics and settings.metrics_sidecar:
+        from app.core.metrics import start_metrics_server
+        start_metrics_server(settings.metrics_port)
+    
+    # Фоновые воркеры очереди webhook (режим быстрого ответа)
+    webhook_workers = None
+    if settings.webhook_async_mode:
+        from app.services.webhook_queue import WebhookWorkerPool
+        webhook_workers = WebhookWorkerPool()
+        webhook_workers.start()
+        app.state.webhook_workers = webhook_workers
+    
+    # Фоновая запись схлопнутых обновлений лидов (окно буферизации)
+    coalescer_stop = None
+    coalescer_task = None
+    if settings.webhook_coalesce_enabled and settings.webhook_coalesce_window > 0:
+        import asyncio
+        from app.core.db import SessionLocal
+        from app.integrations.amo.coalescer import lead_update_coalescer
+        coalescer_stop = asyncio.Event()
+        coalescer_task = asyncio.create_task(lead_update_coalescer.run(SessionLocal, coalescer_stop))
+    
+    # Фоновое обновление колоночного движка аналитики
+    engine_stop = None
+    engine_task = None
+    if settings.analytics_engine_enabled:
+        import asyncio
+        from app.analytics.engine import analytics_engine
+        from app.core.db import SessionLocal
+        if analytics_engine.available:
+            engine_stop = asyncio.Event()
+            engine_task = asyncio.create_task(analytics_engine.run(SessionLocal, engine_stop))
+        else:
+            logger.warning("NumPy is not installed, analytics engine disabled")
+    
+    # Фоновое обновление снимков дашборда
+    snapshots_stop = None
+    snapshots_task = None
+    if settings.analytics_snapshots_enabled:
+        import asyncio
+        from app.analytics.snapshots import dashboard_snapshots
+        from app.core.db import SessionLocal
+        snapshots_stop = asyncio.Event()
+        snapshots_task = asyncio.create_task(dashboard_snapshots.run(SessionLocal, snapshots_stop))
+    
     yield
     
     # Shutdown
     logger.info("Shutting down APEX API")
+    if snapshots_task is not None:
+        snapshots_stop.set()
+        await snapshots_task
+    if engine_task is not None:
+        engine_stop.set()
+        await engine_task
+    if webhook_workers is not None:
+        await webhook_workers.stop()
+    if coalescer_task is not None:
+        coalescer_stop.set()
+        await coalescer_task
+    
+    from app.services.webhook_lanes import shutdown_partitioned_processor
+    shutdown_partitioned_processor()
+    from app.integrations.amo.capture import webhook_recorder
+    webhook_recorder.close()
+    from app.core.db import dispose_async_engine
+    await dispose_async_engine()
 
 app = FastAPI(
     title="APEX Asia Property Exchange API",
@@ -160,7 +224,7 @@ async def root():
 
 # Подключаем все API роутеры
 try:
-    from app.api import webhooks, auth, leads, analytics, notifications
+    from app.api import webhooks, auth, leads, analytics, notifications, export
     
     # Webhooks роутер
     app.include_router(
@@ -197,11 +261,22 @@ try:
         tags=["notifications"]
     )
     
+    # Export роутер (потоковая выгрузка)
+    app.include_router(
+        export.router, 
+        prefix=f"{settings.api_prefix}/export", 
+        tags=["export"]
+    )
+    
     logger.info("All API routers loaded successfully")
     
 except ImportError as e:
     logger.warning(f"Some API modules not available: {e}")
 
+# Метрики Prometheus (после подключения роутеров, чтобы обернуть все маршруты)
+from app.core.metrics import setup_metrics
+setup_metrics(app)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,5 +1,9 @@
 from .lead import Lead
 from .deal import Deal
 from .amocrm_token import AmoCRMToken
+from .webhook_queue import WebhookQueueItem
+from .lead_daily_rollup import LeadDailyRollup
+from .ad_spend import AdSpend
+from .lead_status_history import LeadStatusHistory
 
-__all__ = ["Lead", "Deal", "AmoCRMToken"]
+__all__ = ["Lead", "Deal", "AmoCRMToken", "WebhookQueueItem", "LeadDailyRollup", "AdSpend", "LeadStatusHistory"]
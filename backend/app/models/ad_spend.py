@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Date, DateTime, Float, Index, String
+from sqlalchemy.sql import func
+
+from app.core.db import Base
+
+
+class AdSpend(Base):
+    """
+    Расходы на рекламу за день по UTM источнику и кампании
+
+    Заполняется импортом выгрузок рекламных кабинетов
+    (scripts/import_ad_spend.py, POST /api/analytics/spend/import);
+    для расчетов читается в память целиком (app.analytics.spend).
+    Расход без кампании хранится с utm_campaign = ''.
+    """
+    __tablename__ = "ad_spend"
+
+    day = Column(Date, primary_key=True)
+    utm_source = Column(String(100), primary_key=True)
+    utm_campaign = Column(String(100), primary_key=True, default="")
+
+    cost = Column(Float, nullable=False, default=0.0)
+
+    # Признак изменения данных для перезагрузки индекса в памяти
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_ad_spend_updated_at", "updated_at"),
+    )
+
+    def __repr__(self):
+        return f"<AdSpend(day={self.day}, utm_source='{self.utm_source}', campaign='{self.utm_campaign}', cost={self.cost})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.db import Base
@@ -35,5 +35,11 @@ class Deal(Base):
     # Связи
     lead = relationship("Lead", back_populates="deals")
     
+    # Водяной знак инкрементальной загрузки движка аналитики
+    __table_args__ = (
+        Index("ix_deals_created_at", "created_at"),
+        Index("ix_deals_updated_at", "updated_at"),
+    )
+    
     def __repr__(self):
         return f"<Deal(id={self.id}, amocrm_id={self.amocrm_deal_id}, amount={self.amount})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Index, DDL, event
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.db import Base
@@ -19,13 +19,16 @@ class Lead(Base):
     utm_term = Column(String(100), nullable=True)
     
     # amoCRM интеграция
-    amocrm_contact_id = Column(Integer, nullable=True)
-    amocrm_lead_id = Column(Integer, nullable=True)
+    amocrm_contact_id = Column(Integer, nullable=True, index=True)
+    amocrm_lead_id = Column(Integer, nullable=True, index=True)
     
     # Статус и метаданные
     status = Column(String(50), default="new")
     source = Column(String(100), default="landing")
     
+    # Ответственный менеджер (users.id)
+    assigned_to = Column(Integer, nullable=True, index=True)
+    
     # Финансовые данные
     cost = Column(Float, default=0.0)
     revenue = Column(Float, default=0.0)
@@ -37,5 +40,38 @@ class Lead(Base):
     # Связи
     deals = relationship("Deal", back_populates="lead")
     
+    # Keyset пагинация: ORDER BY created_at DESC, id DESC (с фильтром по статусу и без);
+    # updated_at - водяной знак инкрементальной загрузки движка аналитики
+    __table_args__ = (
+        Index("ix_leads_created_at_id", "created_at", "id"),
+        Index("ix_leads_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_leads_updated_at", "updated_at"),
+    )
+    
     def __repr__(self):
         return f"<Lead(id={self.id}, name='{self.name}', phone='{self.phone}')>"
+
+
+# Полнотекстовый индекс для SQLite (тесты, локальный запуск): FTS5 таблица
+# с внешним содержимым и триггеры синхронизации. На PostgreSQL поиск идет
+# по GIN индексам из миграции 20251017000004 (см. app/services/lead_search.py)
+LEADS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5("
+    "name, email, phone, content='leads', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS leads_fts_ai AFTER INSERT ON leads BEGIN "
+    "INSERT INTO leads_fts(rowid, name, email, phone) VALUES (new.id, new.name, new.email, new.phone); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS leads_fts_ad AFTER DELETE ON leads BEGIN "
+    "INSERT INTO leads_fts(leads_fts, rowid, name, email, phone) "
+    "VALUES ('delete', old.id, old.name, old.email, old.phone); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS leads_fts_au AFTER UPDATE OF name, email, phone ON leads BEGIN "
+    "INSERT INTO leads_fts(leads_fts, rowid, name, email, phone) "
+    "VALUES ('delete', old.id, old.name, old.email, old.phone); "
+    "INSERT INTO leads_fts(rowid, name, email, phone) VALUES (new.id, new.name, new.email, new.phone); "
+    "END",
+)
+
+for _statement in LEADS_FTS_DDL:
+    event.listen(Lead.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+event.listen(Lead.__table__, "before_drop", DDL("DROP TABLE IF EXISTS leads_fts").execute_if(dialect="sqlite"))
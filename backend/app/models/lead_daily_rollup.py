@@ -0,0 +1,167 @@
+from datetime import date, datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Column, Date, Float, Integer, String, event, inspect, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from app.core.db import Base
+from app.models.lead import Lead
+
+# Измерения агрегата в порядке первичного ключа (day вычисляется из created_at)
+ROLLUP_DIMENSIONS = ("source", "utm_source", "utm_medium", "utm_campaign", "status")
+# Поля лида, изменение которых переносит его в другую строку агрегата
+ROLLUP_TRACKED = ROLLUP_DIMENSIONS + ("created_at", "revenue")
+
+
+class LeadDailyRollup(Base):
+    """
+    Дневной агрегат лидов по источнику, UTM меткам и статусу
+
+    Поддерживается инкрементально при каждом flush сессии (см.
+    apply_lead_rollup ниже); восстановление - scripts/rebuild_lead_rollup.py.
+    NULL измерения хранятся как '' (иначе не работает уникальность ключа).
+    """
+    __tablename__ = "lead_daily_rollup"
+
+    day = Column(Date, primary_key=True)
+    source = Column(String(100), primary_key=True, default="")
+    utm_source = Column(String(100), primary_key=True, default="")
+    utm_medium = Column(String(100), primary_key=True, default="")
+    utm_campaign = Column(String(100), primary_key=True, default="")
+    status = Column(String(50), primary_key=True, default="")
+
+    leads_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<LeadDailyRollup(day={self.day}, source='{self.source}', status='{self.status}', leads={self.leads_count})>"
+
+
+RollupKey = Tuple[date, str, str, str, str, str]
+
+
+def rollup_day(created_at: Optional[datetime]) -> date:
+    """День лида; для еще не загруженного server_default - текущий день UTC"""
+    if created_at is None:
+        return datetime.now(timezone.utc).date()
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date()
+
+
+def rollup_key(values: Dict[str, object]) -> RollupKey:
+    return (rollup_day(values["created_at"]),) + tuple(values[name] or "" for name in ROLLUP_DIMENSIONS)
+
+
+def _current_values(lead: Lead) -> Dict[str, object]:
+    # Без загрузки: не выставленный server_default (created_at) - None
+    loaded = inspect(lead).dict
+    return {name: loaded.get(name) for name in ROLLUP_TRACKED}
+
+
+def _previous_values(lead: Lead) -> Optional[Dict[str, object]]:
+    """Значения до изменений в текущем flush; None - ни одно поле агрегата не менялось"""
+    values = {}
+    changed = False
+    for name in ROLLUP_TRACKED:
+        history = get_history(lead, name)
+        if history.has_changes():
+            # Пустой deleted - прежнее значение было NULL
+            values[name] = history.deleted[0] if history.deleted else None
+            changed = True
+        else:
+            values[name] = history.unchanged[0] if history.unchanged else None
+    return values if changed else None
+
+
+def _keep_previous_value(target, value, oldvalue, initiator):
+    pass
+
+
+# active_history: прежнее значение загружается при присваивании, иначе для
+# просроченного после commit объекта неизвестно, из какой строки вычитать лид
+for _name in ROLLUP_TRACKED:
+    event.listen(getattr(Lead, _name), "set", _keep_previous_value, active_history=True)
+
+
+def collect_rollup_deltas(session: Session) -> Dict[RollupKey, list]:
+    """Изменения агрегата (лиды, выручка) по ключу для объектов текущего flush"""
+    deltas: Dict[RollupKey, list] = {}
+
+    def add(values: Dict[str, object], sign: int):
+        delta = deltas.setdefault(rollup_key(values), [0, 0.0])
+        delta[0] += sign
+        delta[1] += sign * float(values["revenue"] or 0.0)
+
+    for obj in session.new:
+        if isinstance(obj, Lead):
+            add(_current_values(obj), 1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Lead) and session.is_modified(obj, include_collections=False):
+            previous = _previous_values(obj)
+            if previous is not None:
+                add(previous, -1)
+                add(_current_values(obj), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Lead):
+            add(_previous_values(obj) or _current_values(obj), -1)
+
+    return {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+
+
+def apply_rollup_deltas(connection, deltas: Dict[RollupKey, list]):
+    """Добавление изменений к строкам агрегата (upsert одним executemany)"""
+    if not deltas:
+        return
+
+    table = LeadDailyRollup.__table__
+    rows = [
+        dict(zip(("day",) + ROLLUP_DIMENSIONS, key), leads_count=count, revenue=revenue)
+        for key, (count, revenue) in deltas.items()
+    ]
+
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.day] + [table.c[name] for name in ROLLUP_DIMENSIONS],
+            set_={
+                "leads_count": table.c.leads_count + statement.excluded.leads_count,
+                "revenue": table.c.revenue + statement.excluded.revenue,
+            }
+        )
+        connection.execute(statement, rows)
+        return
+
+    # Прочие диалекты: UPDATE, при отсутствии строки - INSERT
+    for row in rows:
+        key_filter = [table.c.day == row["day"]] + [table.c[name] == row[name] for name in ROLLUP_DIMENSIONS]
+        result = connection.execute(
+            update(table).where(*key_filter).values(
+                leads_count=table.c.leads_count + row["leads_count"],
+                revenue=table.c.revenue + row["revenue"],
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), row)
+
+
+@event.listens_for(Session, "after_flush")
+def apply_lead_rollup(session: Session, flush_context):
+    """
+    Обновление агрегата в той же транзакции, что и изменение лидов
+
+    Покрывает создание лидов, смену статуса и webhook обработку (все они
+    идут через ORM). Массовые query().update()/delete() агрегат не
+    обновляют - после них нужен rebuild.
+    """
+    deltas = collect_rollup_deltas(session)
+    if deltas:
+        apply_rollup_deltas(session.connection(), deltas)
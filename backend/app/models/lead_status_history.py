@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import Session, relationship
+
+from app.core.db import Base
+from app.models.lead import Lead
+
+
+class LeadStatusHistory(Base):
+    """
+    Журнал смен статуса лида (только добавление)
+
+    Пишется при смене статуса через LeadService.change_lead_status и из
+    webhook amoCRM; вход лида в начальный статус - его created_at.
+    Читается движком воронки (app.analytics.funnel).
+    """
+    __tablename__ = "lead_status_history"
+
+    id = Column(Integer, primary_key=True)
+    lead_id = Column(Integer, ForeignKey("leads.id"), nullable=False)
+    from_status = Column(String(50), nullable=True)
+    to_status = Column(String(50), nullable=False)
+    changed_at = Column(DateTime(timezone=True), nullable=False)
+    # api | amocrm
+    source = Column(String(20), nullable=False, default="api")
+
+    lead = relationship("Lead")
+
+    __table_args__ = (
+        Index("ix_lead_status_history_lead_id_changed_at", "lead_id", "changed_at"),
+    )
+
+    def __repr__(self):
+        return f"<LeadStatusHistory(lead_id={self.lead_id}, '{self.from_status}' -> '{self.to_status}', at={self.changed_at})>"
+
+
+def record_status_change(
+    db: Session,
+    lead: Lead,
+    new_status: str,
+    source: str = "api",
+    changed_at: Optional[datetime] = None
+) -> Optional[LeadStatusHistory]:
+    """
+    Смена статуса лида с записью в журнал (в текущей транзакции)
+
+    Повторная установка того же статуса в журнал не попадает.
+    """
+    previous = lead.status
+    lead.status = new_status
+    if previous == new_status:
+        return None
+    entry = LeadStatusHistory(
+        lead=lead,
+        from_status=previous,
+        to_status=new_status,
+        changed_at=changed_at or datetime.utcnow(),
+        source=source
+    )
+    db.add(entry)
+    return entry
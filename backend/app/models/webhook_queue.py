@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Index
+from sqlalchemy.sql import func
+from app.core.db import Base
+
+
+class WebhookQueueItem(Base):
+    __tablename__ = "webhook_queue"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String(100), nullable=True)  # X-Account-ID отправителя
+    payload = Column(JSON, nullable=False)  # Исходное тело webhook
+    status = Column(String(20), default="pending", nullable=False)  # pending, processing, buffered, done, failed
+    attempts = Column(Integer, default=0, nullable=False)  # Количество попыток обработки
+    last_error = Column(Text, nullable=True)  # Ошибки последней обработки
+    locked_at = Column(DateTime(timezone=True), nullable=True)  # Время захвата воркером
+    processed_at = Column(DateTime(timezone=True), nullable=True)  # Время завершения обработки
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_webhook_queue_status_id", "status", "id"),
+    )
+
+    def __repr__(self):
+        return f"<WebhookQueueItem(id={self.id}, status='{self.status}', attempts={self.attempts})>"
@@ -42,8 +42,8 @@ class RevenueMetrics(BaseModel):
 
 class PerformanceMetrics(BaseModel):
     """Метрики производительности"""
-    response_time_avg: float
-    response_time_median: float
+    response_time_avg: Optional[float] = None  # часы до первой смены статуса
+    response_time_median: Optional[float] = None
     leads_per_day: float
     deals_per_month: float
     user_activity: Dict[str, int]
@@ -7,10 +7,12 @@ from .auth_service import AuthService
 from .lead_service import LeadService
 from .analytics_service import AnalyticsService
 from .notification_service import NotificationService
+from .webhook_service import WebhookService
 
 __all__ = [
     "AuthService",
     "LeadService", 
     "AnalyticsService",
-    "NotificationService"
+    "NotificationService",
+    "WebhookService"
 ]
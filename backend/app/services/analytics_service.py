@@ -5,11 +5,14 @@
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, desc, asc
+from sqlalchemy import case, func, and_, desc, asc
 from sqlalchemy.sql import extract
 
 from app.models.lead import Lead
 from app.models.user import User
+from app.models.lead_daily_rollup import LeadDailyRollup
+from app.analytics.rollup import rollup_query
+from app.analytics.funnel import CONVERTED_STATUSES, FUNNEL_STAGES, FunnelAnalytics
 from app.schemas.analytics import (
     AnalyticsFilter,
     LeadConversionMetrics,
@@ -19,6 +22,7 @@ from app.schemas.analytics import (
     ChartData,
     AnalyticsResponse
 )
+from app.core.cache import cached
 from app.core.exceptions import ValidationError
 
 
@@ -28,52 +32,110 @@ class AnalyticsService:
     def __init__(self, db: Session):
         self.db = db
 
+    @cached("dashboard", decode=DashboardData.model_validate)
     def get_dashboard_data(self, user_id: Optional[int] = None) -> DashboardData:
-        """Получение данных для дашборда"""
-        lead_metrics = self.get_lead_conversion_metrics(user_id)
-        revenue_metrics = self.get_revenue_metrics(user_id)
-        performance_metrics = self.get_performance_metrics(user_id)
-        recent_activities = self.get_recent_activities(user_id)
-        top_performers = self.get_top_performers()
+        """
+        Получение данных для дашборда
+
+        Четыре запроса независимо от числа пользователей и источников:
+        агрегат лидов по (status, source), агрегат по пользователям, журнал
+        статусов когорты (воронка, кэшируется отдельно) и последние лиды.
+        """
+        lead_facts = self._get_lead_facts(user_id)
+        user_facts = self._get_user_facts()
+        funnel = self._get_funnel_metrics(user_id)
 
         return DashboardData(
-            lead_metrics=lead_metrics,
-            revenue_metrics=revenue_metrics,
-            performance_metrics=performance_metrics,
-            recent_activities=recent_activities,
-            top_performers=top_performers
+            lead_metrics=self._build_conversion_metrics(lead_facts, funnel),
+            revenue_metrics=self.get_revenue_metrics(user_id),
+            performance_metrics=self._build_performance_metrics(lead_facts, [] if user_id else user_facts, funnel),
+            recent_activities=self.get_recent_activities(user_id),
+            top_performers=self._build_top_performers(user_facts)
         )
 
-    def get_lead_conversion_metrics(self, user_id: Optional[int] = None) -> LeadConversionMetrics:
-        """Получение метрик конверсии лидов"""
-        query = self.db.query(Lead)
+    def _get_lead_facts(self, user_id: Optional[int] = None) -> List[Any]:
+        """
+        Агрегат лидов: (status, source, total, recent) одним GROUP BY
 
-        if user_id:
-            query = query.filter(Lead.assigned_to == user_id)
+        recent - лиды за последние 30 дней. Общая статистика читается из
+        дневного агрегата lead_daily_rollup. С user_id группы строятся по
+        всем лидам, а считаются только лиды пользователя: источники и статусы
+        без его лидов попадают в разбивку с нулем.
+        """
+        if not user_id:
+            thirty_days_ago = date.today() - timedelta(days=30)
+            return (
+                self.db.query(
+                    LeadDailyRollup.status,
+                    LeadDailyRollup.source,
+                    func.sum(LeadDailyRollup.leads_count).label("total"),
+                    func.sum(
+                        case((LeadDailyRollup.day >= thirty_days_ago, LeadDailyRollup.leads_count), else_=0)
+                    ).label("recent")
+                )
+                .group_by(LeadDailyRollup.status, LeadDailyRollup.source)
+                .having(func.sum(LeadDailyRollup.leads_count) != 0)
+                .all()
+            )
+
+        thirty_days_ago = datetime.now() - timedelta(days=30)
+        owned = Lead.assigned_to == user_id
+        total = func.sum(case((owned, 1), else_=0))
+        recent = func.sum(case((and_(owned, Lead.created_at >= thirty_days_ago), 1), else_=0))
+
+        return (
+            self.db.query(Lead.status, Lead.source, total.label("total"), recent.label("recent"))
+            .group_by(Lead.status, Lead.source)
+            .all()
+        )
 
-        total_leads = query.count()
-        converted_leads = query.filter(Lead.status.in_(["qualified", "closed_won"])).count()
+    def _get_user_facts(self) -> List[Any]:
+        """Агрегат по пользователям: всего лидов и закрытых сделок (один запрос)"""
+        return (
+            self.db.query(
+                User.id,
+                User.email,
+                User.full_name,
+                func.count(Lead.id).label('total_leads'),
+                func.count(Lead.id).filter(Lead.status == "closed_won").label('converted_leads')
+            )
+            .outerjoin(Lead, User.id == Lead.assigned_to)
+            .group_by(User.id, User.email, User.full_name)
+            .order_by(User.id)
+            .all()
+        )
+
+    def _get_funnel_metrics(self, user_id: Optional[int] = None,
+                            filters: Optional[AnalyticsFilter] = None) -> Optional[Dict[str, Any]]:
+        """Воронка когорты: окно из фильтра или последние analytics_funnel_window_days дней"""
+        funnel = FunnelAnalytics(self.db)
+        if filters and filters.date_range:
+            start_date = datetime.combine(filters.date_range.start_date, datetime.min.time())
+            end_date = datetime.combine(filters.date_range.end_date, datetime.max.time())
+        else:
+            start_date, end_date = funnel.default_window()
+        return funnel.cohort_metrics(start_date, end_date, user_id)
+
+    def get_lead_conversion_metrics(self, user_id: Optional[int] = None) -> LeadConversionMetrics:
+        """Получение метрик конверсии лидов"""
+        return self._build_conversion_metrics(self._get_lead_facts(user_id), self._get_funnel_metrics(user_id))
+
+    def _build_conversion_metrics(self, lead_facts: List[Any],
+                                  funnel: Optional[Dict[str, Any]] = None) -> LeadConversionMetrics:
+        # Конверсия по источникам и статусам
+        conversion_by_source: Dict[str, int] = {}
+        conversion_by_status: Dict[str, int] = {}
+        for fact in lead_facts:
+            count = int(fact.total or 0)
+            conversion_by_source[fact.source] = conversion_by_source.get(fact.source, 0) + count
+            conversion_by_status[fact.status] = conversion_by_status.get(fact.status, 0) + count
+
+        total_leads = sum(conversion_by_status.values())
+        converted_leads = sum(conversion_by_status.get(status, 0) for status in CONVERTED_STATUSES)
         conversion_rate = (converted_leads / total_leads * 100) if total_leads > 0 else 0
 
-        # Конверсия по источникам
-        conversion_by_source = {}
-        sources = self.db.query(Lead.source).distinct().all()
-        for source in sources:
-            source_count = query.filter(Lead.source == source[0]).count()
-            conversion_by_source[source[0]] = source_count
-
-        # Конверсия по статусам
-        conversion_by_status = {}
-        statuses = self.db.query(Lead.status).distinct().all()
-        for status in statuses:
-            status_count = query.filter(Lead.status == status[0]).count()
-            conversion_by_status[status[0]] = status_count
-
-        # Среднее время конверсии (упрощенный расчет)
-        avg_conversion_time = None
-        if converted_leads > 0:
-            # Здесь можно добавить более сложную логику расчета времени конверсии
-            pass
+        # Среднее время конверсии (часы) по журналу статусов когорты
+        avg_conversion_time = funnel["time_to_convert"]["avg_hours"] if funnel else None
 
         return LeadConversionMetrics(
             total_leads=total_leads,
@@ -107,31 +169,28 @@ class AnalyticsService:
 
     def get_performance_metrics(self, user_id: Optional[int] = None) -> PerformanceMetrics:
         """Получение метрик производительности"""
-        query = self.db.query(Lead)
-
-        if user_id:
-            query = query.filter(Lead.assigned_to == user_id)
+        # Активность пользователей - только для общей статистики
+        user_facts = [] if user_id else self._get_user_facts()
+        return self._build_performance_metrics(
+            self._get_lead_facts(user_id), user_facts, self._get_funnel_metrics(user_id)
+        )
 
+    def _build_performance_metrics(self, lead_facts: List[Any], user_facts: List[Any],
+                                   funnel: Optional[Dict[str, Any]] = None) -> PerformanceMetrics:
         # Количество лидов за последние 30 дней
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        recent_leads = query.filter(Lead.created_at >= thirty_days_ago).count()
+        recent_leads = sum(int(fact.recent or 0) for fact in lead_facts)
         leads_per_day = recent_leads / 30
 
         # Количество сделок за последний месяц (упрощенно)
-        deals_per_month = query.filter(Lead.status == "closed_won").count()
+        deals_per_month = sum(int(fact.total or 0) for fact in lead_facts if fact.status == "closed_won")
 
         # Активность пользователей
-        user_activity = {}
-        if not user_id:
-            # Получаем активность всех пользователей
-            users = self.db.query(User).all()
-            for user in users:
-                user_leads = self.db.query(Lead).filter(Lead.assigned_to == user.id).count()
-                user_activity[user.email] = user_leads
+        user_activity = {fact.email: fact.total_leads for fact in user_facts}
 
-        # Упрощенные метрики времени ответа
-        response_time_avg = 24.0  # часы
-        response_time_median = 12.0  # часы
+        # Время первого ответа (часы): от создания лида до первой смены статуса
+        first_response = funnel["first_response"] if funnel else {}
+        response_time_avg = first_response.get("avg_hours")
+        response_time_median = first_response.get("p50_hours")
 
         return PerformanceMetrics(
             response_time_avg=response_time_avg,
@@ -149,7 +208,7 @@ class AnalyticsService:
             query = query.filter(Lead.assigned_to == user_id)
 
         recent_leads = (
-            query.order_by(desc(Lead.created_at))
+            query.order_by(desc(Lead.created_at), desc(Lead.id))
             .limit(limit)
             .all()
         )
@@ -159,9 +218,9 @@ class AnalyticsService:
             activities.append({
                 "id": lead.id,
                 "type": "lead_created",
-                "title": f"Новый лид: {lead.first_name} {lead.last_name}",
+                "title": f"Новый лид: {lead.name}",
                 "description": f"Email: {lead.email}, Источник: {lead.source}",
-                "timestamp": lead.created_at.isoformat(),
+                "timestamp": lead.created_at.isoformat() if lead.created_at else None,
                 "user_id": lead.assigned_to,
                 "metadata": {
                     "lead_id": lead.id,
@@ -174,24 +233,14 @@ class AnalyticsService:
 
     def get_top_performers(self, limit: int = 5) -> List[Dict[str, Any]]:
         """Получение топ-исполнителей"""
-        # Подсчитываем количество лидов по пользователям
-        user_stats = (
-            self.db.query(
-                User.id,
-                User.email,
-                User.full_name,
-                func.count(Lead.id).label('total_leads'),
-                func.count(Lead.id).filter(Lead.status == "closed_won").label('converted_leads')
-            )
-            .outerjoin(Lead, User.id == Lead.assigned_to)
-            .group_by(User.id, User.email, User.full_name)
-            .order_by(desc('converted_leads'))
-            .limit(limit)
-            .all()
-        )
+        return self._build_top_performers(self._get_user_facts(), limit)
+
+    def _build_top_performers(self, user_facts: List[Any], limit: int = 5) -> List[Dict[str, Any]]:
+        # Сортировка по закрытым сделкам (стабильная: при равенстве - по id)
+        top = sorted(user_facts, key=lambda fact: fact.converted_leads, reverse=True)[:limit]
 
         performers = []
-        for stat in user_stats:
+        for stat in top:
             conversion_rate = (stat.converted_leads / stat.total_leads * 100) if stat.total_leads > 0 else 0
             performers.append({
                 "user_id": stat.id,
@@ -204,6 +253,7 @@ class AnalyticsService:
 
         return performers
 
+    @cached("chart", decode=ChartData.model_validate)
     def get_chart_data(self, chart_type: str, filters: Optional[AnalyticsFilter] = None) -> ChartData:
         """Получение данных для графиков"""
         if chart_type == "leads_by_source":
@@ -219,19 +269,7 @@ class AnalyticsService:
 
     def _get_leads_by_source_chart(self, filters: Optional[AnalyticsFilter] = None) -> ChartData:
         """График лидов по источникам"""
-        query = self.db.query(Lead)
-
-        if filters and filters.user_id:
-            query = query.filter(Lead.assigned_to == filters.user_id)
-
-        source_stats = (
-            query.with_entities(
-                Lead.source,
-                func.count(Lead.id).label('count')
-            )
-            .group_by(Lead.source)
-            .all()
-        )
+        source_stats = self._count_leads_by("source", filters)
 
         labels = [stat.source for stat in source_stats]
         data = [stat.count for stat in source_stats]
@@ -249,19 +287,7 @@ class AnalyticsService:
 
     def _get_leads_by_status_chart(self, filters: Optional[AnalyticsFilter] = None) -> ChartData:
         """График лидов по статусам"""
-        query = self.db.query(Lead)
-
-        if filters and filters.user_id:
-            query = query.filter(Lead.assigned_to == filters.user_id)
-
-        status_stats = (
-            query.with_entities(
-                Lead.status,
-                func.count(Lead.id).label('count')
-            )
-            .group_by(Lead.status)
-            .all()
-        )
+        status_stats = self._count_leads_by("status", filters)
 
         labels = [stat.status for stat in status_stats]
         data = [stat.count for stat in status_stats]
@@ -279,25 +305,34 @@ class AnalyticsService:
 
     def _get_leads_timeline_chart(self, filters: Optional[AnalyticsFilter] = None) -> ChartData:
         """График лидов по времени"""
-        query = self.db.query(Lead)
-
-        if filters and filters.user_id:
-            query = query.filter(Lead.assigned_to == filters.user_id)
-
         # Группируем по дням за последние 30 дней
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        timeline_stats = (
-            query.filter(Lead.created_at >= thirty_days_ago)
-            .with_entities(
-                func.date(Lead.created_at).label('date'),
-                func.count(Lead.id).label('count')
+        if filters and filters.user_id:
+            thirty_days_ago = datetime.now() - timedelta(days=30)
+            timeline_stats = (
+                self.db.query(Lead)
+                .filter(Lead.assigned_to == filters.user_id, Lead.created_at >= thirty_days_ago)
+                .with_entities(
+                    func.date(Lead.created_at).label('date'),
+                    func.count(Lead.id).label('count')
+                )
+                .group_by(func.date(Lead.created_at))
+                .order_by(func.date(Lead.created_at))
+                .all()
+            )
+        else:
+            timeline_stats = (
+                rollup_query(
+                    self.db,
+                    LeadDailyRollup.day.label('date'),
+                    func.sum(LeadDailyRollup.leads_count).label('count'),
+                    start_date=date.today() - timedelta(days=30)
+                )
+                .group_by(LeadDailyRollup.day)
+                .order_by(LeadDailyRollup.day)
+                .all()
             )
-            .group_by(func.date(Lead.created_at))
-            .order_by(func.date(Lead.created_at))
-            .all()
-        )
 
-        labels = [stat.date.strftime("%Y-%m-%d") for stat in timeline_stats]
+        labels = [str(stat.date)[:10] for stat in timeline_stats]
         data = [stat.count for stat in timeline_stats]
 
         return ChartData(
@@ -312,19 +347,15 @@ class AnalyticsService:
         )
 
     def _get_conversion_funnel_chart(self, filters: Optional[AnalyticsFilter] = None) -> ChartData:
-        """График воронки конверсии"""
-        query = self.db.query(Lead)
-
-        if filters and filters.user_id:
-            query = query.filter(Lead.assigned_to == filters.user_id)
-
-        # Подсчитываем количество лидов на каждом этапе
-        stages = ["new", "contacted", "qualified", "proposal", "negotiation", "closed_won"]
-        stage_counts = []
-
-        for stage in stages:
-            count = query.filter(Lead.status == stage).count()
-            stage_counts.append(count)
+        """График воронки конверсии: лиды когорты, дошедшие до каждой стадии"""
+        stages = list(FUNNEL_STAGES)
+        funnel = self._get_funnel_metrics(filters.user_id if filters else None, filters)
+        if funnel is not None:
+            stage_counts = [stage["reached"] for stage in funnel["stages"]]
+        else:
+            # Без NumPy - текущие статусы лидов
+            counts_by_status = {stat.status: stat.count for stat in self._count_leads_by("status", filters)}
+            stage_counts = [counts_by_status.get(stage, 0) for stage in stages]
 
         return ChartData(
             labels=stages,
@@ -337,6 +368,25 @@ class AnalyticsService:
             }]
         )
 
+    def _count_leads_by(self, dimension: str, filters: Optional[AnalyticsFilter] = None) -> List[Any]:
+        """Количество лидов по source или status: из дневного агрегата, для пользователя - из leads"""
+        if filters and filters.user_id:
+            column = getattr(Lead, dimension)
+            return (
+                self.db.query(column.label(dimension), func.count(Lead.id).label('count'))
+                .filter(Lead.assigned_to == filters.user_id)
+                .group_by(column)
+                .all()
+            )
+
+        column = getattr(LeadDailyRollup, dimension)
+        return (
+            rollup_query(self.db, column.label(dimension), func.sum(LeadDailyRollup.leads_count).label('count'))
+            .group_by(column)
+            .having(func.sum(LeadDailyRollup.leads_count) != 0)
+            .all()
+        )
+
     def get_analytics_response(self, filters: Optional[AnalyticsFilter] = None) -> AnalyticsResponse:
         """Получение полного ответа с аналитическими данными"""
         dashboard = self.get_dashboard_data(filters.user_id if filters else None)
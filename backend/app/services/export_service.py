@@ -0,0 +1,285 @@
+"""
+Потоковая выгрузка лидов, сделок и уведомлений (CSV, NDJSON, Parquet)
+
+Строки читаются серверным курсором (yield_per) пачками export_batch_size
+в порядке первичного ключа; каждая пачка сериализуется и сразу отдается
+клиенту (chunked), поэтому память не зависит от числа строк.
+
+Сессия открывается внутри генератора и закрывается по окончании или
+обрыве выгрузки: сессия get_db закрывается до отправки тела ответа.
+
+Parquet - при установленном pyarrow (группа строк на пачку).
+"""
+
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, Numeric, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.deal import Deal
+from app.models.lead import Lead
+from app.models.notification import Notification
+from app.schemas.leads import LeadFilter
+from app.services.lead_service import LeadService
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - Parquet недоступен
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Поля LeadFilter, применимые к уведомлениям (assigned_to -> user_id)
+NOTIFICATION_FILTERS = {"assigned_to", "created_after", "created_before"}
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+class ExportDataset:
+    """Выгружаемая таблица: модель и столбцы в порядке выгрузки"""
+
+    __slots__ = ("name", "model", "columns")
+
+    def __init__(self, name: str, model, columns: Sequence[str]):
+        self.name = name
+        self.model = model
+        self.columns = tuple(columns)
+
+    @property
+    def attributes(self):
+        return [getattr(self.model, column) for column in self.columns]
+
+
+EXPORT_DATASETS: Dict[str, ExportDataset] = {
+    "leads": ExportDataset("leads", Lead, (
+        "id", "name", "phone", "email",
+        "utm_source", "utm_medium", "utm_campaign", "utm_content", "utm_term",
+        "amocrm_contact_id", "amocrm_lead_id", "status", "source", "assigned_to",
+        "cost", "revenue", "created_at", "updated_at",
+    )),
+    "deals": ExportDataset("deals", Deal, (
+        "id", "lead_id", "amocrm_deal_id", "amocrm_pipeline_id", "amocrm_status_id",
+        "amount", "commission", "commission_percent", "status", "stage",
+        "description", "tags", "created_at", "updated_at", "closed_at",
+    )),
+    "notifications": ExportDataset("notifications", Notification, (
+        "id", "user_id", "type", "status", "recipient", "subject", "message",
+        "template_name", "priority", "scheduled_at", "sent_at", "retry_count",
+        "max_retries", "error_message", "source", "source_id", "created_at", "updated_at",
+    )),
+}
+
+
+def _text(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class _ChunkSink:
+    """Файлоподобный приемник Parquet: байты забираются после каждой группы строк"""
+
+    __slots__ = ("_parts", "_position", "closed")
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _arrow_type(column):
+    """Тип столбца Parquet по типу столбца модели"""
+    column_type = column.type
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, (Float, Numeric)):
+        return pa.float64()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    return pa.string()
+
+
+def write_csv(dataset: ExportDataset, partitions: Iterable[Sequence[Tuple]]) -> Iterator[bytes]:
+    """CSV с заголовком; один чанк на пачку строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(dataset.columns)
+    for rows in partitions:
+        writer.writerows([_text(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Заголовок пустой выгрузки
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_ndjson(dataset: ExportDataset, partitions: Iterable[Sequence[Tuple]]) -> Iterator[bytes]:
+    """Объект JSON на строку; один чанк на пачку строк"""
+    columns = dataset.columns
+    for rows in partitions:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+            for row in rows
+        ).encode("utf-8")
+
+
+def write_parquet(dataset: ExportDataset, partitions: Iterable[Sequence[Tuple]]) -> Iterator[bytes]:
+    """Parquet: группа строк на пачку, байты отдаются по мере записи"""
+    schema = pa.schema([
+        pa.field(name, _arrow_type(dataset.model.__table__.c[name])) for name in dataset.columns
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in partitions:
+            columns = list(zip(*rows))
+            writer.write_table(
+                pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ),
+                row_group_size=len(rows),
+            )
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+WRITERS: Dict[str, Callable[[ExportDataset, Iterable[Sequence[Tuple]]], Iterator[bytes]]] = {
+    "csv": write_csv,
+    "ndjson": write_ndjson,
+    "parquet": write_parquet,
+}
+
+
+class ExportService:
+    """Потоковая выгрузка таблиц с фильтрами LeadFilter"""
+
+    def __init__(self, session_factory: Optional[Callable[[], Session]] = None,
+                 batch_size: Optional[int] = None):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or settings.export_batch_size
+
+    def _session(self) -> Session:
+        if self.session_factory is not None:
+            return self.session_factory()
+        from app.core.db import SessionLocal
+        return SessionLocal()
+
+    def statement(self, db: Session, dataset: ExportDataset, filters: Optional[LeadFilter] = None):
+        """
+        Запрос выгрузки в порядке первичного ключа:
+        лиды - по LeadFilter, сделки - лидов, подходящих под LeadFilter,
+        уведомления - по датам создания и пользователю (assigned_to)
+        """
+        query = select(*dataset.attributes)
+        active = filters.model_dump(exclude_none=True) if filters else {}
+
+        if dataset.model is Lead:
+            query = LeadService(db).apply_filters(query, filters)
+        elif dataset.model is Deal and active:
+            query = LeadService(db).apply_filters(query.join(Lead, Lead.id == Deal.lead_id), filters)
+        elif dataset.model is Notification and active:
+            if filters.assigned_to:
+                query = query.where(Notification.user_id == filters.assigned_to)
+            if filters.created_after:
+                query = query.where(Notification.created_at >= filters.created_after)
+            if filters.created_before:
+                query = query.where(Notification.created_at <= filters.created_before)
+
+        return query.order_by(dataset.model.id)
+
+    def stream(self, name: str, fmt: str, filters: Optional[LeadFilter] = None) -> Iterator[bytes]:
+        """
+        Генератор чанков выгрузки; ошибки параметров (ValueError) -
+        до начала передачи, чтобы их можно было вернуть кодом ответа
+        """
+        dataset = EXPORT_DATASETS.get(name)
+        if dataset is None:
+            raise ValueError(f"Неизвестная таблица: {name} (доступны: {', '.join(EXPORT_DATASETS)})")
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат: {fmt} (доступны: {', '.join(EXPORT_FORMATS)})")
+        if fmt == "parquet" and not parquet_available():
+            raise ValueError("Формат parquet недоступен: pyarrow не установлен")
+        if dataset.model is Notification and filters:
+            unsupported = set(filters.model_dump(exclude_none=True)) - NOTIFICATION_FILTERS
+            if unsupported:
+                raise ValueError(f"Фильтры не применимы к уведомлениям: {', '.join(sorted(unsupported))}")
+        return self._generate(dataset, WRITERS[fmt], filters)
+
+    def _generate(self, dataset: ExportDataset, write, filters: Optional[LeadFilter]) -> Iterator[bytes]:
+        db = self._session()
+        exported = 0
+
+        def partitions():
+            nonlocal exported
+            result = db.execute(
+                self.statement(db, dataset, filters).execution_options(yield_per=self.batch_size)
+            )
+            try:
+                for rows in result.partitions():
+                    exported += len(rows)
+                    yield rows
+            finally:
+                result.close()
+
+        try:
+            yield from write(dataset, partitions())
+        finally:
+            db.close()
+            logger.info(f"Export of {dataset.name} finished: {exported} rows")
+
+
+export_service = ExportService()
@@ -0,0 +1,111 @@
+"""
+Полнотекстовый поиск лидов по имени, email и телефону
+
+PostgreSQL: tsvector (конфигурация 'simple', префиксный поиск для ввода
+по мере набора) и pg_trgm для подстрок; оба выражения покрыты GIN
+индексами из миграции 20251017000004 и должны совпадать с ними
+буквально. Релевантность - ts_rank + similarity.
+
+SQLite: FTS5 таблица leads_fts (см. app/models/lead.py), релевантность -
+bm25. Для остальных диалектов - ILIKE без ранжирования.
+"""
+
+import re
+from typing import List
+
+from sqlalchemy import String, column, desc, func, literal, literal_column, or_, select, table
+
+from app.models.lead import Lead
+
+SEARCH_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# Выражения индексов ix_leads_search_tsv / ix_leads_search_trgm
+SEARCH_TEXT_SQL = "coalesce(leads.name, '') || ' ' || coalesce(leads.email, '') || ' ' || coalesce(leads.phone, '')"
+TS_CONFIG_SQL = "'simple'::regconfig"
+
+leads_fts = table("leads_fts", column("rowid"))
+
+
+def search_tokens(term: str) -> List[str]:
+    """Слова поискового запроса (без операторов и кавычек)"""
+    return SEARCH_TOKEN.findall(term.lower())
+
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class LeadSearch:
+    """Условие поиска и релевантность для диалекта БД"""
+
+    def __init__(self, dialect: str):
+        self.dialect = dialect
+
+    def condition(self, term: str):
+        """Условие "лид соответствует запросу" (None - пустой запрос)"""
+        tokens = search_tokens(term)
+        if not tokens:
+            return None
+
+        if self.dialect == "postgresql":
+            return or_(
+                self._ts_vector().op("@@")(self._ts_query(tokens)),
+                self._search_text().ilike(f"%{escape_like(term.strip())}%", escape="\\")
+            )
+
+        if self.dialect == "sqlite":
+            return Lead.id.in_(
+                select(leads_fts.c.rowid).where(self._fts_match(tokens))
+            )
+
+        pattern = f"%{escape_like(term.strip())}%"
+        return or_(Lead.name.ilike(pattern), Lead.email.ilike(pattern), Lead.phone.ilike(pattern))
+
+    def rank(self, term: str):
+        """Релевантность (больше - лучше)"""
+        tokens = search_tokens(term)
+        if not tokens:
+            return literal(0.0)
+
+        if self.dialect == "postgresql":
+            return (
+                func.ts_rank(self._ts_vector(), self._ts_query(tokens))
+                + func.similarity(self._search_text(), term.strip())
+            )
+
+        if self.dialect == "sqlite":
+            # bm25 тем меньше, чем лучше совпадение
+            return (
+                select(-func.bm25(literal_column("leads_fts")))
+                .where(self._fts_match(tokens), leads_fts.c.rowid == Lead.id)
+                .scalar_subquery()
+            )
+
+        return literal(0.0)
+
+    def apply(self, query, term: str):
+        """Фильтр по запросу и сортировка по релевантности (Query или select)"""
+        condition = self.condition(term)
+        if condition is None:
+            return query.order_by(desc(Lead.created_at), desc(Lead.id))
+        return query.filter(condition).order_by(
+            desc(self.rank(term)), desc(Lead.created_at), desc(Lead.id)
+        )
+
+    def _search_text(self):
+        return literal_column(SEARCH_TEXT_SQL, String)
+
+    def _ts_vector(self):
+        return func.to_tsvector(literal_column(TS_CONFIG_SQL), self._search_text())
+
+    def _ts_query(self, tokens: List[str]):
+        # Префиксный поиск по каждому слову: "ivan 7999" -> 'ivan:* & 7999:*'
+        return func.to_tsquery(literal_column(TS_CONFIG_SQL), " & ".join(f"{token}:*" for token in tokens))
+
+    def _fts_match(self, tokens: List[str]):
+        return literal_column("leads_fts").op("MATCH")(" ".join(f'"{token}"*' for token in tokens))
+
+
+def lead_search_for(session) -> LeadSearch:
+    """Поиск для диалекта БД сессии (Session или AsyncSession)"""
+    return LeadSearch(session.get_bind().dialect.name)
@@ -6,9 +6,12 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import and_, or_, desc, asc
+from sqlalchemy import and_, or_, desc, asc, case, func
 
+from app.core.pagination import KeysetPage, keyset_filter, keyset_order, make_page
+from app.services.lead_search import lead_search_for
 from app.models.lead import Lead
+from app.models.lead_status_history import record_status_change
 from app.schemas.leads import LeadCreate, LeadUpdate, LeadFilter, LeadStatistics
 from app.core.exceptions import (
     LeadNotFoundError,
@@ -38,9 +41,33 @@ class LeadService:
         limit: int = 100,
         filters: Optional[LeadFilter] = None
     ) -> List[Lead]:
-        """Получение списка лидов с фильтрацией"""
-        query = self.db.query(Lead)
+        """Получение списка лидов с фильтрацией (OFFSET; для глубоких страниц - get_leads_page)"""
+        query = self._filter_leads(self.db.query(Lead), filters, with_search=False)
 
+        if filters and filters.search:
+            # Поиск по индексу с сортировкой по релевантности
+            query = lead_search_for(self.db).apply(query, filters.search)
+        else:
+            # Сортировка по дате создания (новые сначала)
+            query = query.order_by(*keyset_order(Lead.created_at, Lead.id))
+
+        return query.offset(skip).limit(limit).all()
+
+    def get_leads_page(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        filters: Optional[LeadFilter] = None
+    ) -> KeysetPage:
+        """Страница лидов по курсору (created_at, id)"""
+        return self._keyset_page(self._filter_leads(self.db.query(Lead), filters), limit, cursor)
+
+    def apply_filters(self, query, filters: Optional[LeadFilter]):
+        """Фильтры LeadFilter для любого запроса по лидам (Query или select)"""
+        return self._filter_leads(query, filters)
+
+    def _filter_leads(self, query, filters: Optional[LeadFilter], with_search: bool = True):
+        """Применение фильтров LeadFilter к запросу"""
         if filters:
             # Фильтр по статусу
             if filters.status:
@@ -61,23 +88,23 @@ class LeadService:
             if filters.created_before:
                 query = query.filter(Lead.created_at <= filters.created_before)
 
-            # Поиск по тексту
-            if filters.search:
-                search_term = f"%{filters.search}%"
-                query = query.filter(
-                    or_(
-                        Lead.first_name.ilike(search_term),
-                        Lead.last_name.ilike(search_term),
-                        Lead.email.ilike(search_term),
-                        Lead.company.ilike(search_term),
-                        Lead.notes.ilike(search_term)
-                    )
-                )
-
-        # Сортировка по дате создания (новые сначала)
-        query = query.order_by(desc(Lead.created_at))
+            # Поиск по тексту (полнотекстовый индекс)
+            if with_search and filters.search:
+                query = self._filter_search(query, filters.search)
 
-        return query.offset(skip).limit(limit).all()
+        return query
+
+    def _filter_search(self, query, search_term: str):
+        """Фильтр поиска без сортировки по релевантности (для keyset страниц)"""
+        condition = lead_search_for(self.db).condition(search_term)
+        return query if condition is None else query.filter(condition)
+
+    def _keyset_page(self, query, limit: int, cursor: Optional[str]) -> KeysetPage:
+        """Выборка страницы: limit + 1 строк после курсора по индексу (created_at, id)"""
+        if cursor:
+            query = query.filter(keyset_filter(Lead.created_at, Lead.id, cursor))
+        rows = query.order_by(*keyset_order(Lead.created_at, Lead.id)).limit(limit + 1).all()
+        return make_page(rows, limit)
 
     def create_lead(self, lead_data: LeadCreate, user_id: Optional[int] = None) -> Lead:
         """Создание нового лида"""
@@ -119,11 +146,18 @@ class LeadService:
 
         # Обновляем только переданные поля
         update_data = lead_data.dict(exclude_unset=True)
+        now = datetime.utcnow()
+
+        # Смена статуса - через журнал (lead_status_history)
+        if update_data.get("status") is not None:
+            new_status = update_data.pop("status")
+            record_status_change(self.db, lead, getattr(new_status, "value", new_status),
+                                 source="api", changed_at=now)
 
         for field, value in update_data.items():
             setattr(lead, field, value)
 
-        lead.updated_at = datetime.utcnow()
+        lead.updated_at = now
 
         try:
             self.db.commit()
@@ -162,42 +196,45 @@ class LeadService:
         if not lead:
             raise LeadNotFoundError(f"Лид с ID {lead_id} не найден")
 
-        lead.status = new_status
-        lead.updated_at = datetime.utcnow()
+        now = datetime.utcnow()
+        record_status_change(self.db, lead, new_status, source="api", changed_at=now)
+        lead.updated_at = now
 
         self.db.commit()
         self.db.refresh(lead)
         return lead
 
     def get_lead_statistics(self, user_id: Optional[int] = None) -> LeadStatistics:
-        """Получение статистики по лидам"""
-        query = self.db.query(Lead)
-
+        """Получение статистики по лидам (один запрос GROUP BY status, source)"""
         if user_id:
-            query = query.filter(Lead.assigned_to == user_id)
+            # Группы строятся по всем лидам, чтобы источники и статусы без
+            # лидов пользователя попадали в разбивку с нулем
+            counted = func.sum(case((Lead.assigned_to == user_id, 1), else_=0))
+        else:
+            counted = func.count(Lead.id)
+
+        rows = (
+            self.db.query(Lead.status, Lead.source, counted)
+            .group_by(Lead.status, Lead.source)
+            .all()
+        )
+
+        # Статистика по статусам и источникам
+        conversion_by_status: Dict[Any, int] = {}
+        conversion_by_source: Dict[Any, int] = {}
+        for status, source, count in rows:
+            count = int(count or 0)
+            conversion_by_status[status] = conversion_by_status.get(status, 0) + count
+            conversion_by_source[source] = conversion_by_source.get(source, 0) + count
 
-        total_leads = query.count()
-        new_leads = query.filter(Lead.status == "new").count()
-        contacted_leads = query.filter(Lead.status == "contacted").count()
-        qualified_leads = query.filter(Lead.status == "qualified").count()
+        total_leads = sum(conversion_by_status.values())
+        new_leads = conversion_by_status.get("new", 0)
+        contacted_leads = conversion_by_status.get("contacted", 0)
+        qualified_leads = conversion_by_status.get("qualified", 0)
 
         # Конверсия (qualified / total)
         conversion_rate = (qualified_leads / total_leads * 100) if total_leads > 0 else 0
 
-        # Статистика по источникам
-        conversion_by_source = {}
-        sources = self.db.query(Lead.source).distinct().all()
-        for source in sources:
-            source_count = query.filter(Lead.source == source[0]).count()
-            conversion_by_source[source[0]] = source_count
-
-        # Статистика по статусам
-        conversion_by_status = {}
-        statuses = self.db.query(Lead.status).distinct().all()
-        for status in statuses:
-            status_count = query.filter(Lead.status == status[0]).count()
-            conversion_by_status[status[0]] = status_count
-
         return LeadStatistics(
             total_leads=total_leads,
             new_leads=new_leads,
@@ -213,28 +250,26 @@ class LeadService:
         return (
             self.db.query(Lead)
             .filter(Lead.assigned_to == user_id)
-            .order_by(desc(Lead.created_at))
+            .order_by(*keyset_order(Lead.created_at, Lead.id))
             .offset(skip)
             .limit(limit)
             .all()
         )
 
+    def get_leads_by_user_page(self, user_id: int, limit: int = 100, cursor: Optional[str] = None) -> KeysetPage:
+        """Страница лидов пользователя по курсору"""
+        return self._keyset_page(self.db.query(Lead).filter(Lead.assigned_to == user_id), limit, cursor)
+
     def search_leads(self, search_term: str, skip: int = 0, limit: int = 100) -> List[Lead]:
-        """Поиск лидов по тексту"""
-        search_pattern = f"%{search_term}%"
+        """Поиск лидов по тексту (по релевантности)"""
         return (
-            self.db.query(Lead)
-            .filter(
-                or_(
-                    Lead.first_name.ilike(search_pattern),
-                    Lead.last_name.ilike(search_pattern),
-                    Lead.email.ilike(search_pattern),
-                    Lead.company.ilike(search_pattern),
-                    Lead.notes.ilike(search_pattern)
-                )
-            )
-            .order_by(desc(Lead.created_at))
+            lead_search_for(self.db)
+            .apply(self.db.query(Lead), search_term)
             .offset(skip)
             .limit(limit)
             .all()
         )
+
+    def search_leads_page(self, search_term: str, limit: int = 100, cursor: Optional[str] = None) -> KeysetPage:
+        """Страница результатов поиска по курсору (новые сначала)"""
+        return self._keyset_page(self._filter_search(self.db.query(Lead), search_term), limit, cursor)
@@ -0,0 +1,158 @@
+"""
+Параллельная обработка webhook amoCRM по полосам
+
+События лидов раскладываются по полосам по ключу (аккаунт, ID лида),
+события контактов - по (аккаунт, ID контакта). Внутри полосы порядок
+сохраняется, поэтому обновления одного лида не переупорядочиваются, а
+разные лиды обрабатываются параллельно. Каждая часть payload
+фиксируется своей транзакцией.
+
+Контакты обрабатываются после лидов того же payload (их перенос зависит
+от только что созданных лидов), а очередность этой второй фазы между
+payload сохраняется цепочкой событий.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.lanes import PartitionedExecutor
+from app.services.webhook_service import WebhookService
+
+
+def split_section(
+    body: Dict[str, Any],
+    section: str,
+    executor: PartitionedExecutor,
+    kind: str
+) -> Dict[int, Dict[str, Any]]:
+    """Разбиение секции payload на части по полосам с сохранением порядка событий"""
+    account_id = (body.get("account") or {}).get("id")
+    parts: Dict[int, Dict[str, Any]] = {}
+
+    for event_type, events in (body.get(section) or {}).items():
+        for event in events or []:
+            entity_id = event.get("id") if isinstance(event, dict) else None
+            lane = executor.lane_for((account_id, kind, entity_id))
+            part = parts.setdefault(lane, {"account": body.get("account"), section: {}})
+            part[section].setdefault(event_type, []).append(event)
+
+    return parts
+
+
+def merge_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Объединение результатов частей payload"""
+    return {
+        "processed": sum(result["processed"] for result in results),
+        "errors": [error for result in results for error in result["errors"]],
+        "committed": all(result["committed"] for result in results),
+        "duplicates": sum(result.get("duplicates", 0) for result in results),
+        "rows_affected": sum(result.get("rows_affected", 0) for result in results),
+        "buffered": sum(result.get("buffered", 0) for result in results)
+    }
+
+
+class PendingPayload:
+    """Payload, лиды которого уже отправлены в полосы"""
+
+    def __init__(self, processor: "PartitionedWebhookProcessor", body: Dict[str, Any], previous: threading.Event,
+                 source: Any = None):
+        self.processor = processor
+        self.body = body
+        self.source = source
+        self.lead_futures: List[Future] = []
+        self._previous = previous
+        self.contacts_submitted = threading.Event()
+
+    def result(self) -> Dict[str, Any]:
+        """Ожидание обработки всего payload"""
+        results = []
+        contact_futures: List[Future] = []
+        try:
+            results.extend(future.result() for future in self.lead_futures)
+
+            # Вторая фаза отправляется в порядке поступления payload
+            self._previous.wait()
+            contact_futures = self.processor._submit_section(self.body, "contacts", "contact", self.source)
+        finally:
+            self.contacts_submitted.set()
+
+        results.extend(future.result() for future in contact_futures)
+        if not results:
+            return merge_results([{"processed": 0, "errors": [], "committed": True}])
+        return merge_results(results)
+
+
+class PartitionedWebhookProcessor:
+    """Обработка webhook payload через PartitionedExecutor"""
+
+    def __init__(
+        self,
+        executor: PartitionedExecutor,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        self.executor = executor
+        self.session_factory = session_factory
+        self._submit_lock = threading.Lock()
+        self._last_contacts_submitted = threading.Event()
+        self._last_contacts_submitted.set()
+
+    def submit(self, body: Dict[str, Any], source: Any = None) -> PendingPayload:
+        """
+        Отправка событий лидов в полосы; порядок вызовов submit - порядок обработки
+        (source - ID задачи очереди, см. WebhookService.process_payload)
+        """
+        with self._submit_lock:
+            pending = PendingPayload(self, body, self._last_contacts_submitted, source)
+            self._last_contacts_submitted = pending.contacts_submitted
+            pending.lead_futures = self._submit_section(body, "leads", "lead", source)
+        return pending
+
+    def process(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Синхронная обработка payload (для обработчика webhook)"""
+        return self.submit(body).result()
+
+    def _submit_section(self, body: Dict[str, Any], section: str, kind: str, source: Any = None) -> List[Future]:
+        parts = split_section(body, section, self.executor, kind)
+        return [
+            self.executor.submit_to_lane(lane, self._process_part, part, source)
+            for lane, part in parts.items()
+        ]
+
+    def _process_part(self, part: Dict[str, Any], source: Any = None) -> Dict[str, Any]:
+        """Обработка части payload в полосе отдельной транзакцией"""
+        db = self.session_factory()
+        try:
+            return WebhookService(db).process_payload(part, source=source)
+        finally:
+            db.close()
+
+
+_processor: Optional[PartitionedWebhookProcessor] = None
+_processor_lock = threading.Lock()
+
+
+def get_partitioned_processor() -> Optional[PartitionedWebhookProcessor]:
+    """Общий процессор полос (None, если WEBHOOK_LANES=0)"""
+    global _processor
+    if settings.webhook_lanes < 1:
+        return None
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                executor = PartitionedExecutor(settings.webhook_lanes, name="webhook-lane")
+                _processor = PartitionedWebhookProcessor(executor)
+    return _processor
+
+
+def shutdown_partitioned_processor():
+    """Остановка полос при завершении приложения"""
+    global _processor
+    with _processor_lock:
+        if _processor is not None:
+            _processor.executor.shutdown()
+            _processor = None
@@ -0,0 +1,239 @@
+"""
+Очередь webhook amoCRM и пул фоновых воркеров
+
+В режиме ``webhook_async_mode`` endpoint только сохраняет payload в
+таблицу ``webhook_queue`` и сразу отвечает 202, а воркеры забирают
+задачи из очереди и обрабатывают их через ``WebhookService``.
+
+Задача, обновления которой ждут в буфере окна схлопывания, получает
+статус ``buffered`` и становится ``done`` после их записи; если процесс
+упал раньше, задача захватывается повторно по visibility timeout.
+"""
+
+import asyncio
+import threading
+from typing import Optional, List, Dict, Any, Callable, Iterable, Set
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logging import logger
+from app.models.webhook_queue import WebhookQueueItem
+from app.services.webhook_service import WebhookService
+from app.services.webhook_lanes import PartitionedWebhookProcessor, get_partitioned_processor
+
+
+def enqueue_webhook(db: Session, body: Dict[str, Any], account_id: Optional[str] = None) -> WebhookQueueItem:
+    """Сохранение webhook payload в очередь"""
+    item = WebhookQueueItem(
+        account_id=account_id,
+        payload=body,
+        status="pending",
+        attempts=0
+    )
+    db.add(item)
+    db.commit()
+    return item
+
+
+def complete_buffered_items(db: Session, item_ids: Iterable[int]) -> Set[int]:
+    """
+    Отметка задач, обновления которых записаны из буфера окна
+
+    Возвращает задачи, которые еще обрабатываются (processing): их
+    результат еще не зафиксирован, отметку нужно повторить позже.
+    """
+    item_ids = list(item_ids)
+    db.execute(
+        update(WebhookQueueItem)
+        .where(WebhookQueueItem.id.in_(item_ids), WebhookQueueItem.status == "buffered")
+        .values(status="done", processed_at=datetime.utcnow(), locked_at=None)
+    )
+    processing = {
+        item_id for (item_id,) in db.query(WebhookQueueItem.id).filter(
+            WebhookQueueItem.id.in_(item_ids), WebhookQueueItem.status == "processing"
+        )
+    }
+    db.commit()
+    return processing
+
+
+class WebhookQueueProcessor:
+    """Захват и обработка задач из очереди webhook"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_attempts: Optional[int] = None,
+        visibility_timeout: Optional[int] = None,
+        partitioned: Optional[PartitionedWebhookProcessor] = None
+    ):
+        self.session_factory = session_factory
+        self.max_attempts = max_attempts or settings.webhook_queue_max_attempts
+        self.visibility_timeout = visibility_timeout or settings.webhook_queue_visibility_timeout
+        self.partitioned = partitioned or get_partitioned_processor()
+        # Захват задачи и отправка в полосы идут в порядке очереди
+        self._dispatch_lock = threading.Lock()
+
+    def process_next(self) -> bool:
+        """Обработка одной задачи. Возвращает False, если очередь пуста"""
+        db = self.session_factory()
+        try:
+            if self.partitioned is not None:
+                with self._dispatch_lock:
+                    item = self._claim(db)
+                    if item is None:
+                        return False
+                    pending = self.partitioned.submit(item.payload, source=item.id)
+                result = pending.result()
+            else:
+                item = self._claim(db)
+                if item is None:
+                    return False
+                result = WebhookService(db).process_payload(item.payload, source=item.id)
+
+            self._finish(db, item, result)
+            return True
+        finally:
+            db.close()
+
+    def process_pending(self, limit: Optional[int] = None) -> int:
+        """Обработка задач, пока очередь не опустеет (или до limit)"""
+        processed = 0
+        while limit is None or processed < limit:
+            if not self.process_next():
+                break
+            processed += 1
+        return processed
+
+    def _claim(self, db: Session) -> Optional[WebhookQueueItem]:
+        """Захват следующей задачи (SKIP LOCKED на PostgreSQL)"""
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.visibility_timeout)
+
+        item = (
+            db.query(WebhookQueueItem)
+            .filter(
+                or_(
+                    WebhookQueueItem.status == "pending",
+                    and_(
+                        # Зависшая задача или буфер окна, не записанный упавшим процессом
+                        WebhookQueueItem.status.in_(("processing", "buffered")),
+                        WebhookQueueItem.locked_at < stale_before
+                    )
+                )
+            )
+            .order_by(WebhookQueueItem.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if item is None:
+            db.rollback()
+            return None
+
+        item.status = "processing"
+        item.attempts = (item.attempts or 0) + 1
+        item.locked_at = now
+        db.commit()
+        return item
+
+    def _finish(self, db: Session, item: WebhookQueueItem, result: Dict[str, Any]):
+        """Фиксация результата обработки задачи"""
+        errors: List[str] = result.get("errors") or []
+        item.last_error = "\n".join(errors) if errors else None
+        item.locked_at = None
+
+        if result.get("committed") and result.get("buffered"):
+            # Обновления только в памяти процесса: done - после записи буфера
+            item.status = "buffered"
+            item.locked_at = datetime.utcnow()
+        elif result.get("committed"):
+            item.status = "done"
+            item.processed_at = datetime.utcnow()
+        elif item.attempts >= self.max_attempts:
+            item.status = "failed"
+            logger.error(f"Webhook queue item {item.id} failed after {item.attempts} attempts")
+        else:
+            # Транзакция payload откатилась - вернем задачу в очередь
+            item.status = "pending"
+            logger.warning(f"Webhook queue item {item.id} will be retried (attempt {item.attempts})")
+
+        db.commit()
+
+
+class WebhookWorkerPool:
+    """Пул асинхронных воркеров, разбирающих очередь webhook"""
+
+    def __init__(
+        self,
+        processor: Optional[WebhookQueueProcessor] = None,
+        workers: Optional[int] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self.processor = processor or WebhookQueueProcessor()
+        self.workers = workers or settings.webhook_workers
+        self.poll_interval = poll_interval if poll_interval is not None else settings.webhook_queue_poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and not self._stopping
+
+    def start(self):
+        """Запуск воркеров в текущем event loop"""
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._run(index), name=f"webhook-worker-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(f"Webhook worker pool started with {self.workers} workers")
+
+    def notify(self):
+        """Сигнал воркерам о новой задаче в очереди"""
+        self._wakeup.set()
+
+    async def stop(self, drain_timeout: Optional[float] = None):
+        """Остановка воркеров с дообработкой очереди"""
+        if not self._tasks:
+            return
+        timeout = drain_timeout if drain_timeout is not None else settings.webhook_queue_drain_timeout
+
+        self._stopping = True
+        self._wakeup.set()
+
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Webhook worker pool stopped with {len(pending)} workers still busy")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        self._tasks = []
+        logger.info("Webhook worker pool stopped")
+
+    async def _run(self, index: int):
+        """Цикл воркера: обрабатываем задачи, пока они есть, затем ждем"""
+        while True:
+            try:
+                has_work = await asyncio.to_thread(self.processor.process_next)
+            except Exception as e:
+                logger.error(f"Webhook worker {index} error: {str(e)}")
+                has_work = False
+
+            if has_work:
+                continue
+            if self._stopping:
+                return
+
+            # Очередь пуста - ждем сигнала или интервала опроса
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,543 @@
+"""
+Сервис для обработки webhook событий amoCRM
+"""
+
+from typing import Optional, List, Dict, Any, Iterable
+from datetime import datetime
+from sqlalchemy import case, update
+from sqlalchemy.orm import Session
+
+from app.models.lead import Lead
+from app.models.lead_status_history import record_status_change
+from app.core.cache import invalidate_cache
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import record_webhook_events
+from app.integrations.amo.dedup import EventDeduplicator, event_key, webhook_deduplicator
+from app.integrations.amo.coalescer import LeadUpdateCoalescer, lead_update_coalescer
+from app.integrations.amo.field_mapping import (
+    CompiledFieldMapping, FieldMappingRegistry, CONTACT_FIELDS, UTM_FIELDS, field_mapping_registry
+)
+
+
+# Маппинг статусов amoCRM на внутренние статусы
+AMO_STATUS_MAPPING = {
+    1: "new",              # Новый лид
+    2: "contacted",        # Первичный контакт
+    3: "presentation",     # Презентация
+    4: "object_selected",  # Выбор объекта
+    5: "reserved",         # Резервирование
+    6: "deal",             # Сделка
+    7: "completed"         # Завершено
+}
+
+# Максимум контактов в одном UPDATE (ограничение числа параметров запроса)
+CONTACT_UPDATE_CHUNK_SIZE = 500
+
+
+class WebhookService:
+    """
+    Сервис для пакетной обработки webhook от amoCRM
+
+    Все лиды, на которые ссылается секция payload, загружаются одним
+    запросом ``IN (...)``, изменения применяются в памяти, а фиксация
+    выполняется одним ``commit`` на весь payload. Повторные доставки
+    уже обработанных событий отсекаются до обращения к БД, а несколько
+    обновлений одного лида схлопываются в одно.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        deduplicator: Optional[EventDeduplicator] = None,
+        coalescer: Optional[LeadUpdateCoalescer] = None,
+        buffer_updates: bool = True,
+        field_mappings: Optional[FieldMappingRegistry] = None,
+        update_keys: Optional[Dict[Any, List[str]]] = None
+    ):
+        self.db = db
+        self.field_mappings = field_mappings or field_mapping_registry
+        self.fields: Optional[CompiledFieldMapping] = None
+        if deduplicator is None and settings.webhook_dedup_enabled:
+            deduplicator = webhook_deduplicator
+        self.deduplicator = deduplicator
+        if coalescer is None and settings.webhook_coalesce_enabled:
+            coalescer = lead_update_coalescer
+        self.coalescer = coalescer
+        # False для записи уже накопленного буфера окна
+        self.buffer_updates = buffer_updates
+        # Ключи дедупликации исходных событий буфера окна по id лида
+        self.update_keys = update_keys or {}
+        self._account_id = None
+        self._applied_keys: List[str] = []
+        # Ключи исходных leads.update, схлопнутых в одно событие лида
+        self._update_keys: Dict[Any, List[str]] = {}
+        self._outcomes: Dict[tuple, int] = {}
+        # Изменения буфера окна применяются только после commit payload
+        self._buffered_updates: List[Dict[str, Any]] = []
+        self._discarded_ids: List[Any] = []
+
+    def process_payload(self, body: Dict[str, Any], source: Any = None) -> Dict[str, Any]:
+        """
+        Обработка всего webhook payload в одной транзакции
+
+        source - ID задачи очереди webhook: задача остается незавершенной,
+        пока обновления payload не записаны из буфера окна ("buffered" в
+        результате).
+        """
+        events_processed = 0
+        rows_affected = 0
+        errors: List[str] = []
+        committed = False
+        buffered = 0
+        self._account_id = (body.get("account") or {}).get("id")
+        self._applied_keys = []
+        self._update_keys = {}
+        self._outcomes = {}
+        self._buffered_updates = []
+        self._discarded_ids = []
+        self.fields = self.field_mappings.get(self._account_id)
+
+        body, duplicates = self._drop_duplicates(body)
+
+        try:
+            # Обработка событий лидов
+            if "leads" in body:
+                lead_events = self._process_lead_events(body["leads"])
+                events_processed += lead_events["processed"]
+                errors.extend(lead_events.get("errors", []))
+
+            # Обработка событий контактов
+            if "contacts" in body:
+                contact_events = self._process_contact_events(body["contacts"])
+                events_processed += contact_events["processed"]
+                rows_affected += contact_events.get("rows_affected", 0)
+                errors.extend(contact_events.get("errors", []))
+
+            # Один commit на весь payload
+            self.db.commit()
+            committed = True
+
+            # Обновления контактов идут в обход ORM (UPDATE по amocrm_contact_id),
+            # поэтому кэш результатов по лидам сбрасывается явно
+            if rows_affected:
+                invalidate_cache("leads")
+
+            if self.deduplicator is not None:
+                self.deduplicator.mark(self._applied_keys)
+
+            buffered = self._apply_buffering(source)
+
+        except Exception as e:
+            self.db.rollback()
+            error_msg = f"Error processing webhook events: {str(e)}"
+            logger.error(error_msg)
+            errors.append(error_msg)
+            events_processed = 0
+            rows_affected = 0
+
+        self._record_outcomes(committed)
+
+        return {
+            "processed": events_processed,
+            "errors": errors,
+            "committed": committed,
+            "duplicates": duplicates,
+            "rows_affected": rows_affected,
+            "buffered": buffered
+        }
+
+    def _drop_duplicates(self, body: Dict[str, Any]) -> tuple:
+        """Исключение уже обработанных событий из payload"""
+        if self.deduplicator is None:
+            return body, 0
+
+        keyed = {}
+        for section in ("leads", "contacts"):
+            section_data = body.get(section)
+            if not isinstance(section_data, dict):
+                continue
+            for event_type, events in section_data.items():
+                for index, event in enumerate(events or []):
+                    if isinstance(event, dict):
+                        key = event_key(self._account_id, f"{section}.{event_type}", event)
+                        if key:
+                            keyed[(section, event_type, index)] = key
+
+        if not keyed:
+            return body, 0
+
+        seen = self.deduplicator.filter_seen(keyed.values())
+        filtered = dict(body)
+        duplicates = 0
+        for section in ("leads", "contacts"):
+            section_data = body.get(section)
+            if not isinstance(section_data, dict):
+                continue
+            new_section = {}
+            for event_type, events in section_data.items():
+                kept = []
+                for index, event in enumerate(events or []):
+                    key = keyed.get((section, event_type, index))
+                    if key in seen:
+                        duplicates += 1
+                        self._count(f"{section}.{event_type}", "duplicate")
+                        continue
+                    if key:
+                        # Дубликаты внутри одного payload тоже пропускаем
+                        seen.add(key)
+                    kept.append(event)
+                new_section[event_type] = kept
+            filtered[section] = new_section
+
+        if duplicates:
+            logger.info(f"Skipped {duplicates} duplicate webhook events")
+        return filtered, duplicates
+
+    def _count(self, event: str, outcome: str, count: int = 1):
+        """Учет результата обработки события для метрик"""
+        key = (event, outcome)
+        self._outcomes[key] = self._outcomes.get(key, 0) + count
+
+    def _record_outcomes(self, committed: bool):
+        """Выгрузка счетчиков в метрики (после отката события не применены)"""
+        if not committed:
+            self._outcomes = {
+                (event, "rolled_back" if outcome == "processed" else outcome): count
+                for (event, outcome), count in self._outcomes.items()
+            }
+        record_webhook_events(self._outcomes)
+
+    def _remember(self, entity: str, event: Dict[str, Any]):
+        """
+        Запоминаем ключ успешно примененного события; для схлопнутого
+        обновления - ключи всех доставленных событий, из которых оно собрано
+        """
+        if self.deduplicator is not None:
+            if entity == "leads.update" and event.get("id") in self._update_keys:
+                self._applied_keys.extend(self._update_keys[event["id"]])
+                return
+            key = event_key(self._account_id, entity, event)
+            if key:
+                self._applied_keys.append(key)
+
+    def _process_lead_events(self, leads_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Обработка событий лидов"""
+        events_processed = 0
+        errors = []
+
+        leads_data = self._coalesce_updates(leads_data)
+
+        # Одним запросом получаем все лиды, упомянутые в секции
+        leads_by_id = self._load_leads_by_amo_id(
+            _collect_ids(leads_data, ("add", "update", "delete"))
+        )
+
+        handlers = (
+            ("add", self._process_new_lead, "Error processing new lead"),
+            ("update", self._process_lead_update, "Error processing lead update"),
+            ("delete", self._process_lead_delete, "Error processing lead delete"),
+        )
+
+        for event_type, handler, error_prefix in handlers:
+            for lead_data in leads_data.get(event_type) or []:
+                try:
+                    handler(lead_data, leads_by_id)
+                    self._remember(f"leads.{event_type}", lead_data)
+                    self._count(f"leads.{event_type}", "processed")
+                    events_processed += 1
+                except Exception as e:
+                    self._count(f"leads.{event_type}", "error")
+                    error_msg = f"{error_prefix} {lead_data.get('id', 'unknown')}: {str(e)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+
+        return {
+            "processed": events_processed,
+            "errors": errors
+        }
+
+    def _coalesce_updates(self, leads_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Схлопывание leads.update по лиду и буферизация во временном окне"""
+        if self.coalescer is None:
+            return leads_data
+
+        buffering = self.buffer_updates and self.coalescer.window > 0
+        if buffering and leads_data.get("delete"):
+            # Удаление лида отменяет его отложенные обновления (после commit)
+            self._discarded_ids = _collect_ids(leads_data, ("delete",))
+
+        updates = leads_data.get("update")
+        if not updates:
+            return leads_data
+
+        leads_data = dict(leads_data)
+        self._update_keys = self._original_update_keys(updates)
+        # Запись буфера (buffer_updates=False) уже учтена при поступлении
+        updates = self.coalescer.coalesce(updates, count=self.buffer_updates)
+
+        if buffering:
+            self._buffered_updates = updates
+            updates = []
+
+        leads_data["update"] = updates
+        return leads_data
+
+    def _original_update_keys(self, updates: List[Dict[str, Any]]) -> Dict[Any, List[str]]:
+        """Ключи дедупликации leads.update до схлопывания, по id лида"""
+        keys: Dict[Any, List[str]] = {}
+        if self.deduplicator is None:
+            return keys
+        for event in updates:
+            lead_id = event.get("id") if isinstance(event, dict) else None
+            if not lead_id:
+                continue
+            if lead_id in self.update_keys:
+                # Запись буфера окна: ключи событий, накопленных в буфере
+                keys.setdefault(lead_id, []).extend(self.update_keys[lead_id])
+                continue
+            key = event_key(self._account_id, "leads.update", event)
+            if key:
+                keys.setdefault(lead_id, []).append(key)
+        return keys
+
+    def _apply_buffering(self, source: Any) -> int:
+        """Передача обновлений зафиксированного payload в буфер окна"""
+        if self.coalescer is None:
+            return 0
+        if self._discarded_ids:
+            self.coalescer.discard(self._account_id, self._discarded_ids)
+        updates = self._buffered_updates
+        if not updates:
+            return 0
+        self.coalescer.buffer(self._account_id, updates, source=source, keys=self._update_keys)
+        self._count("leads.update", "buffered", len(updates))
+        logger.info(f"Buffered {len(updates)} lead updates for coalescing")
+        return len(updates)
+
+    def _process_contact_events(self, contacts_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Обработка событий контактов"""
+        events_processed = 0
+        errors = []
+
+        # Новые лиды из этого же payload должны быть видны UPDATE по контактам
+        self.db.flush()
+
+        handlers = (
+            ("add", self._process_new_contact, "Error processing new contact"),
+            ("update", self._process_contact_update, "Error processing contact update"),
+        )
+
+        # Изменения по контактам копятся в памяти, более поздние события побеждают
+        changes: Dict[int, Dict[str, Any]] = {}
+        for event_type, handler, error_prefix in handlers:
+            for contact_data in contacts_data.get(event_type) or []:
+                try:
+                    handler(contact_data, changes)
+                    self._remember(f"contacts.{event_type}", contact_data)
+                    self._count(f"contacts.{event_type}", "processed")
+                    events_processed += 1
+                except Exception as e:
+                    self._count(f"contacts.{event_type}", "error")
+                    error_msg = f"{error_prefix} {contact_data.get('id', 'unknown')}: {str(e)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+
+        return {
+            "processed": events_processed,
+            "errors": errors,
+            "rows_affected": self._apply_contact_changes(changes)
+        }
+
+    def _load_leads_by_amo_id(self, lead_ids: List[int]) -> Dict[int, Lead]:
+        """Загрузка лидов по amoCRM ID одним запросом"""
+        if not lead_ids:
+            return {}
+
+        leads = self.db.query(Lead).filter(Lead.amocrm_lead_id.in_(lead_ids)).all()
+        return {lead.amocrm_lead_id: lead for lead in leads}
+
+    def _process_new_lead(self, lead_data: Dict[str, Any], leads_by_id: Dict[int, Lead]):
+        """Обработка нового лида из amoCRM"""
+        lead_id = lead_data.get("id")
+        if not lead_id:
+            raise ValueError("Lead ID is required")
+
+        # Проверяем, есть ли уже такой лид в нашей БД (или в этом payload)
+        if lead_id in leads_by_id:
+            logger.info(f"Lead {lead_id} already exists in local DB")
+            return
+
+        # Получаем информацию о контакте
+        contact_id = None
+        if "_embedded" in lead_data and "contacts" in lead_data["_embedded"]:
+            contact_id = lead_data["_embedded"]["contacts"][0]["id"]
+
+        # Извлекаем UTM метки из кастомных полей
+        utm_data = _extract_utm_data(lead_data, self.fields)
+
+        new_lead = Lead(
+            name=lead_data.get("name", "Новый лид"),
+            phone="",  # Будет заполнено из контакта
+            email="",  # Будет заполнено из контакта
+            amocrm_contact_id=contact_id,
+            amocrm_lead_id=lead_id,
+            status=_map_amo_status(lead_data.get("status_id", 1)),
+            source="amocrm_webhook",
+            utm_source=utm_data.get("utm_source"),
+            utm_medium=utm_data.get("utm_medium"),
+            utm_campaign=utm_data.get("utm_campaign"),
+            utm_content=utm_data.get("utm_content"),
+            utm_term=utm_data.get("utm_term"),
+            created_at=_parse_amo_timestamp(lead_data.get("created_at"))
+        )
+
+        self.db.add(new_lead)
+        leads_by_id[lead_id] = new_lead
+
+        logger.info(f"New lead created from amoCRM: {lead_id}")
+
+    def _process_lead_update(self, lead_data: Dict[str, Any], leads_by_id: Dict[int, Lead]):
+        """Обработка обновления лида из amoCRM"""
+        lead_id = lead_data.get("id")
+        if not lead_id:
+            raise ValueError("Lead ID is required")
+
+        lead = leads_by_id.get(lead_id)
+        if not lead:
+            logger.warning(f"Lead {lead_id} not found in local DB")
+            return
+
+        # Обновляем статус (со временем изменения в amoCRM)
+        if "status_id" in lead_data:
+            record_status_change(
+                self.db,
+                lead,
+                _map_amo_status(lead_data["status_id"]),
+                source="amocrm",
+                changed_at=_parse_amo_timestamp(lead_data.get("updated_at"))
+            )
+
+        # Обновляем название
+        if "name" in lead_data:
+            lead.name = lead_data["name"]
+
+        # Обновляем UTM метки
+        utm_data = _extract_utm_data(lead_data, self.fields)
+        for utm_field, value in utm_data.items():
+            if value:
+                setattr(lead, utm_field, value)
+
+        logger.info(f"Lead updated from amoCRM: {lead_id}")
+
+    def _process_lead_delete(self, lead_data: Dict[str, Any], leads_by_id: Dict[int, Lead]):
+        """Обработка удаления лида из amoCRM"""
+        lead_id = lead_data.get("id")
+        if not lead_id:
+            raise ValueError("Lead ID is required")
+
+        lead = leads_by_id.get(lead_id)
+        if not lead:
+            logger.warning(f"Lead {lead_id} not found in local DB")
+            return
+
+        # Помечаем как удаленный
+        record_status_change(self.db, lead, "deleted", source="amocrm")
+
+        logger.info(f"Lead marked as deleted from amoCRM: {lead_id}")
+
+    def _process_new_contact(self, contact_data: Dict[str, Any], changes: Dict[int, Dict[str, Any]]):
+        """Обработка нового контакта из amoCRM"""
+        self._collect_contact(contact_data, changes)
+
+    def _process_contact_update(self, contact_data: Dict[str, Any], changes: Dict[int, Dict[str, Any]]):
+        """Обработка обновления контакта из amoCRM"""
+        self._collect_contact(contact_data, changes)
+
+    def _collect_contact(self, contact_data: Dict[str, Any], changes: Dict[int, Dict[str, Any]]):
+        """Сбор данных контакта для переноса на связанные лиды"""
+        contact_id = contact_data.get("id")
+        if not contact_id:
+            raise ValueError("Contact ID is required")
+
+        # Телефон и email за один проход по кастомным полям
+        values = self.fields.extract(contact_data)
+
+        contact_changes = changes.setdefault(contact_id, {})
+        if "name" in contact_data:
+            contact_changes["name"] = contact_data["name"]
+        for column in CONTACT_FIELDS:
+            if values.get(column) is not None:
+                contact_changes[column] = values[column]
+
+    def _apply_contact_changes(self, changes: Dict[int, Dict[str, Any]]) -> int:
+        """
+        Перенос данных контактов на лиды без загрузки ORM объектов
+
+        Для каждой пачки контактов выполняется один
+        ``UPDATE leads SET col = CASE amocrm_contact_id ... END
+        WHERE amocrm_contact_id IN (...)``. Возвращает число затронутых строк.
+        """
+        changes = {contact_id: values for contact_id, values in changes.items() if values}
+        contact_ids = list(changes)
+        rows_affected = 0
+
+        for offset in range(0, len(contact_ids), CONTACT_UPDATE_CHUNK_SIZE):
+            chunk = contact_ids[offset:offset + CONTACT_UPDATE_CHUNK_SIZE]
+            values = {}
+            for column in ("name",) + CONTACT_FIELDS:
+                column_values = {
+                    contact_id: changes[contact_id][column]
+                    for contact_id in chunk
+                    if column in changes[contact_id]
+                }
+                if column_values:
+                    values[column] = case(
+                        column_values,
+                        value=Lead.amocrm_contact_id,
+                        else_=getattr(Lead, column)
+                    )
+
+            result = self.db.execute(
+                update(Lead)
+                .where(Lead.amocrm_contact_id.in_(chunk))
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            rows_affected += result.rowcount or 0
+
+        if contact_ids:
+            logger.info(f"Contact information updated from amoCRM: {len(contact_ids)} contacts, {rows_affected} leads")
+        return rows_affected
+
+
+def _collect_ids(section_data: Dict[str, Any], event_types: Iterable[str]) -> List[int]:
+    """Сбор уникальных ID сущностей из секции webhook"""
+    ids = set()
+    for event_type in event_types:
+        for item in section_data.get(event_type) or []:
+            entity_id = item.get("id") if isinstance(item, dict) else None
+            if entity_id:
+                ids.add(entity_id)
+    return list(ids)
+
+
+def _parse_amo_timestamp(value: Any) -> Optional[datetime]:
+    """Преобразование unix timestamp amoCRM в datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.utcfromtimestamp(int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _extract_utm_data(data: Dict[str, Any], fields: Optional[CompiledFieldMapping] = None) -> Dict[str, str]:
+    """Извлечение UTM меток из кастомных полей"""
+    values = (fields or field_mapping_registry.get(None)).extract(data)
+    return {field: values[field] for field in UTM_FIELDS if field in values}
+
+
+def _map_amo_status(status_id: int) -> str:
+    """Маппинг статусов amoCRM на внутренние статусы"""
+    return AMO_STATUS_MAPPING.get(status_id, "new")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности с логированием и без
+
+Запросы к списку лидов (in-memory SQLite) выполняются через полное
+приложение в трех режимах: логирование выключено, синхронные
+обработчики (LOG_QUEUE_ENABLED=false) и очередь с фоновым потоком.
+Консольный вывод уходит в /dev/null, файловый - во временный каталог.
+
+    python scripts/benchmark_logging.py --requests 3000 --concurrency 10
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+# Добавляем корневую папку backend в путь
+backend_root = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_root))
+
+import httpx
+
+from app.core import logging as app_logging
+from app.core.config import settings
+from app.core.db import get_async_db
+from app.integrations.amo.replay import rate_limit_disabled, setup_replay_database
+from app.models.lead import Lead
+
+PATH = "/api/leads/?limit=20"
+
+
+async def run_requests(asgi_app, requests: int, concurrency: int) -> float:
+    """Запросов в секунду"""
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        await asyncio.gather(*[client.get(PATH) for _ in range(concurrency)])  # прогрев
+        started = time.perf_counter()
+        for _ in range(requests // concurrency):
+            responses = await asyncio.gather(*[client.get(PATH) for _ in range(concurrency)])
+            if any(response.status_code != 200 for response in responses):
+                raise RuntimeError(f"{PATH} failed: {responses[0].text[:200]}")
+        elapsed = time.perf_counter() - started
+    return (requests // concurrency) * concurrency / elapsed
+
+
+@contextlib.contextmanager
+def logging_mode(mode: str, log_dir: str):
+    """Настройка логирования для режима и восстановление после замера"""
+    original = (settings.log_queue_enabled, settings.log_file, sys.stdout)
+    devnull = open(os.devnull, "w")
+    cwd = os.getcwd()
+    os.chdir(log_dir)
+    try:
+        sys.stdout = devnull
+        settings.log_queue_enabled = mode == "queue"
+        settings.log_file = "app.log"
+        app_logging.setup_logging()
+        if mode == "off":
+            logging.disable(logging.CRITICAL)
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+        app_logging.stop_logging()
+        settings.log_queue_enabled, settings.log_file, sys.stdout = original
+        os.chdir(cwd)
+        devnull.close()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Logging overhead benchmark")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    from app.main import app as api_app
+
+    database = await setup_replay_database(api_app)
+    session_factory = api_app.dependency_overrides[get_async_db]
+    async for db in session_factory():
+        db.add_all([Lead(name=f"Lead {i}", phone="", status="new") for i in range(20)])
+        await db.commit()
+
+    report = {}
+    try:
+        with rate_limit_disabled(), tempfile.TemporaryDirectory() as log_dir:
+            for mode in ("off", "sync", "queue"):
+                with logging_mode(mode, log_dir):
+                    report[mode] = round(await run_requests(api_app, args.requests, args.concurrency), 1)
+    finally:
+        await database.close(api_app)
+
+    print(json.dumps({"requests_per_second": report}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов middleware
+
+Один и тот же маршрут вызывается через полное приложение (со всем стеком
+middleware) и напрямую через роутер; разница - стоимость middleware на
+запрос. Маршруты: /health и список лидов (in-memory SQLite).
+
+    python scripts/benchmark_middleware.py --requests 2000
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+# Добавляем корневую папку backend в путь
+backend_root = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_root))
+
+import httpx
+
+from app.core.db import get_async_db
+from app.integrations.amo.replay import rate_limit_disabled, setup_replay_database
+from app.models.lead import Lead
+
+
+async def measure(asgi_app, path: str, requests: int) -> list:
+    """Задержки последовательных запросов (секунды)"""
+    transport = httpx.ASGITransport(app=asgi_app)
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        # Прогрев
+        for _ in range(min(50, requests)):
+            await client.get(path)
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+    return latencies
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "mean_us": round(statistics.fmean(latencies) * 1e6, 1),
+        "p50_us": round(statistics.median(latencies) * 1e6, 1)
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Middleware overhead benchmark")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    from app.main import app
+
+    database = await setup_replay_database(app)
+    session_factory = app.dependency_overrides[get_async_db]
+    async for db in session_factory():
+        db.add_all([Lead(name=f"Lead {i}", phone="", status="new") for i in range(50)])
+        await db.commit()
+
+    report = {}
+    try:
+        with rate_limit_disabled():
+            for path in ("/health", "/api/leads/?limit=50"):
+                full = summarize(await measure(app, path, args.requests))
+                bare = summarize(await measure(app.router, path, args.requests))
+                report[path] = {
+                    "with_middleware": full,
+                    "router_only": bare,
+                    "overhead_us": round(full["mean_us"] - bare["mean_us"], 1)
+                }
+    finally:
+        await database.close(app)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Импорт расходов на рекламу (ad_spend) из выгрузки рекламного кабинета
+
+Поля: day (или date), utm_source (source), utm_campaign (campaign,
+необязательно), cost (spend, amount). Файл читается потоково, размер не
+ограничен памятью.
+
+Примеры:
+    # CSV, расход по ключу заменяется
+    python scripts/import_ad_spend.py spend_2025_10.csv
+
+    # NDJSON из stdin, расход прибавляется к записанному
+    cat spend.ndjson | python scripts/import_ad_spend.py - --format json --mode add
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+# Добавляем корневую папку backend в путь
+backend_root = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.analytics.spend import SPEND_FORMATS, SPEND_MODES, import_spend_file
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import advertising spend into ad_spend")
+    parser.add_argument("path", help="Файл выгрузки или - для stdin")
+    parser.add_argument("--format", choices=SPEND_FORMATS, default=None, help="По умолчанию - по расширению файла")
+    parser.add_argument("--mode", choices=SPEND_MODES, default="replace", help="replace - заменить, add - прибавить")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fmt = args.format or ("json" if args.path.lower().endswith((".json", ".ndjson", ".jsonl")) else "csv")
+
+    if args.path == "-":
+        result = import_spend_file(sys.stdin, fmt, args.mode)
+    else:
+        with open(args.path, encoding="utf-8-sig", newline="") as stream:
+            result = import_spend_file(stream, fmt, args.mode)
+
+    print(f"ad_spend imported: {result.rows} rows, {result.skipped} skipped ({result.first_day} - {result.last_day})")
+    for error in result.errors:
+        print(f"  {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Пересчет дневного агрегата лидов (lead_daily_rollup) по таблице leads
+
+Нужен после массовых изменений в обход ORM (query().update(), ручной SQL)
+или при расхождении агрегата с лидами.
+
+Примеры:
+    # Весь агрегат
+    python scripts/rebuild_lead_rollup.py
+
+    # Только период
+    python scripts/rebuild_lead_rollup.py --start 2025-10-01 --end 2025-10-17
+"""
+
+import sys
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+# Добавляем корневую папку backend в путь
+backend_root = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.analytics.rollup import rebuild_lead_rollup
+from app.core.db import SessionLocal
+
+
+def parse_date(value: str):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rebuild lead_daily_rollup from leads")
+    parser.add_argument("--start", type=parse_date, default=None, help="Первый день периода (YYYY-MM-DD)")
+    parser.add_argument("--end", type=parse_date, default=None, help="Последний день периода (YYYY-MM-DD)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        rows = rebuild_lead_rollup(db, args.start, args.end)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    print(f"lead_daily_rollup rebuilt: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
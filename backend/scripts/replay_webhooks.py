@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанного webhook трафика amoCRM
+
+Примеры:
+    # Архив из WEBHOOK_CAPTURE_ENABLED=true, максимально быстро
+    python scripts/replay_webhooks.py logs/webhook_capture.jsonl.gz
+
+    # С записанной скоростью и с ускорением в 10 раз
+    python scripts/replay_webhooks.py capture.jsonl.gz --speed 1
+    python scripts/replay_webhooks.py capture.jsonl.gz --speed 10
+
+    # Синтетический архив для воспроизводимого офлайн прогона
+    python scripts/replay_webhooks.py synthetic.jsonl.gz --generate 1000
+
+По умолчанию используется in-memory SQLite, поэтому прогон не зависит
+от окружения; --database-url позволяет прогнать трафик на реальной БД.
+При WEBHOOK_LANES>0 нужен --database-url (полосы пишут параллельно).
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+from pathlib import Path
+
+# Добавляем корневую папку backend в путь
+backend_root = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.core.config import settings
+from app.integrations.amo.capture import WebhookRecorder, read_archive
+from app.integrations.amo.replay import (
+    StatementCounter, rate_limit_disabled, replay_records, setup_replay_database, synthetic_records
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay captured amoCRM webhooks in-process")
+    parser.add_argument("archive", help="Путь к архиву .jsonl.gz")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="0 - максимально быстро, 1 - записанная скорость, N - ускорение в N раз")
+    parser.add_argument("--database-url", default="sqlite://",
+                        help="БД для прогона (по умолчанию in-memory SQLite)")
+    parser.add_argument("--limit", type=int, default=None, help="Максимум записей")
+    parser.add_argument("--generate", type=int, default=None, metavar="N",
+                        help="Записать синтетический архив из N webhook и выйти")
+    parser.add_argument("--seed", type=int, default=42, help="Seed синтетического архива")
+    parser.add_argument("--keep-rate-limit", action="store_true",
+                        help="Не отключать rate limit API во время прогона")
+    return parser.parse_args()
+
+
+def generate_archive(path: str, count: int, seed: int):
+    """Запись синтетического архива (существующий файл перезаписывается)"""
+    Path(path).unlink(missing_ok=True)
+    recorder = WebhookRecorder(path)
+    for record in synthetic_records(count, seed=seed):
+        recorder.record(record["body"], record["headers"], timestamp=record["ts"])
+    recorder.close()
+    print(f"Synthetic archive with {count} webhooks written to {path}")
+
+
+async def main() -> int:
+    args = parse_args()
+
+    if args.generate:
+        generate_archive(args.archive, args.generate, args.seed)
+        return 0
+
+    records = list(read_archive(args.archive))
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print(f"No webhooks found in {args.archive}")
+        return 1
+
+    # Подпись считается тем же секретом, которым ее проверяет middleware
+    if not settings.amocrm_webhook_secret:
+        settings.amocrm_webhook_secret = "replay-secret"
+
+    from app.main import app
+    try:
+        database = await setup_replay_database(app, args.database_url)
+    except ValueError as e:
+        print(str(e))
+        return 1
+
+    try:
+        with StatementCounter(database.sync_engine) as counter:
+            if args.keep_rate_limit:
+                report = await replay_records(records, app, speed=args.speed, statement_counter=counter)
+            else:
+                with rate_limit_disabled():
+                    report = await replay_records(records, app, speed=args.speed, statement_counter=counter)
+    finally:
+        await database.close(app)
+
+    report["speed"] = args.speed or "max"
+    report["async_mode"] = settings.webhook_async_mode
+    report["lanes"] = settings.webhook_lanes
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Отдельный процесс-воркер для очереди webhook amoCRM
+Используется вместе с WEBHOOK_ASYNC_MODE=true, когда воркеры нужно
+вынести из процесса API
+"""
+
+import sys
+import signal
+import asyncio
+import logging
+from pathlib import Path
+
+# Добавляем корневую папку backend в путь
+backend_root = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_root))
+
+from app.core.logging import setup_logging
+from app.services.webhook_queue import WebhookWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+async def main() -> int:
+    setup_logging()
+
+    pool = WebhookWorkerPool()
+    stop_event = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    pool.start()
+    logger.info("Webhook worker process started")
+
+    await stop_event.wait()
+
+    logger.info("Stopping webhook worker process, draining queue...")
+    await pool.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
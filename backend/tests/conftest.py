@@ -0,0 +1,50 @@
+"""
+Общие фикстуры для тестов
+"""
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.db import Base
+import app.models  # noqa: F401 - регистрация моделей в metadata
+import app.models.user  # noqa: F401
+import app.models.notification  # noqa: F401
+
+
+@pytest.fixture
+def db_engine():
+    """In-memory SQLite движок с созданной схемой"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine):
+    """Сессия БД для тестов"""
+    session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def statements(db_engine):
+    """Счетчик SQL запросов (выполненные запросы db_engine)"""
+    executed = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", before_execute)
+    yield executed
+    event.remove(db_engine, "before_cursor_execute", before_execute)
@@ -99,95 +99,101 @@ class TestSecurityUtils:
 class TestRateLimiter:
     """Тесты для rate limiter"""
 
-    def test_rate_limiter_initial_state(self):
+    @pytest.mark.asyncio
+    async def test_rate_limiter_initial_state(self):
         """Тест начального состояния rate limiter"""
         limiter = RateLimiter()
         client_id = "test_client"
         
         # В начальном состоянии запросы должны быть разрешены
-        assert limiter.is_allowed(client_id, limit=1, window=3600) is True
+        assert await limiter.is_allowed(client_id, limit=1, window=3600) is True
 
-    def test_rate_limiter_within_limit(self):
+    @pytest.mark.asyncio
+    async def test_rate_limiter_within_limit(self):
         """Тест rate limiter в пределах лимита"""
         limiter = RateLimiter()
         client_id = "test_client"
         
         # Первый запрос должен быть разрешен
-        assert limiter.is_allowed(client_id, limit=2, window=3600) is True
+        assert await limiter.is_allowed(client_id, limit=2, window=3600) is True
         
         # Второй запрос должен быть разрешен
-        assert limiter.is_allowed(client_id, limit=2, window=3600) is True
+        assert await limiter.is_allowed(client_id, limit=2, window=3600) is True
 
-    def test_rate_limiter_exceed_limit(self):
+    @pytest.mark.asyncio
+    async def test_rate_limiter_exceed_limit(self):
         """Тест rate limiter при превышении лимита"""
         limiter = RateLimiter()
         client_id = "test_client"
         
         # Первый запрос
-        assert limiter.is_allowed(client_id, limit=1, window=3600) is True
+        assert await limiter.is_allowed(client_id, limit=1, window=3600) is True
         
         # Второй запрос должен быть заблокирован
-        assert limiter.is_allowed(client_id, limit=1, window=3600) is False
+        assert await limiter.is_allowed(client_id, limit=1, window=3600) is False
 
-    def test_rate_limiter_window_expiry(self):
+    @pytest.mark.asyncio
+    async def test_rate_limiter_window_expiry(self):
         """Тест истечения окна rate limiter"""
         limiter = RateLimiter()
         client_id = "test_client"
         
         # Первый запрос
-        assert limiter.is_allowed(client_id, limit=1, window=1) is True
+        assert await limiter.is_allowed(client_id, limit=1, window=1) is True
         
         # Второй запрос должен быть заблокирован
-        assert limiter.is_allowed(client_id, limit=1, window=1) is False
+        assert await limiter.is_allowed(client_id, limit=1, window=1) is False
         
         # Ждем истечения окна
-        import time
-        time.sleep(1.1)
+        import asyncio
+        await asyncio.sleep(1.1)
         
         # После истечения окна запрос должен быть разрешен
-        assert limiter.is_allowed(client_id, limit=1, window=1) is True
+        assert await limiter.is_allowed(client_id, limit=1, window=1) is True
 
 
 class TestSecurityMiddleware:
     """Тесты для middleware безопасности"""
 
     @pytest.fixture
-    def mock_request(self):
-        """Мок для HTTP запроса"""
-        request = Mock()
-        request.url.path = "/api/test"
-        request.client.host = "127.0.0.1"
-        request.headers = {}
-        return request
-
-    @pytest.fixture
-    def mock_response(self):
-        """Мок для HTTP ответа"""
-        response = Mock()
-        response.headers = {}
-        response.status_code = 200
-        return response
-
-    def test_security_headers(self, mock_request, mock_response):
+    def scope(self):
+        """ASGI scope HTTP запроса"""
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": "/api/test",
+            "headers": [(b"host", b"localhost")],
+            "client": ("127.0.0.1", 12345),
+        }
+
+    def test_security_headers(self, scope):
         """Тест добавления security headers"""
         from app.core.middleware import SecurityMiddleware
-        
-        middleware = SecurityMiddleware(Mock())
-        
-        # Мокаем call_next
-        async def mock_call_next(request):
-            return mock_response
-        
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = SecurityMiddleware(app, environment="development")
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
         # Вызываем middleware
         import asyncio
-        result = asyncio.run(middleware.dispatch(mock_request, mock_call_next))
-        
+        asyncio.run(middleware(scope, receive, send))
+
         # Проверяем, что security headers добавлены
-        assert "X-Content-Type-Options" in result.headers
-        assert "X-Frame-Options" in result.headers
-        assert "X-XSS-Protection" in result.headers
-        assert "Referrer-Policy" in result.headers
-        assert "Strict-Transport-Security" in result.headers
+        headers = dict(messages[0]["headers"])
+        assert b"x-content-type-options" in headers
+        assert b"x-frame-options" in headers
+        assert b"x-xss-protection" in headers
+        assert b"referrer-policy" in headers
+        assert b"strict-transport-security" in headers
 
 
 class TestWebhookSecurity:
@@ -196,12 +202,17 @@ class TestWebhookSecurity:
     def test_webhook_signature_validation(self):
         """Тест валидации подписи webhook"""
         from app.core.middleware import WebhookSignatureMiddleware
-        
-        middleware = WebhookSignatureMiddleware(Mock())
+
+        received = []
+
+        async def app(scope, receive, send):
+            received.append(await receive())
+
+        middleware = WebhookSignatureMiddleware(app)
         
         # Создаем тестовые данные
         payload = '{"test": "data"}'
-        secret = settings.amocrm_webhook_secret
+        secret = "test_webhook_secret"
         
         import hmac
         import hashlib
@@ -211,22 +222,27 @@ class TestWebhookSecurity:
             hashlib.sha256
         ).hexdigest()
         
-        # Мокаем запрос
-        request = Mock()
-        request.url.path = "/api/webhooks/amocrm"
-        request.headers = {"X-Webhook-Signature": signature}
-        request.body = lambda: payload.encode()
-        
-        # Мокаем call_next
-        async def mock_call_next(request):
-            return Mock()
+        # ASGI scope запроса
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/api/webhooks/amocrm",
+            "headers": [(b"x-webhook-signature", signature.encode())],
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": payload.encode(), "more_body": False}
+
+        async def send(message):
+            pass
         
         # Тестируем с правильной подписью
         import asyncio
-        result = asyncio.run(middleware.dispatch(request, mock_call_next))
+        with patch.object(settings, "amocrm_webhook_secret", secret):
+            asyncio.run(middleware(scope, receive, send))
         
-        # Должен вернуть нормальный ответ
-        assert result is not None
+        # Запрос с телом должен дойти до приложения
+        assert received[0]["body"] == payload.encode()
 
 
 class TestRetryLogic:
@@ -0,0 +1,103 @@
+"""
+Unit тесты для расходов на рекламу (импорт и индекс префиксных сумм)
+"""
+
+import io
+from datetime import date, datetime
+
+import pytest
+
+from app.analytics.metrics import AnalyticsCalculator
+from app.analytics.spend import SpendIndex, import_spend, iter_csv_records, iter_json_records
+from app.core.cache import result_cache
+from app.models.ad_spend import AdSpend
+from app.models.deal import Deal
+from app.models.lead import Lead
+
+CSV = """day,utm_source,utm_campaign,cost
+2025-10-01,google,brand,100
+2025-10-01,google,generic,50
+2025-10-02,google,brand,70
+2025-10-03,facebook,,40
+2025-10-05,facebook,retarget,10
+bad-date,google,brand,1
+"""
+
+
+def _import_csv(db_session, text=CSV, mode="replace"):
+    result = import_spend(db_session, iter_csv_records(io.StringIO(text)), mode=mode, batch_size=2)
+    db_session.commit()
+    return result
+
+
+def test_json_array_and_ndjson_are_streamed_across_chunks():
+    array = '[{"day": "2025-10-01", "source": "google", "cost": 1.5},\n {"date": "2025-10-02", "utm_source": "vk", "spend": 2}]'
+    ndjson = '{"day": "2025-10-01", "utm_source": "google", "cost": 1}\n{"day": "2025-10-02", "utm_source": "vk", "cost": 2}\n'
+
+    for text in (array, ndjson):
+        records = list(iter_json_records(io.StringIO(text), chunk_size=7))
+        assert len(records) == 2
+
+    with pytest.raises(ValueError):
+        list(iter_json_records(io.StringIO('[{"day": "2025-10-01", '), chunk_size=7))
+
+
+def test_import_replaces_or_adds_costs_and_skips_bad_rows(db_session):
+    result = _import_csv(db_session)
+    assert (result.rows, result.skipped) == (5, 1)
+    assert result.first_day == date(2025, 10, 1) and result.last_day == date(2025, 10, 5)
+
+    _import_csv(db_session, "day,utm_source,utm_campaign,cost\n2025-10-01,google,brand,30\n")
+    assert db_session.get(AdSpend, (date(2025, 10, 1), "google", "brand")).cost == 30
+
+    _import_csv(db_session, "day,utm_source,utm_campaign,cost\n2025-10-01,google,brand,5\n", mode="add")
+    assert db_session.get(AdSpend, (date(2025, 10, 1), "google", "brand")).cost == 35
+
+
+def test_index_range_lookups_without_queries(db_session, statements):
+    _import_csv(db_session)
+    index = SpendIndex(reload_interval=60)
+    index.ensure_loaded(db_session)
+
+    statements.clear()
+    index.ensure_loaded(db_session)
+    assert index.total(date(2025, 10, 1), date(2025, 10, 31)) == 270
+    assert index.total(date(2025, 10, 2), date(2025, 10, 3)) == 110
+    assert index.total(datetime(2025, 10, 1, 15), datetime(2025, 10, 1, 9), utm_source="google") == 150
+    assert index.total(date(2025, 10, 2), date(2025, 10, 1)) == 0
+    assert index.total(date(2025, 9, 1), date(2025, 10, 1), utm_source="google") == 150
+    assert index.total(date(2025, 10, 1), date(2025, 10, 31), "google", "brand") == 170
+    assert index.total(date(2025, 10, 1), date(2025, 10, 31), "facebook", "") == 40
+    assert index.total(date(2025, 10, 1), date(2025, 10, 31), utm_source="vk") == 0
+    assert index.total_for_sources(date(2025, 10, 1), date(2025, 10, 4), ["google", "facebook"]) == 260
+    assert index.by_source(date(2025, 10, 4), date(2025, 10, 5)) == {"facebook": 10}
+    assert statements == []
+
+    _import_csv(db_session, "day,utm_source,cost\n2025-10-04,vk,25\n")
+    index.mark_stale()
+    index.ensure_loaded(db_session)
+    assert index.total(date(2025, 10, 1), date(2025, 10, 31), utm_source="vk") == 25
+
+
+def test_calculator_uses_imported_spend(db_session):
+    result_cache.clear()
+    _import_csv(db_session)
+    db_session.add_all([
+        Lead(id=1, name="A", phone="1", utm_source="google", created_at=datetime(2025, 10, 1, 10)),
+        Lead(id=2, name="B", phone="2", utm_source="google", created_at=datetime(2025, 10, 2, 10)),
+        Lead(id=3, name="C", phone="3", utm_source="facebook", created_at=datetime(2025, 10, 3, 10)),
+    ])
+    db_session.add(Deal(id=1, lead_id=1, amocrm_deal_id=1, amount=540.0, status="completed",
+                        created_at=datetime(2025, 10, 4)))
+    db_session.commit()
+
+    calculator = AnalyticsCalculator(db_session, engine=None, spend=SpendIndex(reload_interval=0))
+    calculator.engine = None
+    start, end = datetime(2025, 10, 1), datetime(2025, 10, 31, 23, 59)
+
+    cpl = calculator.calculate_cpl(start, end)
+    assert (cpl["total_cost"], cpl["leads_count"], cpl["value"]) == (270, 3, 90)
+    assert cpl["breakdown"] == {"google": 110, "facebook": 50}
+
+    roi = calculator.calculate_roi(start, end, utm_source="google")
+    assert (roi["total_cost"], roi["total_revenue"], roi["value"]) == (220, 540.0, 145.45)
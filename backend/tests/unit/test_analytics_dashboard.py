@@ -0,0 +1,78 @@
+"""
+Unit тесты для дашборда AnalyticsService
+"""
+
+from datetime import datetime, timedelta
+
+from app.models.lead import Lead
+from app.models.lead_daily_rollup import LeadDailyRollup
+from app.models.user import User
+from app.services.analytics_service import AnalyticsService
+
+
+def _seed(db_session, users, sources):
+    db_session.add_all([
+        User(id=i + 1, email=f"user{i}@example.com", hashed_password="x", full_name=f"User {i}")
+        for i in range(users)
+    ])
+    now = datetime.now()
+    statuses = ["new", "qualified", "closed_won"]
+    db_session.add_all([
+        Lead(
+            name=f"Lead {i}",
+            phone="",
+            status=statuses[i % 3],
+            source=f"source-{i % sources}",
+            assigned_to=i % users + 1,
+            created_at=now - timedelta(days=40 if i % 4 == 0 else 1, seconds=i)
+        )
+        for i in range(max(users, sources) * 3)
+    ])
+    db_session.commit()
+
+
+def _reset(db_session):
+    # Массовое удаление в обход ORM: агрегат очищается явно
+    db_session.query(Lead).delete()
+    db_session.query(LeadDailyRollup).delete()
+    db_session.query(User).delete()
+    db_session.commit()
+
+
+def test_dashboard_values(db_session):
+    _seed(db_session, users=2, sources=2)
+
+    dashboard = AnalyticsService(db_session).get_dashboard_data()
+
+    assert dashboard.lead_metrics.total_leads == 6
+    assert dashboard.lead_metrics.converted_leads == 4
+    assert dashboard.lead_metrics.conversion_by_status == {"new": 2, "qualified": 2, "closed_won": 2}
+    assert dashboard.lead_metrics.conversion_by_source == {"source-0": 3, "source-1": 3}
+    assert dashboard.performance_metrics.leads_per_day == 4 / 30
+    assert dashboard.performance_metrics.deals_per_month == 2
+    assert dashboard.performance_metrics.user_activity == {"user0@example.com": 3, "user1@example.com": 3}
+    assert [p["converted_leads"] for p in dashboard.top_performers] == [1, 1]
+    assert dashboard.recent_activities[0]["title"] == "Новый лид: Lead 1"
+
+
+def test_dashboard_for_user_keeps_empty_groups(db_session):
+    _seed(db_session, users=2, sources=2)
+
+    dashboard = AnalyticsService(db_session).get_dashboard_data(user_id=1)
+
+    assert dashboard.lead_metrics.total_leads == 3
+    assert dashboard.lead_metrics.conversion_by_source == {"source-0": 3, "source-1": 0}
+    assert dashboard.performance_metrics.user_activity == {}
+    assert {activity["user_id"] for activity in dashboard.recent_activities} == {1}
+
+
+def test_dashboard_query_count_is_constant(db_session, statements):
+    counts = []
+    for users, sources in ((2, 2), (30, 40)):
+        _reset(db_session)
+        _seed(db_session, users, sources)
+        statements.clear()
+        AnalyticsService(db_session).get_dashboard_data()
+        counts.append(len(statements))
+
+    assert counts == [4, 4]
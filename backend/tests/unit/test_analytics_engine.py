@@ -0,0 +1,104 @@
+"""
+Unit тесты для колоночного движка аналитики
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from app.analytics.engine import AnalyticsEngine, FactTable
+from app.analytics.metrics import AnalyticsCalculator
+from app.models.deal import Deal
+from app.models.lead import Lead
+
+START = datetime(2025, 10, 1)
+END = datetime(2025, 10, 31, 23, 59)
+
+
+def _seed(db_session):
+    sources = ["google", "facebook", None]
+    db_session.add_all([
+        Lead(
+            id=i + 1,
+            name=f"Lead {i}",
+            phone="",
+            utm_source=sources[i % 3],
+            status="new" if i % 2 else "qualified",
+            created_at=datetime(2025, 9 + i % 2 * 1, 20 + i % 10, 12)
+        )
+        for i in range(30)
+    ])
+    db_session.add_all([
+        Deal(id=i + 1, lead_id=i * 2 + 2, amocrm_deal_id=i + 1, amount=1000.0 * (i + 1),
+             status="completed" if i % 3 else "new", created_at=datetime(2025, 10, 5 + i))
+        for i in range(10)
+    ])
+    db_session.commit()
+
+
+def test_fact_table_upsert_keeps_rows_ordered_by_id():
+    table = FactTable({"value": "int64"}, capacity=2)
+
+    table.upsert({"id": np.array([1, 3, 5]), "value": np.array([10, 30, 50])})
+    table.upsert({"id": np.array([5, 7, 3, 7]), "value": np.array([51, 70, 31, 71])})
+    table.upsert({"id": np.array([2]), "value": np.array([20])})
+
+    assert table.column("id").tolist() == [1, 2, 3, 5, 7]
+    assert table.column("value").tolist() == [10, 20, 31, 51, 71]
+
+
+def test_engine_matches_database_calculations(db_session):
+    _seed(db_session)
+    engine = AnalyticsEngine(batch_size=7)
+    engine.refresh(db_session)
+
+    in_memory = AnalyticsCalculator(db_session, engine=engine)
+    database = AnalyticsCalculator(db_session, engine=AnalyticsEngine())
+
+    for utm_source in (None, "google", "unknown"):
+        cpl = in_memory.calculate_cpl(START, END, utm_source)
+        assert cpl == database.calculate_cpl(START, END, utm_source)
+        roi = in_memory.calculate_roi(START, END, utm_source)
+        assert roi == database.calculate_roi(START, END, utm_source)
+    assert in_memory.calculate_conversion_rate(START, END) == database.calculate_conversion_rate(START, END)
+    assert in_memory.calculate_cpl(START, END)["leads_count"] == 15
+    assert engine.leads_by("status", START, END) == {"new": 15}
+    assert engine.deal_totals(START, END, status="completed") == (6, 33000.0)
+    assert {row["source"]: row["leads_count"] for row in engine.source_statistics(START, END)} == {
+        "google": 5, "facebook": 5
+    }
+
+
+def test_engine_and_rollup_use_whole_days(db_session):
+    _seed(db_session)
+    engine = AnalyticsEngine()
+    engine.refresh(db_session)
+
+    in_memory = AnalyticsCalculator(db_session, engine=engine)
+    database = AnalyticsCalculator(db_session, engine=AnalyticsEngine())
+    # Границы внутри дня: лиды 25.10 12:00 и сделка 13.10 00:00 попадают в период
+    start, end = datetime(2025, 10, 13, 18), datetime(2025, 10, 25, 6)
+
+    cr = in_memory.calculate_conversion_rate(start, end)
+    assert cr == database.calculate_conversion_rate(start, end)
+    assert (cr["total_leads"], cr["completed_deals"]) == (9, 1)
+    assert in_memory.calculate_cpl(start, end) == database.calculate_cpl(start, end)
+    assert in_memory.calculate_roi(start, end) == database.calculate_roi(start, end)
+    assert in_memory.calculate_roi(start, end)["total_revenue"] == 9000.0
+
+
+def test_incremental_refresh_loads_only_changes(db_session):
+    _seed(db_session)
+    engine = AnalyticsEngine()
+    assert engine.refresh(db_session) == 40
+
+    lead = db_session.get(Lead, 2)
+    lead.utm_source = "yandex"
+    db_session.add(Lead(id=100, name="New", phone="", utm_source="yandex", created_at=datetime(2025, 10, 15)))
+    db_session.commit()
+
+    loaded = engine.refresh(db_session)
+
+    assert loaded < 40
+    assert engine.count_leads(START, END, utm_source="yandex") == 2
+    assert engine.count_leads(START, END) == 16
@@ -0,0 +1,116 @@
+"""
+Unit тесты для асинхронного доступа к БД
+"""
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.core.db import Base, get_async_db, get_async_url
+from app.models.lead import Lead
+
+
+def test_async_url_uses_async_drivers():
+    assert get_async_url("postgresql://u:p@db:5432/apex") == "postgresql+asyncpg://u:p@db:5432/apex"
+    assert get_async_url("postgresql+psycopg2://u:p@db/apex") == "postgresql+asyncpg://u:p@db/apex"
+    assert get_async_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert get_async_url("postgresql+asyncpg://db/apex") == "postgresql+asyncpg://db/apex"
+
+
+@pytest.mark.asyncio
+async def test_leads_router_uses_async_session(tmp_path):
+    from app.main import app
+
+    engine = create_async_engine(get_async_url(f"sqlite:///{tmp_path / 'async.db'}"))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with session_factory() as db:
+        db.add_all([Lead(name=f"Lead {i}", phone="", status="new" if i % 2 else "contacted") for i in range(6)])
+        await db.commit()
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            response = await client.get("/api/leads/", params={"status": "new"})
+            single = await client.get(f"/api/leads/{response.json()[0]['id']}")
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+        await engine.dispose()
+
+    assert response.status_code == 200
+    assert {lead["status"] for lead in response.json()} == {"new"}
+    assert len(response.json()) == 3
+    assert single.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_analytics_runs_off_event_loop_thread(db_session, monkeypatch):
+    import threading
+
+    from app.analytics.metrics import AnalyticsCalculator
+    from app.core.db import get_db
+    from app.main import app
+
+    threads = []
+
+    def calculate_cpl(self, start_date=None, end_date=None, utm_source=None):
+        threads.append(threading.get_ident())
+        return {"value": 0}
+
+    monkeypatch.setattr(AnalyticsCalculator, "calculate_cpl", calculate_cpl)
+    app.dependency_overrides[get_db] = lambda: db_session
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            response = await client.get("/api/analytics/cpl")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.json() == {"value": 0}
+    assert threads and threads[0] != threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_webhook_runs_off_event_loop_thread(db_session, monkeypatch):
+    import json
+    import threading
+
+    from app.core.config import settings
+    from app.core.db import get_db
+    from app.integrations.amo.replay import WEBHOOK_PATH, _sign, rate_limit_disabled
+    from app.main import app
+    from app.services.webhook_service import WebhookService
+
+    threads = []
+
+    def process_payload(self, body, source=None):
+        threads.append(threading.get_ident())
+        return {"processed": 1, "errors": [], "committed": True, "duplicates": 0, "rows_affected": 0}
+
+    monkeypatch.setattr(WebhookService, "process_payload", process_payload)
+    monkeypatch.setattr(settings, "amocrm_webhook_secret", "secret")
+    monkeypatch.setattr(settings, "webhook_async_mode", False)
+    monkeypatch.setattr(settings, "webhook_lanes", 0)
+    content = json.dumps({"leads": {"update": [{"id": 1, "status_id": 2}]}}).encode()
+
+    app.dependency_overrides[get_db] = lambda: db_session
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            with rate_limit_disabled():
+                response = await client.post(WEBHOOK_PATH, content=content, headers={
+                    "content-type": "application/json", "X-Webhook-Signature": _sign(content)
+                })
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == 200
+    assert response.json()["events_processed"] == 1
+    assert threads and threads[0] != threading.get_ident()
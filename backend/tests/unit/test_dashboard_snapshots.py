@@ -0,0 +1,126 @@
+"""
+Unit тесты для снимков дашборда (stale-while-revalidate)
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.analytics.snapshots import DashboardSnapshotService
+from app.core.cache import result_cache
+from app.models.lead import Lead
+
+
+class FakeSnapshots(DashboardSnapshotService):
+    """Расчет без БД: очередной номер версии или ошибка"""
+
+    def __init__(self, **kwargs):
+        super().__init__(periods=("7d", "30d"), refresh_interval=300, **kwargs)
+        self.calls = []
+        self.fail = False
+
+    def compute(self, period, user_id=None):
+        if self.fail:
+            raise RuntimeError("database is unavailable")
+        self.calls.append((period, user_id))
+        return {"period": period, "user_id": user_id, "version": len(self.calls)}
+
+
+def _expire(service, key):
+    service._snapshots[key].computed_at -= service.refresh_interval + 1
+
+
+@pytest.mark.asyncio
+async def test_fresh_snapshot_is_served_without_recompute():
+    service = FakeSnapshots()
+
+    first = await service.get("7d")
+    second = await service.get("7d")
+
+    assert first is second
+    assert service.calls == [("7d", None)]
+    assert service.headers(second) == {"Age": "0"}
+
+
+@pytest.mark.asyncio
+async def test_stale_snapshot_is_served_and_refreshed_in_background():
+    service = FakeSnapshots()
+    await service.get("7d")
+    _expire(service, ("7d", None))
+
+    stale = await service.get("7d")
+    assert stale.data["version"] == 1
+    assert service.headers(stale)["X-Snapshot-Stale"] == "true"
+
+    await service._refreshing[("7d", None)]
+    fresh = await service.get("7d")
+    assert fresh.data["version"] == 2
+    assert service.stats()["stale_served"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_keeps_last_good_snapshot():
+    service = FakeSnapshots()
+    await service.get("7d")
+    _expire(service, ("7d", None))
+    service.fail = True
+
+    await service.get("7d")
+    with pytest.raises(RuntimeError):
+        await service._refreshing[("7d", None)]
+
+    degraded = await service.get("7d")
+    assert degraded.data["version"] == 1
+    headers = service.headers(degraded)
+    assert headers["X-Snapshot-Degraded"] == "true"
+    assert int(headers["Age"]) >= 300
+    assert service.stats()["failures"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_missing_snapshot_error_is_raised():
+    service = FakeSnapshots()
+    service.fail = True
+    with pytest.raises(RuntimeError):
+        await service.get("30d")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_requests_compute_once():
+    service = FakeSnapshots()
+    results = await asyncio.gather(*(service.get("30d", user_id=7) for _ in range(5)))
+    assert {id(snapshot) for snapshot in results} == {id(results[0])}
+    assert service.calls == [("30d", 7)]
+
+
+@pytest.mark.asyncio
+async def test_background_pass_refreshes_periods_and_evicts_idle_users():
+    service = FakeSnapshots(user_ttl=60)
+    await service.get("7d", user_id=1)
+    service._snapshots[("7d", 1)].requested_at -= 120
+
+    await service.refresh_stale()
+
+    assert set(service._snapshots) == {("7d", None), ("30d", None)}
+
+
+@pytest.mark.asyncio
+async def test_run_builds_dashboards_from_database(db_engine, db_session):
+    result_cache.clear()
+    db_session.add(Lead(name="Lead", phone="1", utm_source="google"))
+    db_session.commit()
+
+    service = DashboardSnapshotService(periods=("7d",), refresh_interval=300)
+    stop = asyncio.Event()
+    task = asyncio.create_task(service.run(sessionmaker(bind=db_engine), stop))
+    for _ in range(500):
+        if ("7d", None) in service._snapshots:
+            break
+        await asyncio.sleep(0.01)
+    stop.set()
+    await task
+
+    data = service._snapshots[("7d", None)].data
+    assert data["period"] == "7d"
+    assert [lead["name"] for lead in data["recent_leads"]] == ["Lead"]
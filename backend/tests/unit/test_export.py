@@ -0,0 +1,100 @@
+"""
+Unit тесты для потоковой выгрузки (CSV, NDJSON, Parquet)
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.models.deal import Deal
+from app.models.lead import Lead
+from app.models.notification import Notification
+from app.schemas.leads import LeadFilter
+from app.services.export_service import ExportService, parquet_available
+
+
+def _seed(db_session):
+    db_session.add_all([
+        Lead(id=i, name=f"Lead {i}", phone=str(i), status="new" if i % 2 else "qualified",
+             source="landing", assigned_to=i % 3, created_at=datetime(2025, 10, i))
+        for i in range(1, 8)
+    ])
+    db_session.add_all([
+        Deal(id=i, lead_id=i, amocrm_deal_id=100 + i, amount=1000.0 * i, status="completed",
+             created_at=datetime(2025, 10, 10))
+        for i in range(1, 5)
+    ])
+    db_session.add_all([
+        Notification(id=i, user_id=i % 2, type="email", recipient="a@example.com", message="Текст, с запятой",
+                     created_at=datetime(2025, 10, i))
+        for i in range(1, 4)
+    ])
+    db_session.commit()
+
+
+def _export(db_engine, dataset, fmt, filters=None, batch_size=3):
+    service = ExportService(sessionmaker(bind=db_engine), batch_size=batch_size)
+    return list(service.stream(dataset, fmt, filters))
+
+
+def test_csv_is_streamed_in_batches_with_one_statement(db_engine, db_session, statements):
+    _seed(db_session)
+
+    statements.clear()
+    chunks = _export(db_engine, "leads", "csv")
+    assert len(statements) == 1
+
+    # Пачки по 3 строки: заголовок уходит с первой
+    assert len(chunks) == 3
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+    assert [row["id"] for row in rows] == [str(i) for i in range(1, 8)]
+    assert rows[0]["created_at"] == "2025-10-01T00:00:00"
+    assert rows[0]["email"] == ""
+
+
+def test_lead_filters_apply_to_leads_and_deals(db_engine, db_session):
+    _seed(db_session)
+    filters = LeadFilter(status="new", created_after=datetime(2025, 10, 2))
+
+    leads = [json.loads(line) for line in b"".join(_export(db_engine, "leads", "ndjson", filters)).splitlines()]
+    assert [lead["id"] for lead in leads] == [3, 5, 7]
+
+    deals = [json.loads(line) for line in b"".join(_export(db_engine, "deals", "ndjson", filters)).splitlines()]
+    assert [(deal["lead_id"], deal["amount"]) for deal in deals] == [(3, 3000.0)]
+
+    notifications = b"".join(_export(db_engine, "notifications", "csv", LeadFilter(assigned_to=1)))
+    rows = list(csv.DictReader(io.StringIO(notifications.decode("utf-8"))))
+    assert [(row["id"], row["message"]) for row in rows] == [("1", "Текст, с запятой"), ("3", "Текст, с запятой")]
+
+
+def test_empty_export_and_invalid_parameters(db_engine):
+    assert b"".join(_export(db_engine, "deals", "csv")).decode("utf-8").startswith("id,lead_id,")
+    assert _export(db_engine, "deals", "ndjson") == []
+
+    service = ExportService(sessionmaker(bind=db_engine))
+    with pytest.raises(ValueError):
+        service.stream("users", "csv")
+    with pytest.raises(ValueError):
+        service.stream("leads", "xlsx")
+    with pytest.raises(ValueError):
+        service.stream("notifications", "csv", LeadFilter(status="new"))
+
+
+def test_parquet_row_groups(db_engine, db_session):
+    if not parquet_available():
+        with pytest.raises(ValueError):
+            ExportService(sessionmaker(bind=db_engine)).stream("leads", "parquet")
+        return
+
+    import pyarrow.parquet as pq
+
+    _seed(db_session)
+    data = b"".join(_export(db_engine, "leads", "parquet"))
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_rows == 7
+    assert parquet.metadata.num_row_groups == 3
+    assert parquet.read().column("id").to_pylist() == list(range(1, 8))
@@ -0,0 +1,132 @@
+"""
+Unit тесты для маппинга кастомных полей amoCRM
+"""
+
+import json
+
+from sqlalchemy import create_engine, text
+
+from app.core.config import settings
+from app.integrations.amo.field_mapping import (
+    CompiledFieldMapping, DEFAULT_FIELD_MAPPING, FieldMappingRegistry, _load_from_admin
+)
+from app.models.lead import Lead
+from app.services.webhook_service import WebhookService
+
+
+def _field(field_id, value):
+    return {"field_id": field_id, "values": [{"value": value}]}
+
+
+class TestFieldMapping:
+    """Тесты для CompiledFieldMapping и FieldMappingRegistry"""
+
+    def test_extract_single_pass(self):
+        fields = CompiledFieldMapping({"utm_source": 10, "phone": "20", "unknown": 30})
+
+        values = fields.extract({"custom_fields_values": [
+            _field(10, "google"), _field(20, "+7999"), _field(30, "x"), {"field_id": 10, "values": []}
+        ]})
+
+        assert values == {"utm_source": "google", "phone": "+7999"}
+        assert set(fields.setters) == {10, 20}
+
+    def test_registry_compiles_once_per_account(self):
+        calls = []
+
+        def loader(account_id):
+            calls.append(account_id)
+            return {"email": 555} if account_id == "acc-2" else None
+
+        registry = FieldMappingRegistry(loaders=[loader])
+
+        assert registry.get("acc-1") is registry.get("acc-1")
+        assert registry.get("acc-1").mapping == DEFAULT_FIELD_MAPPING
+        assert registry.get("acc-2").mapping["email"] == 555
+        assert calls == ["acc-1", "acc-2"]
+
+    def test_failed_loader_is_not_cached_and_entries_expire(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("app.integrations.amo.field_mapping.time.monotonic", lambda: now[0])
+        admin = {"down": True, "mapping": {"phone": 1}}
+
+        def admin_loader(account_id):
+            if admin["down"]:
+                raise ConnectionError("admin db is unreachable")
+            return admin["mapping"]
+
+        registry = FieldMappingRegistry(loaders=[admin_loader], ttl=60, retry_interval=10)
+
+        assert registry.get("acc").mapping == DEFAULT_FIELD_MAPPING
+        admin["down"] = False
+        # Повтор загрузки - не раньше retry_interval
+        assert registry.get("acc").mapping == DEFAULT_FIELD_MAPPING
+        now[0] += 11
+        assert registry.get("acc").mapping["phone"] == 1
+
+        # Изменение в админке применяется после ttl
+        admin["mapping"] = {"phone": 2}
+        assert registry.get("acc").mapping["phone"] == 1
+        now[0] += 61
+        assert registry.get("acc").mapping["phone"] == 2
+
+    def test_failed_reload_keeps_last_mapping_until_retry(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("app.integrations.amo.field_mapping.time.monotonic", lambda: now[0])
+        calls = []
+
+        def admin_loader(account_id):
+            calls.append(now[0])
+            if len(calls) > 1:
+                raise ConnectionError("admin db is unreachable")
+            return {"phone": 1}
+
+        registry = FieldMappingRegistry(loaders=[admin_loader], ttl=60, retry_interval=10)
+        assert registry.get("acc").mapping["phone"] == 1
+
+        # БД админки недоступна: последний маппинг, без попытки подключения на каждый вызов
+        now[0] += 61
+        for _ in range(3):
+            assert registry.get("acc").mapping["phone"] == 1
+        assert len(calls) == 2
+        now[0] += 11
+        assert registry.get("acc").mapping["phone"] == 1
+        assert len(calls) == 3
+
+    def test_admin_loader(self, tmp_path, monkeypatch):
+        url = f"sqlite:///{tmp_path / 'admin.db'}"
+        engine = create_engine(url)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE integrations_apiintegration (integration_type TEXT, status TEXT, config TEXT)"
+            ))
+            conn.execute(text("INSERT INTO integrations_apiintegration VALUES ('amocrm', 'active', :config)"),
+                         {"config": json.dumps({"account_id": 7, "field_mapping": {"phone": 1}})})
+            conn.execute(text("INSERT INTO integrations_apiintegration VALUES ('amocrm', 'inactive', :config)"),
+                         {"config": json.dumps({"account_id": 8, "field_mapping": {"phone": 2}})})
+        engine.dispose()
+        monkeypatch.setattr(settings, "admin_db_url", url)
+
+        assert _load_from_admin(7) == {"phone": 1}
+        assert _load_from_admin(8) is None
+
+    def test_webhook_uses_account_mapping(self, db_session):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, amocrm_contact_id=50, status="new"))
+        db_session.commit()
+
+        registry = FieldMappingRegistry(loaders=[])
+        registry.register("acc", {"phone": 900, "utm_source": 901})
+
+        body = {
+            "account": {"id": "acc"},
+            "leads": {"update": [{"id": 1, "custom_fields_values": [_field(901, "vk")]}]},
+            "contacts": {"update": [{"id": 50, "custom_fields_values": [
+                _field(900, "+7000"), _field(DEFAULT_FIELD_MAPPING["email"], "a@b.c")
+            ]}]}
+        }
+        WebhookService(db_session, deduplicator=None, field_mappings=registry).process_payload(body)
+
+        lead = db_session.query(Lead).one()
+        assert lead.utm_source == "vk"
+        assert lead.phone == "+7000"
+        assert lead.email == "a@b.c"
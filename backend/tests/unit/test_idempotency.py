@@ -0,0 +1,114 @@
+"""
+Unit тесты для кэша Idempotency-Key
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.core.idempotency import IdempotencyStore, decode_response, encode_response
+from app.core.middleware import IdempotencyMiddleware
+
+
+def _build_app(store, delay=0.0):
+    api_app = FastAPI()
+    calls = []
+
+    @api_app.post("/api/leads/")
+    async def create_lead():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return {"id": len(calls)}
+
+    @api_app.post("/api/export")
+    async def export():
+        calls.append(1)
+
+        async def rows():
+            for row in range(3):
+                yield f"row-{row}\n".encode()
+
+        return StreamingResponse(rows(), media_type="text/plain")
+
+    @api_app.post("/api/fail")
+    async def fail():
+        calls.append(1)
+        raise RuntimeError("amoCRM is down")
+
+    @api_app.post("/api/limited/{status_code}")
+    async def limited(status_code: int):
+        calls.append(1)
+        return JSONResponse(status_code=status_code if len(calls) == 1 else 200, content={"calls": len(calls)})
+
+    api_app.add_middleware(IdempotencyMiddleware, store=store)
+    return api_app, calls
+
+
+def _client(api_app):
+    transport = httpx.ASGITransport(app=api_app, raise_app_exceptions=False)
+    return httpx.AsyncClient(transport=transport, base_url="http://localhost")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_execute_once():
+    store = IdempotencyStore(max_entries=100, ttl=60, use_redis=False)
+    api_app, calls = _build_app(store, delay=0.05)
+    headers = {"Idempotency-Key": "lead-form-1"}
+
+    async with _client(api_app) as client:
+        responses = await asyncio.gather(*[client.post("/api/leads/", headers=headers) for _ in range(5)])
+
+    assert len(calls) == 1
+    assert [response.json() for response in responses] == [{"id": 1}] * 5
+    assert sum(response.headers.get("idempotent-replayed") == "true" for response in responses) == 4
+    assert store.stats()["coalesced"] == 4
+    assert store.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_streamed_body_is_cached_and_errors_are_not():
+    store = IdempotencyStore(max_entries=100, ttl=60, use_redis=False)
+    api_app, calls = _build_app(store)
+
+    async with _client(api_app) as client:
+        first = await client.post("/api/export", headers={"Idempotency-Key": "export"})
+        second = await client.post("/api/export", headers={"Idempotency-Key": "export"})
+        await client.post("/api/fail", headers={"Idempotency-Key": "fail"})
+        failed = await client.post("/api/fail", headers={"Idempotency-Key": "fail"})
+
+    assert first.text == second.text == "row-0\nrow-1\nrow-2\n"
+    assert failed.status_code == 500
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status_code", [401, 403, 429])
+async def test_rate_limit_and_auth_errors_are_not_cached(status_code):
+    store = IdempotencyStore(max_entries=100, ttl=60, use_redis=False)
+    api_app, calls = _build_app(store)
+    headers = {"Idempotency-Key": "retry-later"}
+
+    async with _client(api_app) as client:
+        first = await client.post(f"/api/limited/{status_code}", headers=headers)
+        retry = await client.post(f"/api/limited/{status_code}", headers=headers)
+
+    assert first.status_code == status_code
+    assert retry.status_code == 200
+    assert "idempotent-replayed" not in retry.headers
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_store_is_bounded_and_serializable():
+    store = IdempotencyStore(max_entries=2, ttl=60, use_redis=False)
+    response = {"status_code": 201, "headers": [(b"content-type", b"application/json")], "content": b'{"id": 1}'}
+
+    for key in ("a", "b", "c"):
+        await store.set(key, response)
+
+    assert len(store.local) == 2
+    assert await store.get("a") is None
+    assert decode_response(encode_response(response)) == response
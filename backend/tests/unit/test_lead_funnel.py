@@ -0,0 +1,134 @@
+"""
+Unit тесты для журнала статусов лидов и воронки
+"""
+
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.analytics.funnel import FunnelAnalytics
+from app.core.cache import result_cache
+from app.core.db import Base, get_async_db, get_async_url
+from app.models.lead import Lead
+from app.models.lead_status_history import LeadStatusHistory
+from app.services.analytics_service import AnalyticsService
+from app.schemas.leads import LeadUpdate
+from app.services.lead_service import LeadService
+from app.services.webhook_service import WebhookService
+
+CREATED = datetime(2025, 10, 1, 9, 0)
+START = datetime(2025, 10, 1)
+END = datetime(2025, 10, 31)
+
+
+def _history(db_session, lead_id, *changes):
+    """Смены статуса: (from, to, часы от создания лида)"""
+    db_session.add_all([
+        LeadStatusHistory(lead_id=lead_id, from_status=from_status, to_status=to_status,
+                          changed_at=CREATED + timedelta(hours=hours), source="api")
+        for from_status, to_status, hours in changes
+    ])
+
+
+def _seed(db_session):
+    db_session.add_all([
+        Lead(id=i, name=f"Lead {i}", phone=str(i), status=status, created_at=CREATED)
+        for i, status in ((1, "closed_won"), (2, "qualified"), (3, "contacted"), (4, "new"))
+    ])
+    _history(db_session, 1, ("new", "contacted", 2), ("contacted", "qualified", 10), ("qualified", "closed_won", 40))
+    _history(db_session, 2, ("new", "contacted", 4), ("contacted", "qualified", 6))
+    _history(db_session, 3, ("new", "contacted", 6))
+    db_session.commit()
+
+
+def test_status_changes_are_journaled(db_session):
+    db_session.add(Lead(id=1, name="Lead", phone="1", amocrm_lead_id=10, status="new"))
+    db_session.commit()
+
+    LeadService(db_session).change_lead_status(1, "contacted")
+    LeadService(db_session).change_lead_status(1, "contacted")
+    LeadService(db_session).update_lead(1, LeadUpdate(status="qualified"))
+    LeadService(db_session).change_lead_status(1, "contacted")
+    WebhookService(db_session, coalescer=None).process_payload(
+        {"leads": {"update": [{"id": 10, "status_id": 3, "updated_at": 1760000000}]}}
+    )
+
+    history = db_session.query(LeadStatusHistory).order_by(LeadStatusHistory.id).all()
+    assert [(h.from_status, h.to_status, h.source) for h in history] == [
+        ("new", "contacted", "api"),
+        ("contacted", "qualified", "api"),
+        ("qualified", "contacted", "api"),
+        ("contacted", "presentation", "amocrm"),
+    ]
+    assert history[-1].changed_at == datetime.utcfromtimestamp(1760000000)
+
+
+@pytest.mark.asyncio
+async def test_status_route_journals_change(tmp_path):
+    from app.main import app
+
+    engine = create_async_engine(get_async_url(f"sqlite:///{tmp_path / 'status.db'}"))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add(Lead(id=1, name="Lead", phone="1", status="new"))
+        await db.commit()
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            response = await client.put("/api/leads/1/status", params={"status": "contacted"})
+        async with session_factory() as db:
+            history = (await db.execute(select(LeadStatusHistory))).scalars().all()
+    finally:
+        app.dependency_overrides.pop(get_async_db, None)
+        await engine.dispose()
+
+    assert response.status_code == 200
+    assert [(h.from_status, h.to_status, h.source) for h in history] == [("new", "contacted", "api")]
+
+
+def test_funnel_conversion_time_in_stage_and_latency(db_session):
+    _seed(db_session)
+
+    funnel = FunnelAnalytics(db_session).compute(FunnelAnalytics(db_session).load(START, END))
+
+    assert funnel["cohort_size"] == 4
+    assert [(stage["stage"], stage["reached"]) for stage in funnel["stages"]] == [
+        ("new", 4), ("contacted", 3), ("qualified", 2), ("proposal", 1), ("negotiation", 1), ("closed_won", 1)
+    ]
+    assert funnel["stages"][0]["conversion_to_next"] == 75.0
+    assert funnel["stages"][-1]["conversion_to_next"] is None
+
+    # В "new": 2, 4 и 6 часов; в "contacted": 8 и 2 часа
+    assert funnel["time_in_stage"]["new"]["count"] == 3
+    assert funnel["time_in_stage"]["new"]["p50_hours"] == 4
+    assert funnel["time_in_stage"]["contacted"]["avg_hours"] == 5
+    assert funnel["first_response"]["avg_hours"] == 4
+    # Первый вход в qualified: 10 и 6 часов
+    assert funnel["time_to_convert"]["count"] == 2
+    assert funnel["time_to_convert"]["avg_hours"] == 8
+
+
+def test_dashboard_uses_funnel_metrics(db_session, monkeypatch):
+    result_cache.clear()
+    _seed(db_session)
+    monkeypatch.setattr(FunnelAnalytics, "default_window", lambda self: (START, END))
+
+    dashboard = AnalyticsService(db_session).get_dashboard_data()
+
+    assert dashboard.lead_metrics.avg_conversion_time == 8
+    assert dashboard.performance_metrics.response_time_avg == 4
+    assert dashboard.performance_metrics.response_time_median == 4
+
+    chart = AnalyticsService(db_session).get_chart_data("conversion_funnel")
+    assert chart.datasets[0]["data"] == [4, 3, 2, 1, 1, 1]
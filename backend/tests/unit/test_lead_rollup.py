@@ -0,0 +1,88 @@
+"""
+Unit тесты для дневного агрегата лидов
+"""
+
+from datetime import datetime
+
+from app.analytics.metrics import AnalyticsCalculator
+from app.analytics.rollup import count_leads, rebuild_lead_rollup
+from app.models.lead import Lead
+from app.models.lead_daily_rollup import LeadDailyRollup
+from app.services.lead_service import LeadService
+from app.services.webhook_service import WebhookService
+
+
+def _rollup(db_session):
+    rows = db_session.query(LeadDailyRollup).filter(LeadDailyRollup.leads_count != 0).all()
+    return sorted(
+        (str(row.day), row.source, row.utm_source, row.status, row.leads_count, row.revenue)
+        for row in rows
+    )
+
+
+def test_rollup_follows_lead_writes(db_session):
+    db_session.add_all([
+        Lead(name="A", phone="", utm_source="google", revenue=100.0, created_at=datetime(2025, 10, 1, 10)),
+        Lead(name="B", phone="", utm_source="google", created_at=datetime(2025, 10, 1, 12)),
+        Lead(name="C", phone="", amocrm_lead_id=7, created_at=datetime(2025, 10, 2, 9)),
+    ])
+    db_session.commit()
+
+    # Смена статуса через сервис и через webhook, новый лид из webhook
+    lead = db_session.query(Lead).filter(Lead.name == "A").one()
+    LeadService(db_session).change_lead_status(lead.id, "qualified")
+    WebhookService(db_session, deduplicator=None, coalescer=None).process_payload({
+        "leads": {
+            "update": [{"id": 7, "status_id": 2}],
+            "add": [{"id": 8, "name": "D", "status_id": 1, "created_at": 1759449600}],
+        }
+    })
+    db_session.delete(db_session.query(Lead).filter(Lead.name == "B").one())
+    db_session.commit()
+
+    assert _rollup(db_session) == [
+        ("2025-10-01", "landing", "google", "qualified", 1, 100.0),
+        ("2025-10-02", "landing", "", "contacted", 1, 0.0),
+        ("2025-10-03", "amocrm_webhook", "", "new", 1, 0.0),
+    ]
+
+    incremental = _rollup(db_session)
+    rebuild_lead_rollup(db_session)
+    db_session.commit()
+    assert _rollup(db_session) == incremental
+
+
+def test_rebuild_repairs_bulk_updates(db_session):
+    db_session.add_all([
+        Lead(name=f"Lead {i}", phone="", utm_source="google", created_at=datetime(2025, 10, i + 1))
+        for i in range(3)
+    ])
+    db_session.commit()
+
+    # Массовое обновление в обход ORM агрегат не видит
+    db_session.query(Lead).update({Lead.utm_source: "yandex"})
+    db_session.commit()
+    assert count_leads(db_session, datetime(2025, 10, 1), datetime(2025, 10, 3), utm_source="yandex") == 0
+
+    rebuild_lead_rollup(db_session, datetime(2025, 10, 2), datetime(2025, 10, 3))
+    db_session.commit()
+
+    assert count_leads(db_session, datetime(2025, 10, 1), datetime(2025, 10, 3), utm_source="yandex") == 2
+    assert count_leads(db_session, datetime(2025, 10, 1), datetime(2025, 10, 3), utm_source="google") == 1
+
+
+def test_cpl_reads_leads_from_rollup(db_session):
+    db_session.add_all([
+        Lead(name=f"Lead {i}", phone="", utm_source="google" if i % 2 else "facebook",
+             created_at=datetime(2025, 10, 1 + i % 5, 15))
+        for i in range(10)
+    ])
+    db_session.commit()
+
+    calculator = AnalyticsCalculator(db_session)
+    cpl = calculator.calculate_cpl(datetime(2025, 10, 2), datetime(2025, 10, 3), utm_source="google")
+    cr = calculator.calculate_conversion_rate(datetime(2025, 10, 1), datetime(2025, 10, 5))
+
+    assert cpl["leads_count"] == 2
+    assert set(cpl["breakdown"]) == {"google", "facebook"}
+    assert cr["total_leads"] == 10
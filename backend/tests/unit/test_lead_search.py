@@ -0,0 +1,56 @@
+"""
+Unit тесты для полнотекстового поиска лидов
+"""
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.lead import Lead
+from app.schemas.leads import LeadFilter
+from app.services.lead_search import LeadSearch
+from app.services.lead_service import LeadService
+
+
+def _seed(db_session):
+    db_session.add_all([
+        Lead(name="Ivan Petrov", phone="79991234567", email="ivan@example.com", status="new"),
+        Lead(name="Ivan Ivanov", phone="79990000000", email="ivanov@ivan.ru", status="contacted"),
+        Lead(name="Anna Smirnova", phone="79161112233", email="anna@example.com", status="new"),
+    ])
+    db_session.commit()
+
+
+def test_sqlite_fts_search_is_ranked_and_prefix_based(db_session):
+    _seed(db_session)
+    service = LeadService(db_session)
+
+    results = service.search_leads("ivan")
+    assert [lead.name for lead in results] == ["Ivan Ivanov", "Ivan Petrov"]
+    assert [lead.name for lead in service.search_leads("7916")] == ["Anna Smirnova"]
+    assert [lead.name for lead in service.search_leads("examp")] == ["Anna Smirnova", "Ivan Petrov"]
+    assert service.search_leads("nobody") == []
+
+
+def test_search_respects_filters_and_updates(db_session):
+    _seed(db_session)
+    service = LeadService(db_session)
+
+    filtered = service.get_leads(filters=LeadFilter(status="new", search="ivan"))
+    assert [lead.name for lead in filtered] == ["Ivan Petrov"]
+
+    # Триггеры FTS5 синхронизируют индекс при изменении лида
+    lead = db_session.query(Lead).filter(Lead.name == "Anna Smirnova").one()
+    lead.name = "Anna Kuznetsova"
+    db_session.commit()
+    assert [lead.name for lead in service.search_leads("kuzne")] == ["Anna Kuznetsova"]
+    assert service.search_leads("smirnova") == []
+
+
+def test_postgres_search_uses_indexed_expressions():
+    search = LeadSearch("postgresql")
+    query = search.apply(select(Lead), "Ivan 7999")
+
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert "to_tsvector('simple'::regconfig, coalesce(leads.name, '')" in sql
+    assert "ts_rank" in sql and "similarity" in sql
+    assert query.compile(dialect=postgresql.dialect()).params["to_tsquery_1"] == "ivan:* & 7999:*"
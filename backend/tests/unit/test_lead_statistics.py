@@ -0,0 +1,37 @@
+"""
+Unit тесты для статистики LeadService
+"""
+
+from app.models.lead import Lead
+from app.services.lead_service import LeadService
+
+
+def _seed(db_session, sources):
+    statuses = ["new", "contacted", "qualified"]
+    db_session.add_all([
+        Lead(name=f"Lead {i}", phone="", status=statuses[i % 3], source=f"source-{i % sources}")
+        for i in range(sources * 3)
+    ])
+    db_session.commit()
+
+
+def test_statistics_values(db_session):
+    _seed(db_session, sources=2)
+
+    statistics = LeadService(db_session).get_lead_statistics()
+
+    assert statistics.total_leads == 6
+    assert (statistics.new_leads, statistics.contacted_leads, statistics.qualified_leads) == (2, 2, 2)
+    assert round(statistics.conversion_rate, 2) == 33.33
+
+
+def test_statistics_query_count_is_constant(db_session, statements):
+    counts = []
+    for sources in (2, 40):
+        db_session.query(Lead).delete()
+        _seed(db_session, sources)
+        statements.clear()
+        LeadService(db_session).get_lead_statistics()
+        counts.append(len(statements))
+
+    assert counts == [1, 1]
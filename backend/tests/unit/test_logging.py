@@ -0,0 +1,85 @@
+"""
+Unit тесты для конвейера логирования
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+
+from app.core.logging import JsonFormatter, LogQueueHandler, RateLimitFilter, SamplingFilter, lazy
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def _logger(name, handler):
+    test_logger = logging.getLogger(name)
+    test_logger.handlers = [handler]
+    test_logger.propagate = False
+    test_logger.setLevel(logging.DEBUG)
+    return test_logger
+
+
+def test_queue_pipeline_formats_json_in_listener_thread():
+    log_queue = queue.Queue(maxsize=100)
+    sink = _ListHandler()
+    sink.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, sink)
+    listener.start()
+
+    body = {"leads": {"add": [{"id": 1}]}}
+    test_logger = _logger("test.queue", LogQueueHandler(log_queue))
+    test_logger.info("Received %s", lazy(json.dumps, body), extra={"request_id": "r-1", "size": lazy(len, body)})
+    body["leads"] = {}  # изменения после вызова не попадают в запись
+    listener.stop()
+
+    record = json.loads(sink.lines[0])
+    assert record["message"] == 'Received {"leads": {"add": [{"id": 1}]}}'
+    assert record["request_id"] == "r-1"
+    assert record["size"] == 1
+    assert record["logger"] == "test.queue"
+
+
+def test_lazy_values_are_not_evaluated_for_filtered_records():
+    calls = []
+    test_logger = _logger("test.lazy", _ListHandler())
+    test_logger.setLevel(logging.WARNING)
+
+    test_logger.info("payload %s", lazy(lambda: calls.append(1)))
+
+    assert calls == []
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = LogQueueHandler(queue.Queue(maxsize=1))
+    test_logger = _logger("test.full", handler)
+
+    for index in range(3):
+        test_logger.info("record %s", index)
+
+    assert handler.dropped == 2
+
+
+def test_sampling_and_rate_limit_keep_warnings():
+    sink = _ListHandler()
+    test_logger = _logger("test.hot", sink)
+    test_logger.filters = [SamplingFilter(0.0)]
+
+    test_logger.info("dropped")
+    test_logger.warning("kept")
+    assert len(sink.lines) == 1
+
+    limited = RateLimitFilter(limit=2, window=3600)
+    test_logger.filters = [limited]
+    for _ in range(5):
+        test_logger.info("hot path")
+
+    assert len(sink.lines) == 3
+    assert limited.suppressed == 3
@@ -0,0 +1,65 @@
+"""
+Unit тесты для метрик Prometheus
+"""
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+
+from app.core.metrics import _endpoint_label, instrument_engine
+from app.models.lead import Lead
+from app.services.webhook_service import WebhookService
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_route_histogram_uses_route_template():
+    from app.main import app
+
+    before = _sample("apex_http_request_duration_seconds_count", method="GET", route="/health")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        await client.get("/health")
+        response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "apex_http_requests_in_flight" in response.text
+    assert _sample("apex_http_request_duration_seconds_count", method="GET", route="/health") == before + 1
+    assert _sample("apex_http_responses_total", method="GET", route="/health", status="200") >= 1
+
+
+def test_webhook_events_by_type_and_outcome(db_session):
+    db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+    db_session.commit()
+    processed = _sample("apex_webhook_events_total", event="leads.update", outcome="processed")
+    errors = _sample("apex_webhook_events_total", event="leads.update", outcome="error")
+
+    body = {"leads": {"update": [{"id": 1, "status_id": 2}, {"status_id": 3}]}}
+    WebhookService(db_session, deduplicator=None).process_payload(body)
+
+    assert _sample("apex_webhook_events_total", event="leads.update", outcome="processed") == processed + 1
+    assert _sample("apex_webhook_events_total", event="leads.update", outcome="error") == errors + 1
+
+
+def test_pool_checkout_is_measured(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    instrument_engine(engine, "test")
+    before = _sample("apex_db_pool_checkout_seconds_count", pool="test")
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        assert _sample("apex_db_pool_checked_out", pool="test") == 1
+    engine.dispose()
+
+    assert _sample("apex_db_pool_checkout_seconds_count", pool="test") == before + 1
+
+
+def test_amocrm_endpoint_label():
+    assert _endpoint_label("/api/v4/leads/123") == "/api/v4/leads/{id}"
+    assert _endpoint_label("/api/v4/contacts/55/links") == "/api/v4/contacts/{id}/links"
+    assert _endpoint_label("/api/v4/leads/note_types") == "/api/v4/leads/note_types"
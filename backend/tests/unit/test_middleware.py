@@ -0,0 +1,104 @@
+"""
+Unit тесты для ASGI middleware
+"""
+
+import hashlib
+import hmac
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+from app.core.config import settings
+from app.core.idempotency import IdempotencyStore
+from app.core.middleware import (
+    HostPolicy,
+    IdempotencyMiddleware,
+    LoggingMiddleware,
+    SecurityMiddleware,
+    WebhookSignatureMiddleware,
+)
+
+
+def _build_app(environment="development"):
+    api_app = FastAPI()
+    calls = []
+
+    @api_app.post("/api/items")
+    async def create_item(request: Request):
+        calls.append(request.state.request_id)
+        return {"call": len(calls)}
+
+    @api_app.post("/api/webhooks/test")
+    async def webhook(request: Request):
+        return {"received": json.loads(await request.body())}
+
+    api_app.add_middleware(SecurityMiddleware, allowed_hosts=["api.example.com", "*.apex.asia"], environment=environment)
+    api_app.add_middleware(LoggingMiddleware)
+    api_app.add_middleware(IdempotencyMiddleware, store=IdempotencyStore(max_entries=100, ttl=60, use_redis=False))
+    api_app.add_middleware(WebhookSignatureMiddleware)
+    return api_app, calls
+
+
+def _client(api_app, host="api.example.com"):
+    transport = httpx.ASGITransport(app=api_app)
+    return httpx.AsyncClient(transport=transport, base_url=f"http://{host}")
+
+
+def test_host_policy_matches_exact_hosts_and_subdomains():
+    policy = HostPolicy(["api.example.com", "*.apex.asia"])
+
+    assert policy.is_allowed("api.example.com:8000")
+    assert policy.is_allowed("crm.apex.asia")
+    assert not policy.is_allowed("apex.asia")
+    assert not policy.is_allowed("evilapex.asia")
+    assert HostPolicy(["*"]).is_allowed("anything")
+
+
+@pytest.mark.asyncio
+async def test_security_headers_request_id_and_host_check():
+    api_app, _ = _build_app(environment="production")
+
+    async with _client(api_app) as client:
+        response = await client.post("/api/items")
+    async with _client(api_app, host="evil.com") as client:
+        rejected = await client.post("/api/items")
+
+    assert response.status_code == 200
+    assert response.headers["x-frame-options"] == "DENY"
+    assert response.headers["content-security-policy"] == "default-src 'self'"
+    assert response.headers["x-request-id"]
+    assert rejected.status_code == 403
+    assert rejected.json() == {"detail": "Host not allowed"}
+
+
+@pytest.mark.asyncio
+async def test_idempotency_replays_captured_body():
+    api_app, calls = _build_app()
+    headers = {"Idempotency-Key": "key-1"}
+
+    async with _client(api_app) as client:
+        first = await client.post("/api/items", headers=headers)
+        second = await client.post("/api/items", headers=headers)
+
+    assert first.json() == second.json() == {"call": 1}
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_webhook_signature_and_body_passthrough(monkeypatch):
+    monkeypatch.setattr(settings, "amocrm_webhook_secret", "secret")
+    api_app, _ = _build_app()
+    body = b'{"leads": {"add": [{"id": 1}]}}'
+    signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+
+    async with _client(api_app) as client:
+        accepted = await client.post("/api/webhooks/test", content=body, headers={"X-Webhook-Signature": signature})
+        invalid = await client.post("/api/webhooks/test", content=body, headers={"X-Webhook-Signature": "bad"})
+        missing = await client.post("/api/webhooks/test", content=body)
+
+    assert accepted.json() == {"received": {"leads": {"add": [{"id": 1}]}}}
+    assert invalid.status_code == 401
+    assert invalid.json() == {"detail": "Invalid webhook signature"}
+    assert missing.json() == {"detail": "Missing webhook signature"}
@@ -0,0 +1,88 @@
+"""
+Unit тесты для keyset пагинации лидов
+"""
+
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.core.db import Base, get_async_db, get_async_url
+from app.core.exceptions import ValidationError
+from app.core.pagination import decode_cursor, encode_cursor
+from app.models.lead import Lead
+from app.services.lead_service import LeadService
+
+START = datetime(2025, 10, 1, 12, 0, 0)
+
+
+def _leads(count):
+    # По три лида на одну метку времени - курсор должен различать их по id
+    return [
+        Lead(name=f"Lead {i}", phone="", status="new", created_at=START + timedelta(minutes=i // 3))
+        for i in range(count)
+    ]
+
+
+def test_cursor_round_trip_and_invalid_cursor():
+    cursor = encode_cursor(START, 42)
+
+    assert decode_cursor(cursor) == (START, 42)
+    with pytest.raises(ValidationError):
+        decode_cursor("not-a-cursor")
+
+
+def test_service_pages_cover_all_rows_once(db_session):
+    db_session.add_all(_leads(10))
+    db_session.commit()
+    service = LeadService(db_session)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = service.get_leads_page(limit=3, cursor=cursor)
+        seen.extend((lead.created_at, lead.id) for lead in page.items)
+        pages += 1
+        if not page.has_more:
+            break
+        cursor = page.next_cursor
+
+    assert pages == 4
+    assert page.next_cursor is None
+    assert seen == sorted(seen, reverse=True)
+    assert len(set(seen)) == 10
+    assert [lead.id for lead in service.get_leads(skip=3, limit=3)] == [lead_id for _, lead_id in seen[3:6]]
+
+
+@pytest.mark.asyncio
+async def test_leads_page_endpoint(tmp_path):
+    from app.main import app as api_app
+
+    engine = create_async_engine(get_async_url(f"sqlite:///{tmp_path / 'pages.db'}"))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add_all(_leads(5))
+        await db.commit()
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    api_app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        transport = httpx.ASGITransport(app=api_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            first = (await client.get("/api/leads/page", params={"limit": 3})).json()
+            second = (await client.get("/api/leads/page", params={"limit": 3, "cursor": first["next_cursor"]})).json()
+            invalid = await client.get("/api/leads/page", params={"cursor": "broken"})
+    finally:
+        api_app.dependency_overrides.pop(get_async_db, None)
+        await engine.dispose()
+
+    assert first["has_more"] is True
+    assert second["has_more"] is False
+    assert second["next_cursor"] is None
+    assert len({lead["id"] for lead in first["items"] + second["items"]}) == 5
+    assert invalid.status_code == 400
@@ -0,0 +1,130 @@
+"""
+Unit тесты для rate limiter
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.core.rate_limit import (
+    MemoryBackend,
+    RateLimit,
+    RedisBackend,
+    RouteLimits,
+    SharedMemoryBackend,
+)
+from app.core.security import RateLimiter
+
+
+def test_memory_backend_refills_and_evicts_idle_keys(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.core.rate_limit.time.monotonic", lambda: now[0])
+    backend = MemoryBackend(max_keys=10)
+    limit = RateLimit(2, 10)
+
+    assert backend.acquire("a", limit)
+    assert backend.acquire("a", limit)
+    assert not backend.acquire("a", limit)
+
+    now[0] += 5  # пополнился один токен
+    assert backend.acquire("a", limit)
+    assert not backend.acquire("a", limit)
+
+    # Бакет "a" наполнился и вытесняется при следующем обращении
+    now[0] += 60
+    backend.acquire("b", limit)
+    assert len(backend) == 1
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryBackend(max_keys=100)
+    limit = RateLimit(10, 3600)
+
+    for client in range(1000):
+        backend.acquire(f"client-{client}", limit)
+
+    assert len(backend) == 100
+
+
+def test_shared_backend_state_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "rate-limit")
+    first = SharedMemoryBackend(path, slots=64)
+    second = SharedMemoryBackend(path, slots=64)
+    limit = RateLimit(2, 3600)
+
+    try:
+        assert first.acquire("10.0.0.1", limit)
+        assert second.acquire("10.0.0.1", limit)
+        assert not first.acquire("10.0.0.1", limit)
+        assert second.acquire("10.0.0.2", limit)
+    finally:
+        first.close()
+        second.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_falls_back_to_local_limiter():
+    calls = []
+
+    class BrokenRedis:
+        def register_script(self, script):
+            async def run(keys, args):
+                calls.append(keys)
+                raise ConnectionError("redis is down")
+            return run
+
+    backend = RedisBackend(redis_client=BrokenRedis(), fallback=MemoryBackend(), retry_interval=60)
+    limit = RateLimit(1, 3600)
+
+    assert await backend.acquire("client", limit)
+    assert not await backend.acquire("client", limit)
+    # После ошибки Redis не опрашивается до истечения retry_interval
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_redis_does_not_block_event_loop():
+    class SlowRedis:
+        def register_script(self, script):
+            async def run(keys, args):
+                await asyncio.sleep(0.2)
+                raise TimeoutError("redis timeout")
+            return run
+
+    backend = RedisBackend(redis_client=SlowRedis(), fallback=MemoryBackend(), retry_interval=60)
+    limiter = RateLimiter(backend)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(ticker())
+    try:
+        assert await limiter.is_allowed("client", limit=2, window=3600)
+    finally:
+        task.cancel()
+    assert ticks >= 5
+
+    # Следующие запросы - сразу локальным лимитером
+    started = time.monotonic()
+    assert await limiter.is_allowed("client", limit=2, window=3600)
+    assert not await limiter.is_allowed("client", limit=2, window=3600)
+    assert time.monotonic() - started < 0.1
+
+
+def test_route_limits_resolve_classes():
+    webhooks = RateLimit(600, 60, "webhooks")
+    lead_forms = RateLimit(20, 60, "lead_forms")
+    default = RateLimit(100, 3600)
+    limits = RouteLimits(
+        [(None, "/api/webhooks/", webhooks), ("POST", "/api/leads", lead_forms)],
+        default=default
+    )
+
+    assert limits.resolve("POST", "/api/webhooks/amo") is webhooks
+    assert limits.resolve("POST", "/api/leads/") is lead_forms
+    assert limits.resolve("GET", "/api/leads/") is default
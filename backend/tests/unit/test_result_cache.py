@@ -0,0 +1,146 @@
+"""
+Unit тесты для кэша результатов аналитики
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from app.core.cache import ResultCache, _Flight, _wait_for_flight, cached, make_cache_key, not_error
+from app.models.lead import Lead
+from app.services.analytics_service import AnalyticsService
+
+
+def _cache(**kwargs) -> ResultCache:
+    options = {"max_entries": 100, "ttl": 60, "use_redis": False, "beta": 0.0, "enabled": True}
+    options.update(kwargs)
+    return ResultCache(**options)
+
+
+def test_hit_after_miss_and_stats():
+    cache = _cache()
+    calls = []
+
+    @cached("metric", cache=cache)
+    def compute(period, user_id=None):
+        calls.append((period, user_id))
+        return {"period": period}
+
+    assert compute("7d") == {"period": "7d"}
+    assert compute("7d") == {"period": "7d"}
+    assert compute("7d", user_id=1) == {"period": "7d"}
+    assert calls == [("7d", None), ("7d", 1)]
+
+    stats = cache.stats()["metrics"]["metric"]
+    assert (stats["hits"], stats["misses"], stats["recomputes"]) == (1, 2, 2)
+    assert stats["hit_ratio"] == pytest.approx(1 / 3, abs=1e-3)
+
+
+def test_key_rounds_datetimes_to_time_bucket():
+    first = make_cache_key({"start": datetime(2025, 10, 1, 12, 0, 5)}, time_bucket=60)
+    second = make_cache_key({"start": datetime(2025, 10, 1, 12, 0, 55)}, time_bucket=60)
+    third = make_cache_key({"start": datetime(2025, 10, 1, 12, 1, 5)}, time_bucket=60)
+    assert first == second != third
+
+
+def test_error_results_are_not_cached():
+    cache = _cache()
+    calls = []
+
+    @cached("metric", cache=cache, should_cache=not_error)
+    def compute():
+        calls.append(1)
+        return {"error": "db unavailable"}
+
+    compute()
+    compute()
+    assert len(calls) == 2
+
+
+def test_concurrent_misses_compute_once():
+    cache = _cache()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    def worker(results):
+        barrier.wait()
+        results.append(cache.get_or_compute("metric", "key", compute))
+
+    results = []
+    threads = [threading.Thread(target=worker, args=(results,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [42] * 8
+    assert len(calls) == 1
+    assert cache.stats()["metrics"]["metric"]["coalesced"] == 7
+
+
+def test_early_refresh_recomputes_before_expiry():
+    # Огромный beta: пересчет заранее при каждом обращении
+    cache = _cache(beta=1e9)
+    values = iter([1, 2])
+
+    def compute():
+        time.sleep(0.001)
+        return next(values)
+
+    assert cache.get_or_compute("metric", "key", compute) == 1
+    assert cache.get_or_compute("metric", "key", compute) == 2
+    assert cache.stats()["metrics"]["metric"]["early_refreshes"] == 1
+
+
+def test_tag_invalidation_changes_key():
+    cache = _cache()
+    values = iter([1, 2])
+
+    assert cache.get_or_compute("metric", "key", lambda: next(values), tags=("leads",)) == 1
+    cache.invalidate("deals")
+    assert cache.get_or_compute("metric", "key", lambda: next(values), tags=("leads",)) == 1
+    cache.invalidate("leads")
+    assert cache.get_or_compute("metric", "key", lambda: next(values), tags=("leads",)) == 2
+
+
+def test_committed_lead_write_invalidates_analytics(db_session, statements):
+    db_session.add(Lead(name="First", phone="1", utm_source="google"))
+    db_session.commit()
+
+    def leads_by_source():
+        return AnalyticsService(db_session).get_chart_data("leads_by_source").datasets[0]["data"]
+
+    assert leads_by_source() == [1]
+
+    # Повторный запрос без записей - из кэша, без обращения к БД
+    statements.clear()
+    assert leads_by_source() == [1]
+    assert statements == []
+
+    db_session.add(Lead(name="Second", phone="2", utm_source="google"))
+    db_session.commit()
+    assert leads_by_source() == [2]
+
+
+@pytest.mark.asyncio
+async def test_wait_in_event_loop_thread_does_not_block():
+    flight = _Flight()
+    started = time.perf_counter()
+    assert _wait_for_flight(flight, timeout=5) is False
+    assert time.perf_counter() - started < 1
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_wait_in_worker_thread_receives_flight_result():
+    flight = _Flight()
+    threading.Timer(0.05, flight.done.set).start()
+    assert await asyncio.to_thread(_wait_for_flight, flight, 5) is True
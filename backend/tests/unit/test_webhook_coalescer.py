@@ -0,0 +1,202 @@
+"""
+Unit тесты для схлопывания обновлений лидов из webhook
+"""
+
+from sqlalchemy.orm import sessionmaker
+
+from app.integrations.amo.coalescer import LeadUpdateCoalescer, merge_lead_updates
+from app.integrations.amo.dedup import EventDeduplicator, event_key
+from app.models.lead import Lead
+from app.services.webhook_service import WebhookService
+
+
+def _utm(field_id, value):
+    return {"field_id": field_id, "values": [{"value": value}]}
+
+
+class TestLeadUpdateCoalescer:
+    """Тесты для LeadUpdateCoalescer"""
+
+    def test_latest_values_win(self):
+        events = [
+            {"id": 1, "status_id": 2, "name": "A", "updated_at": 100,
+             "custom_fields_values": [_utm(123458, "google"), _utm(123459, "cpc")]},
+            {"id": 2, "status_id": 1, "updated_at": 100},
+            {"id": 1, "status_id": 4, "updated_at": 300, "custom_fields_values": [_utm(123458, "yandex")]},
+            # Более старое событие, доставленное последним, не перетирает новое
+            {"id": 1, "status_id": 3, "name": "B", "updated_at": 200},
+        ]
+
+        merged = merge_lead_updates(events)
+
+        assert [event["id"] for event in merged] == [1, 2]
+        lead = merged[0]
+        assert lead["status_id"] == 4
+        assert lead["name"] == "B"
+        assert {f["field_id"]: f["values"][0]["value"] for f in lead["custom_fields_values"]} == {
+            123458: "yandex", 123459: "cpc"
+        }
+
+    def test_payload_coalescing_counts_saved_writes(self, db_session):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        coalescer = LeadUpdateCoalescer(window=0)
+        body = {"leads": {"update": [
+            {"id": 1, "status_id": 2, "updated_at": 1},
+            {"id": 1, "status_id": 3, "updated_at": 2},
+            {"id": 1, "status_id": 6, "updated_at": 3},
+        ]}}
+
+        result = WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(body)
+
+        assert result["processed"] == 1
+        assert db_session.query(Lead).one().status == "deal"
+        assert coalescer.stats()["saved_writes"] == 2
+
+    def test_window_buffers_until_flush(self, db_engine, db_session):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.add(Lead(name="B", phone="", amocrm_lead_id=2, status="new"))
+        db_session.commit()
+
+        coalescer = LeadUpdateCoalescer(window=60)
+        for status_id in (2, 3, 5):
+            WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(
+                {"account": {"id": "acc"}, "leads": {"update": [{"id": 1, "status_id": status_id}]}}
+            )
+        # Удаление лида отменяет его отложенные обновления
+        WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(
+            {"account": {"id": "acc"}, "leads": {"update": [{"id": 2, "status_id": 3}]}}
+        )
+        WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(
+            {"account": {"id": "acc"}, "leads": {"delete": [{"id": 2}]}}
+        )
+
+        assert coalescer.drain() == {}
+        assert coalescer.stats()["pending"] == 1
+        assert db_session.query(Lead).filter_by(amocrm_lead_id=1).one().status == "new"
+
+        written = coalescer.flush(sessionmaker(bind=db_engine), force=True)
+
+        db_session.expire_all()
+        assert written == 1
+        assert db_session.query(Lead).filter_by(amocrm_lead_id=1).one().status == "reserved"
+        assert db_session.query(Lead).filter_by(amocrm_lead_id=2).one().status == "deleted"
+        assert coalescer.stats()["saved_writes"] == 3
+
+    def test_window_buffers_only_committed_payloads(self, db_session, monkeypatch):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        coalescer = LeadUpdateCoalescer(window=60)
+
+        def failing_commit():
+            raise RuntimeError("db down")
+
+        monkeypatch.setattr(db_session, "commit", failing_commit)
+        result = WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(
+            {"leads": {"update": [{"id": 1, "status_id": 3}]}}
+        )
+
+        assert result["committed"] is False
+        assert result["buffered"] == 0
+        assert coalescer.stats()["pending"] == 0
+
+    def test_failed_flush_returns_updates_to_buffer(self, db_engine, db_session):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        coalescer = LeadUpdateCoalescer(window=60)
+        WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(
+            {"leads": {"update": [{"id": 1, "status_id": 3, "updated_at": 1}, {"id": 1, "status_id": 4, "updated_at": 2}]}}
+        )
+        assert coalescer.stats()["received"] == 2
+
+        def broken_sessions():
+            raise RuntimeError("db down")
+
+        assert coalescer.flush(broken_sessions, force=True) == 0
+        assert coalescer.stats()["pending"] == 1
+
+        # Более новое обновление, пришедшее после неудачной записи, побеждает
+        WebhookService(db_session, deduplicator=None, coalescer=coalescer).process_payload(
+            {"leads": {"update": [{"id": 1, "status_id": 5, "updated_at": 3}]}}
+        )
+        assert coalescer.flush(sessionmaker(bind=db_engine), force=True) == 1
+
+        db_session.expire_all()
+        assert db_session.query(Lead).one().status == "reserved"
+        stats = coalescer.stats()
+        assert (stats["pending"], stats["failed_flushes"]) == (0, 1)
+        # Запись буфера не учитывается в received повторно
+        assert stats["received"] == 3
+
+    def test_queue_item_is_done_only_after_flush(self, db_engine, db_session, monkeypatch):
+        from app.models.webhook_queue import WebhookQueueItem
+        from app.services.webhook_queue import WebhookQueueProcessor, enqueue_webhook
+
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+        coalescer = LeadUpdateCoalescer(window=60)
+        monkeypatch.setattr("app.services.webhook_service.lead_update_coalescer", coalescer)
+        session_factory = sessionmaker(bind=db_engine)
+
+        item = enqueue_webhook(db_session, {"leads": {"update": [{"id": 1, "status_id": 3}]}})
+        WebhookQueueProcessor(session_factory=session_factory, partitioned=None).process_next()
+
+        db_session.expire_all()
+        assert db_session.get(WebhookQueueItem, item.id).status == "buffered"
+
+        coalescer.flush(session_factory, force=True)
+
+        db_session.expire_all()
+        assert db_session.get(WebhookQueueItem, item.id).status == "done"
+        assert db_session.query(Lead).one().status == "presentation"
+        assert coalescer.stats()["pending_sources"] == 0
+
+    def test_redelivered_coalesced_update_is_duplicate(self, db_session):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        coalescer = LeadUpdateCoalescer(window=0)
+        deduplicator = EventDeduplicator(use_redis=False)
+        v1 = {"id": 1, "name": "old", "updated_at": 1}
+
+        def deliver(events):
+            return WebhookService(db_session, deduplicator=deduplicator, coalescer=coalescer).process_payload(
+                {"account": {"id": "acc"}, "leads": {"update": events}}
+            )
+
+        deliver([v1, {"id": 1, "status_id": 3, "updated_at": 2}])
+        deliver([{"id": 1, "name": "new", "updated_at": 3}])
+        result = deliver([dict(v1)])
+
+        assert result["duplicates"] == 1
+        lead = db_session.query(Lead).one()
+        assert (lead.name, lead.status) == ("new", "presentation")
+
+    def test_window_flush_marks_buffered_updates(self, db_engine, db_session, monkeypatch):
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        coalescer = LeadUpdateCoalescer(window=60)
+        deduplicator = EventDeduplicator(use_redis=False)
+        # Запись буфера идет через глобальный дедупликатор
+        monkeypatch.setattr("app.services.webhook_service.webhook_deduplicator", deduplicator)
+        v1 = {"id": 1, "name": "old", "updated_at": 1}
+
+        WebhookService(db_session, coalescer=coalescer).process_payload(
+            {"account": {"id": "acc"}, "leads": {"update": [v1]}}
+        )
+        WebhookService(db_session, coalescer=coalescer).process_payload(
+            {"account": {"id": "acc"}, "leads": {"update": [{"id": 1, "status_id": 3, "updated_at": 2}]}}
+        )
+        # До записи буфера события не отмечены
+        assert deduplicator.filter_seen([event_key("acc", "leads.update", v1)]) == set()
+
+        assert coalescer.flush(sessionmaker(bind=db_engine), force=True) == 1
+
+        result = WebhookService(db_session, coalescer=coalescer).process_payload(
+            {"account": {"id": "acc"}, "leads": {"update": [dict(v1)]}}
+        )
+        assert (result["duplicates"], result["buffered"]) == (1, 0)
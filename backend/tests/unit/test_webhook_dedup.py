@@ -0,0 +1,120 @@
+"""
+Unit тесты для дедупликации webhook событий
+"""
+
+import time
+
+from app.core.cache import TTLCache
+from app.integrations.amo.dedup import EventDeduplicator, event_key
+from app.models.lead import Lead
+from app.services.webhook_service import WebhookService
+
+
+class TestTTLCache:
+    """Тесты для TTLCache"""
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+    def test_ttl_expiry(self):
+        cache = TTLCache(max_entries=10, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+
+class TestEventDeduplicator:
+    """Тесты для EventDeduplicator"""
+
+    def test_event_key(self):
+        key = event_key(1, "leads.update", {"id": 5, "updated_at": 100})
+        assert key.startswith("1:leads.update:5:100:")
+        assert key == event_key(1, "leads.update", {"updated_at": 100, "id": 5})
+        assert key != event_key(1, "leads.update", {"id": 5, "updated_at": 100, "status_id": 2})
+        assert event_key(1, "leads.update", {"id": 5, "last_modified": 100}).startswith("1:leads.update:5:100:")
+        assert event_key(1, "leads.update", {"id": 5}) is None
+        assert event_key(None, "leads.delete", {"id": 5}).startswith("-:leads.delete:5:-:")
+
+    def test_counters(self):
+        dedup = EventDeduplicator(max_entries=100, ttl=60, use_redis=False)
+        assert dedup.filter_seen(["a", "b"]) == set()
+        dedup.mark(["a"])
+        assert dedup.filter_seen(["a", "b"]) == {"a"}
+
+        stats = dedup.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 3
+
+    def test_redelivery_skips_database(self, db_session):
+        """Повторная доставка не затрагивает БД"""
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        dedup = EventDeduplicator(max_entries=100, ttl=60, use_redis=False)
+        body = {
+            "account": {"id": 42},
+            "leads": {"update": [{"id": 1, "status_id": 2, "updated_at": 1700000000}]}
+        }
+
+        first = WebhookService(db_session, deduplicator=dedup).process_payload(body)
+        assert first["processed"] == 1
+        assert first["duplicates"] == 0
+
+        lead = db_session.query(Lead).one()
+        lead.status = "new"
+        db_session.commit()
+
+        second = WebhookService(db_session, deduplicator=dedup).process_payload(body)
+        assert second["processed"] == 0
+        assert second["duplicates"] == 1
+        assert db_session.query(Lead).one().status == "new"
+
+    def test_rolled_back_payload_is_not_remembered(self, db_session, monkeypatch):
+        """События откатившейся транзакции не попадают в хранилище"""
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        dedup = EventDeduplicator(max_entries=100, ttl=60, use_redis=False)
+        body = {"leads": {"update": [{"id": 1, "status_id": 2, "updated_at": 1}]}}
+
+        def failing_commit():
+            raise RuntimeError("db down")
+
+        monkeypatch.setattr(db_session, "commit", failing_commit)
+        result = WebhookService(db_session, deduplicator=dedup).process_payload(body)
+
+        assert result["committed"] is False
+        assert len(dedup.local) == 0
+
+    def test_same_second_updates_are_not_duplicates(self, db_session):
+        """Разные правки лида в одну секунду не считаются повторной доставкой"""
+        db_session.add(Lead(name="A", phone="", amocrm_lead_id=1, status="new"))
+        db_session.commit()
+
+        dedup = EventDeduplicator(max_entries=100, ttl=60, use_redis=False)
+        first = {"leads": {"update": [{"id": 1, "status_id": 2, "updated_at": 1700000000}]}}
+        second = {"leads": {"update": [{"id": 1, "status_id": 3, "updated_at": 1700000000}]}}
+
+        WebhookService(db_session, deduplicator=dedup, coalescer=None).process_payload(first)
+        result = WebhookService(db_session, deduplicator=dedup, coalescer=None).process_payload(second)
+        assert result["duplicates"] == 0
+        assert db_session.query(Lead).one().status == "presentation"
+
+        # Обе правки в одном payload
+        db_session.query(Lead).one().status = "new"
+        db_session.commit()
+        both = {"leads": {"update": first["leads"]["update"] + second["leads"]["update"]}}
+        result = WebhookService(db_session, deduplicator=EventDeduplicator(100, 60, False),
+                                coalescer=None).process_payload(both)
+        assert result["duplicates"] == 0
+        assert db_session.query(Lead).one().status == "presentation"
@@ -0,0 +1,111 @@
+"""
+Unit тесты для партиционированной обработки webhook
+"""
+
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.db import Base
+from app.core.lanes import PartitionedExecutor, partition_for
+from app.models.lead import Lead
+from app.services.webhook_lanes import PartitionedWebhookProcessor, split_section
+
+
+@pytest.fixture
+def lanes():
+    executor = PartitionedExecutor(4, name="test-lane")
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def file_session_factory(tmp_path):
+    """Файловая SQLite: полосы пишут из разных потоков"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'lanes.db'}", connect_args={"timeout": 30})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+class TestPartitionedExecutor:
+    """Тесты для PartitionedExecutor"""
+
+    def test_same_key_runs_in_submission_order(self, lanes):
+        order = []
+        lock = threading.Lock()
+
+        def task(key, index):
+            time.sleep(0.001 * ((index * 7) % 3))
+            with lock:
+                order.append((key, index))
+
+        futures = [lanes.submit(key, task, key, index) for index in range(30) for key in ("a", "b", "c")]
+        for future in futures:
+            future.result()
+
+        for key in ("a", "b", "c"):
+            assert [index for k, index in order if k == key] == list(range(30))
+        assert partition_for(("acc", 1), 4) == partition_for(("acc", 1), 4)
+
+    def test_split_section_keeps_lead_events_together(self, lanes):
+        body = {"account": {"id": 1}, "leads": {
+            "add": [{"id": i} for i in range(10)],
+            "update": [{"id": i, "status_id": 2} for i in range(10)]
+        }}
+
+        parts = split_section(body, "leads", lanes, "lead")
+
+        assert sum(len(part["leads"]["add"]) for part in parts.values()) == 10
+        for lane, part in parts.items():
+            ids = {event["id"] for event in part["leads"]["add"]}
+            assert ids == {event["id"] for event in part["leads"]["update"]}
+            assert all(lanes.lane_for((1, "lead", i)) == lane for i in ids)
+
+
+class TestPartitionedWebhookProcessor:
+    """Тесты для PartitionedWebhookProcessor"""
+
+    def test_updates_to_same_lead_are_not_reordered(self, lanes, file_session_factory):
+        db = file_session_factory()
+        db.add_all([Lead(name=f"Lead {i}", phone="", amocrm_lead_id=i, status="new") for i in range(1, 21)])
+        db.commit()
+        db.close()
+
+        processor = PartitionedWebhookProcessor(lanes, session_factory=file_session_factory)
+        pending = [
+            processor.submit({"account": {"id": "acc"}, "leads": {
+                "update": [{"id": lead_id, "status_id": status_id} for lead_id in range(1, 21)]
+            }})
+            for status_id in (2, 3, 4, 5, 6)
+        ]
+        results = [item.result() for item in pending]
+
+        assert all(result["committed"] and result["processed"] == 20 for result in results)
+        db = file_session_factory()
+        assert {lead.status for lead in db.query(Lead).all()} == {"deal"}
+        db.close()
+
+    def test_contacts_run_after_leads_of_same_payload(self, lanes, file_session_factory):
+        processor = PartitionedWebhookProcessor(lanes, session_factory=file_session_factory)
+
+        result = processor.process({
+            "account": {"id": "acc"},
+            "leads": {"add": [
+                {"id": i, "name": "Новый", "_embedded": {"contacts": [{"id": 100 + i}]}} for i in range(1, 9)
+            ]},
+            "contacts": {"add": [
+                {"id": 100 + i, "custom_fields_values": [{"field_id": 123456, "values": [{"value": f"+7{i}"}]}]}
+                for i in range(1, 9)
+            ]}
+        })
+
+        assert result["committed"] is True
+        assert result["processed"] == 16
+        assert result["rows_affected"] == 8
+        db = file_session_factory()
+        assert {lead.phone for lead in db.query(Lead).all()} == {f"+7{i}" for i in range(1, 9)}
+        db.close()
@@ -0,0 +1,82 @@
+"""
+Unit тесты для очереди webhook и фоновых воркеров
+"""
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.models.lead import Lead
+from app.models.webhook_queue import WebhookQueueItem
+from app.services import webhook_queue
+from app.services.webhook_queue import (
+    enqueue_webhook,
+    WebhookQueueProcessor,
+    WebhookWorkerPool
+)
+
+
+@pytest.fixture
+def session_factory(db_engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+
+def _payload(lead_id):
+    return {"leads": {"add": [{"id": lead_id, "name": f"Lead {lead_id}", "status_id": 1}]}}
+
+
+class TestWebhookQueue:
+    """Тесты для очереди webhook"""
+
+    def test_process_pending(self, db_session, session_factory):
+        """Задачи из очереди обрабатываются через WebhookService"""
+        enqueue_webhook(db_session, _payload(1), "acc-1")
+        enqueue_webhook(db_session, _payload(2), "acc-1")
+
+        processor = WebhookQueueProcessor(session_factory=session_factory)
+        assert processor.process_pending() == 2
+        assert processor.process_next() is False
+
+        db_session.expire_all()
+        assert db_session.query(Lead).count() == 2
+        statuses = {item.status for item in db_session.query(WebhookQueueItem).all()}
+        assert statuses == {"done"}
+
+    def test_failed_transaction_is_retried(self, db_session, session_factory, monkeypatch):
+        """Откат транзакции возвращает задачу в очередь, затем помечает failed"""
+        enqueue_webhook(db_session, _payload(1))
+
+        def failing_process(self, body, source=None):
+            return {"processed": 0, "errors": ["db down"], "committed": False}
+
+        monkeypatch.setattr(webhook_queue.WebhookService, "process_payload", failing_process)
+        processor = WebhookQueueProcessor(session_factory=session_factory, max_attempts=2)
+
+        processor.process_next()
+        db_session.expire_all()
+        item = db_session.query(WebhookQueueItem).one()
+        assert item.status == "pending"
+        assert item.last_error == "db down"
+
+        processor.process_next()
+        db_session.expire_all()
+        assert db_session.query(WebhookQueueItem).one().status == "failed"
+        assert processor.process_next() is False
+
+    @pytest.mark.asyncio
+    async def test_pool_drains_queue_on_stop(self, db_session, session_factory):
+        """Остановка пула дообрабатывает очередь"""
+        for lead_id in range(1, 6):
+            enqueue_webhook(db_session, _payload(lead_id))
+
+        pool = WebhookWorkerPool(
+            processor=WebhookQueueProcessor(session_factory=session_factory),
+            workers=1,
+            poll_interval=0.01
+        )
+        pool.start()
+        pool.notify()
+        await pool.stop(drain_timeout=5)
+
+        db_session.expire_all()
+        assert db_session.query(Lead).count() == 5
+        assert db_session.query(WebhookQueueItem).filter(WebhookQueueItem.status != "done").count() == 0
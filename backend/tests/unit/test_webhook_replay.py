@@ -0,0 +1,136 @@
+"""
+Unit тесты для записи и воспроизведения webhook трафика
+"""
+
+import pytest
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.integrations.amo.capture import WebhookRecorder, read_archive, sanitize_payload
+from app.integrations.amo.replay import (
+    StatementCounter, percentile, rate_limit_disabled, replay_records, setup_replay_database, synthetic_records
+)
+from app.models.lead import Lead
+
+
+class TestWebhookCapture:
+    """Тесты для WebhookRecorder"""
+
+    def test_sanitize_masks_pii_and_keeps_shape(self):
+        body = synthetic_records(1)[0]["body"]
+
+        sanitized = sanitize_payload(body)
+
+        lead = sanitized["leads"]["add"][0]
+        contact = sanitized["contacts"]["add"][0]
+        assert lead["name"].startswith("masked-")
+        assert lead["custom_fields_values"] == body["leads"]["add"][0]["custom_fields_values"]
+        assert all(
+            field["values"][0]["value"].startswith("masked-")
+            for field in contact["custom_fields_values"]
+        )
+        assert sanitize_payload(body) == sanitized
+        assert body["contacts"]["add"][0]["name"] != contact["name"]
+
+    def test_archive_appends_across_recorders(self, tmp_path):
+        path = tmp_path / "capture.jsonl.gz"
+        headers = {"x-account-id": "acc", "x-webhook-signature": "secret", "content-type": "application/json"}
+
+        for index in range(2):
+            recorder = WebhookRecorder(str(path))
+            recorder.record({"leads": {"delete": [{"id": index}]}}, headers, timestamp=index)
+            recorder.close()
+
+        records = list(read_archive(str(path)))
+        assert [record["ts"] for record in records] == [0, 1]
+        assert records[0]["headers"] == {"x-account-id": "acc", "content-type": "application/json"}
+
+    def test_submit_writes_in_background_and_drops_on_overflow(self, tmp_path, monkeypatch):
+        import json
+        import threading
+
+        from app.integrations.amo import capture
+
+        path = tmp_path / "capture.jsonl.gz"
+        recorder = WebhookRecorder(str(path), queue_size=2)
+        writer_threads = []
+        release = threading.Event()
+        sanitize = capture.sanitize_payload
+
+        def slow_sanitize(body):
+            writer_threads.append(threading.get_ident())
+            release.wait(5)
+            return sanitize(body)
+
+        monkeypatch.setattr(capture, "sanitize_payload", slow_sanitize)
+        for index in range(5):
+            recorder.submit(json.dumps({"leads": {"delete": [{"id": index}]}}).encode(), {"x-account-id": "acc"})
+        # Поток записи занят первым payload: в очереди два, остальные отброшены
+        assert recorder.dropped >= 2
+        release.set()
+        recorder.close()
+
+        records = list(read_archive(str(path)))
+        assert len(records) == recorder.recorded == 5 - recorder.dropped
+        assert records[0]["headers"] == {"x-account-id": "acc"}
+        assert writer_threads and threading.get_ident() not in writer_threads
+
+
+class TestWebhookReplay:
+    """Тесты для воспроизведения архива через ASGI транспорт"""
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        assert percentile(values, 50) == 50.0
+        assert percentile(values, 99) == 99.0
+        assert percentile([], 95) == 0.0
+
+    @pytest.mark.asyncio
+    async def test_replay_reports_throughput(self, monkeypatch):
+        from app.main import app
+
+        monkeypatch.setattr(settings, "amocrm_webhook_secret", "replay-secret")
+        monkeypatch.setattr(settings, "webhook_async_mode", False)
+        database = await setup_replay_database(app)
+        try:
+            with StatementCounter(database.sync_engine) as counter, rate_limit_disabled():
+                report = await replay_records(synthetic_records(20), app, statement_counter=counter)
+            async with database.engine.connect() as conn:
+                leads_count = (await conn.execute(select(func.count(Lead.id)))).scalar()
+        finally:
+            await database.close(app)
+
+        assert report["requests"] == 20
+        assert report["status_counts"] == {200: 20}
+        assert report["events"] > 20
+        assert report["statements_per_event"] > 0
+        assert set(report["latency_ms"]) == {"p50", "p95", "p99"}
+        assert leads_count > 0
+
+    @pytest.mark.asyncio
+    async def test_replay_with_lanes_writes_to_replay_database(self, tmp_path, monkeypatch):
+        from app.main import app
+        from app.services.webhook_lanes import shutdown_partitioned_processor
+
+        monkeypatch.setattr(settings, "amocrm_webhook_secret", "replay-secret")
+        monkeypatch.setattr(settings, "webhook_async_mode", False)
+        monkeypatch.setattr(settings, "webhook_lanes", 2)
+        try:
+            # In-memory БД не допускает параллельной записи полос
+            with pytest.raises(ValueError):
+                await setup_replay_database(app)
+
+            database = await setup_replay_database(app, f"sqlite:///{tmp_path / 'replay.db'}")
+            try:
+                with StatementCounter(database.sync_engine) as counter, rate_limit_disabled():
+                    report = await replay_records(synthetic_records(10), app, statement_counter=counter)
+                with database.session_factory() as db:
+                    leads_count = db.scalar(select(func.count(Lead.id)))
+            finally:
+                await database.close(app)
+        finally:
+            shutdown_partitioned_processor()
+
+        assert report["status_counts"] == {200: 10}
+        assert report["statements_per_event"] > 0
+        assert leads_count > 0
@@ -0,0 +1,144 @@
+"""
+Unit тесты для пакетной обработки webhook amoCRM
+"""
+
+from sqlalchemy import event
+
+from app.models.lead import Lead
+from app.services.webhook_service import WebhookService
+
+
+def _lead(amocrm_lead_id, contact_id=None, status="new"):
+    return Lead(
+        name=f"Lead {amocrm_lead_id}",
+        phone="",
+        email="",
+        amocrm_lead_id=amocrm_lead_id,
+        amocrm_contact_id=contact_id,
+        status=status
+    )
+
+
+class TestWebhookService:
+    """Тесты для WebhookService"""
+
+    def test_batch_uses_single_lookup_and_commit(self, db_session, statements):
+        """Весь payload обрабатывается одним запросом на секцию и одним commit"""
+        db_session.add_all([_lead(i) for i in range(1, 101)])
+        db_session.commit()
+        statements.clear()
+
+        commits = []
+        event.listen(db_session, "after_commit", lambda session: commits.append(1))
+
+        body = {
+            "leads": {
+                "update": [{"id": i, "status_id": 2} for i in range(1, 101)]
+            }
+        }
+        result = WebhookService(db_session).process_payload(body)
+
+        assert result == {"processed": 100, "errors": [], "committed": True, "duplicates": 0, "rows_affected": 0,
+                          "buffered": 0}
+        assert len(commits) == 1
+        selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+        assert len(selects) == 1
+        assert db_session.query(Lead).filter(Lead.status == "contacted").count() == 100
+
+    def test_add_update_delete_in_one_payload(self, db_session):
+        """Новые, обновленные и удаленные лиды в одном payload"""
+        db_session.add(_lead(2))
+        db_session.commit()
+
+        body = {
+            "leads": {
+                "add": [
+                    {
+                        "id": 1,
+                        "name": "Новый",
+                        "status_id": 1,
+                        "created_at": 1700000000,
+                        "custom_fields_values": [
+                            {"field_id": 123458, "values": [{"value": "google"}]}
+                        ],
+                        "_embedded": {"contacts": [{"id": 77}]}
+                    }
+                ],
+                "update": [{"id": 1, "status_id": 3}],
+                "delete": [{"id": 2}]
+            },
+            "contacts": {
+                "update": [
+                    {
+                        "id": 77,
+                        "name": "Иван",
+                        "custom_fields_values": [
+                            {"field_id": 123456, "values": [{"value": "+79990000000"}]},
+                            {"field_id": 123457, "values": [{"value": "ivan@example.com"}]}
+                        ]
+                    }
+                ]
+            }
+        }
+        result = WebhookService(db_session).process_payload(body)
+
+        assert result["processed"] == 4
+        assert result["errors"] == []
+
+        new_lead = db_session.query(Lead).filter(Lead.amocrm_lead_id == 1).one()
+        assert new_lead.status == "presentation"
+        assert new_lead.utm_source == "google"
+        assert new_lead.name == "Иван"
+        assert new_lead.phone == "+79990000000"
+        assert new_lead.email == "ivan@example.com"
+        assert db_session.query(Lead).filter(Lead.amocrm_lead_id == 2).one().status == "deleted"
+
+    def test_per_event_errors_are_reported(self, db_session):
+        """Ошибка в одном событии не мешает остальным"""
+        db_session.add(_lead(1))
+        db_session.commit()
+
+        body = {"leads": {"update": [{"status_id": 2}, {"id": 1, "status_id": 2}]}}
+        result = WebhookService(db_session).process_payload(body)
+
+        assert result["processed"] == 1
+        assert len(result["errors"]) == 1
+        assert "Lead ID is required" in result["errors"][0]
+        assert db_session.query(Lead).one().status == "contacted"
+
+    def test_duplicate_add_is_ignored(self, db_session):
+        """Повторная доставка leads.add не создает дубликат"""
+        body = {"leads": {"add": [{"id": 5, "name": "A"}, {"id": 5, "name": "A"}]}}
+        WebhookService(db_session).process_payload(body)
+        WebhookService(db_session).process_payload(body)
+
+        assert db_session.query(Lead).count() == 1
+
+    def test_contacts_use_set_based_update(self, db_session, statements):
+        """Контакты переносятся на лиды одним UPDATE без загрузки лидов"""
+        db_session.add_all([_lead(i, contact_id=i % 3 + 1) for i in range(1, 31)])
+        db_session.commit()
+        statements.clear()
+
+        body = {
+            "contacts": {
+                "add": [{"id": 1, "name": "Анна"}],
+                "update": [
+                    {"id": 2, "custom_fields_values": [{"field_id": 123456, "values": [{"value": "+7111"}]}]},
+                    {"id": 1, "custom_fields_values": [{"field_id": 123457, "values": [{"value": "a@x.ru"}]}]},
+                    {"id": 99, "name": "Без лидов"}
+                ]
+            }
+        }
+        result = WebhookService(db_session).process_payload(body)
+
+        assert result["processed"] == 4
+        assert result["rows_affected"] == 20
+        executed = [s.lstrip().upper() for s in statements]
+        assert not [s for s in executed if s.startswith("SELECT")]
+        assert len([s for s in executed if s.startswith("UPDATE")]) == 1
+
+        anna = db_session.query(Lead).filter(Lead.amocrm_contact_id == 1).all()
+        assert {(lead.name, lead.email, lead.phone) for lead in anna} == {("Анна", "a@x.ru", "")}
+        other = db_session.query(Lead).filter(Lead.amocrm_contact_id == 2).all()
+        assert {(lead.name.startswith("Lead"), lead.phone) for lead in other} == {(True, "+7111")}